@@ -0,0 +1,166 @@
+"""
+Admin dashboard statistics for the Pixel Plaza Token game.
+All totals are aggregated in the database. The result is kept as a
+short-lived snapshot shared by the admin page and its polling endpoint.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, and_
+
+from app import db
+from models import User, GameState, Transaction
+from config import ADMIN_STATS_TTL_SECONDS, ADMIN_STATS_GROWTH_WEEKS, ADMIN_STATS_ACTIVITY_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Chart categories and the transaction types they cover
+TOKEN_SOURCES = [
+    ('Mining', ('mining', 'mine')),
+    ('Art Creation', ('pixel_art',)),
+    ('Buildings', ('building_income',)),
+    ('Task Rewards', ('task_reward',)),
+    ('Referrals', ('referral_bonus',))
+]
+
+ACTIVITY_TYPES = [
+    ('Mining', ('mining', 'mine')),
+    ('Art Creation', ('pixel_art',)),
+    ('Building', ('building_purchase',)),
+    ('Collection', ('building_income',)),
+    ('Market Trading', ('market_buy', 'market_sell'))
+]
+
+_snapshot = None
+_snapshot_expires = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _player_totals(today_start):
+    """One aggregate query over users and their game states."""
+    has_wallet = and_(User.wallet_address.isnot(None), User.wallet_address != '')
+    row = db.session.query(
+        func.count(User.id),
+        _count_if(has_wallet),
+        func.coalesce(func.sum(GameState.token_balance), 0),
+        func.coalesce(func.sum(GameState.pixels), 0),
+        func.coalesce(func.sum(GameState.energy), 0),
+        func.coalesce(func.sum(GameState.materials), 0),
+        func.coalesce(func.sum(GameState.gems), 0),
+        func.coalesce(func.sum(GameState.buildings_owned), 0),
+        func.coalesce(func.sum(GameState.pixel_art_created), 0),
+        _count_if(GameState.last_active >= today_start),
+        _count_if(GameState.level >= 5),
+        _count_if(GameState.buildings_owned > 0),
+        _count_if(GameState.pixel_art_created > 0),
+        _count_if(and_(
+            GameState.level >= 5,
+            GameState.buildings_owned > 0,
+            GameState.pixel_art_created > 0,
+            has_wallet
+        ))
+    ).join(
+        GameState, User.id == GameState.user_id
+    ).one()
+
+    keys = [
+        'total_users', 'users_with_wallet', 'total_tokens', 'total_pixels', 'total_energy',
+        'total_materials', 'total_gems', 'total_buildings', 'total_art_created', 'active_today',
+        'users_level_5', 'users_with_buildings', 'users_with_pixel_art', 'eligible_users'
+    ]
+    stats = {key: int(value or 0) for key, value in zip(keys, row)}
+    stats['total_tokens'] = float(row[2] or 0)
+    return stats
+
+
+def _user_growth(today_start):
+    """New registrations per week, oldest week first; the last week ends today."""
+    tomorrow_start = today_start + timedelta(days=1)
+    week_starts = [tomorrow_start - timedelta(weeks=week) for week in range(ADMIN_STATS_GROWTH_WEEKS, 0, -1)]
+    columns = []
+    for week_start in week_starts:
+        week_end = week_start + timedelta(weeks=1)
+        columns.append(_count_if(and_(
+            User.registration_date >= week_start,
+            User.registration_date < week_end
+        )))
+    counts = db.session.query(*columns).filter(
+        User.registration_date >= week_starts[0]
+    ).one()
+    labels = [week_start.strftime('%b %d') for week_start in week_starts]
+    return labels, [int(count or 0) for count in counts]
+
+
+def _transaction_breakdown(since):
+    """Token totals and activity counts per transaction type since a point in time."""
+    rows = db.session.query(
+        Transaction.type,
+        func.count(Transaction.id),
+        func.coalesce(func.sum(case((Transaction.amount > 0, Transaction.amount), else_=0)), 0)
+    ).filter(
+        Transaction.timestamp >= since
+    ).group_by(
+        Transaction.type
+    ).all()
+    counts = {tx_type: int(count) for tx_type, count, _ in rows}
+    earned = {tx_type: amount for tx_type, _, amount in rows}
+
+    token_distribution = [round(float(sum(earned.get(t, 0) for t in types)), 2) for _, types in TOKEN_SOURCES]
+    activity_breakdown = [sum(counts.get(t, 0) for t in types) for _, types in ACTIVITY_TYPES]
+    return token_distribution, activity_breakdown
+
+
+def compute_dashboard_stats():
+    """
+    Compute the admin dashboard statistics in the database.
+
+    Returns:
+        dict with the player totals, airdrop eligibility counts and chart series
+    """
+    now = datetime.utcnow()
+    today_start = datetime(now.year, now.month, now.day)
+
+    stats = _player_totals(today_start)
+    labels, growth = _user_growth(today_start)
+    token_distribution, activity_breakdown = _transaction_breakdown(
+        now - timedelta(days=ADMIN_STATS_ACTIVITY_DAYS)
+    )
+
+    stats.update({
+        'userGrowthLabels': labels,
+        'userGrowth': growth,
+        'tokenDistributionLabels': [label for label, _ in TOKEN_SOURCES],
+        'tokenDistribution': token_distribution,
+        'activityBreakdownLabels': [label for label, _ in ACTIVITY_TYPES],
+        'activityBreakdown': activity_breakdown,
+        'generated_at': now.isoformat()
+    })
+    return stats
+
+
+def get_dashboard_stats(force_refresh=False):
+    """
+    Get the cached dashboard statistics, recomputing them when the snapshot is stale.
+
+    Args:
+        force_refresh: Recompute even if the snapshot is still fresh
+
+    Returns:
+        dict as returned by compute_dashboard_stats
+    """
+    global _snapshot, _snapshot_expires
+
+    with _snapshot_lock:
+        if not force_refresh and _snapshot is not None and time.monotonic() < _snapshot_expires:
+            return _snapshot
+
+        snapshot = compute_dashboard_stats()
+        _snapshot = snapshot
+        _snapshot_expires = time.monotonic() + ADMIN_STATS_TTL_SECONDS
+        return snapshot
@@ -13,11 +13,13 @@ logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s %(levelname)s %(name)s: %(message)s'
 )
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 import csv
+import zlib
 from io import StringIO
 from datetime import datetime
 
@@ -43,17 +45,43 @@ db.init_app(app)
 
 with app.app_context():
     # Import models after db initialization to avoid circular imports
-    from models import User, GameState, Transaction, Task, UserTask
-    db.create_all()
+    from models import User, GameState, Transaction, Task, UserTask, game_state_hot_table
+
+    # Until migrate_game_state_split.py has run, the balances still live on game_state.
+    # Creating an empty game_state_hot would hide every existing player behind the
+    # GameState join, so leave it to the migration and refuse to serve (see main.py).
+    inspector = inspect(db.engine)
+    GAME_STATE_SPLIT_PENDING = 'game_state' in inspector.get_table_names() and 'token_balance' in {
+        col['name'] for col in inspector.get_columns('game_state')
+    }
+    if GAME_STATE_SPLIT_PENDING:
+        logging.error("game_state has not been split yet, run migrate_game_state_split.py")
+        db.metadata.create_all(db.engine, tables=[
+            table for table in db.metadata.sorted_tables if table is not game_state_hot_table
+        ])
+    else:
+        db.create_all()
 
 # Import game mechanics and utilities after models
-from game_mechanics import GameMechanics
+from game_mechanics import GameMechanics, parse_action_params
 from mini_games import MiniGames
+from puzzle_pool import puzzle_pool
 from utils import (
     generate_referral_code, process_referral, initialize_tasks, 
     assign_tasks_to_user, update_task_progress, get_user_tasks
 )
-from config import REFERRER_LEVEL_REQUIREMENT, TELEGRAM_BOT_TOKEN, TELEGRAM_BOT_USERNAME
+from player_context import load_player_context
+from leaderboard import leaderboard as token_leaderboard
+from admin_stats import get_dashboard_stats
+from market import MARKET_RESOURCES, MarketConflict
+from market_candles import CANDLE_PERIODS, get_candles
+from resource_updates import apply_resources
+from optimistic_retry import run_with_retry, retry_stats
+from config import (
+    REFERRER_LEVEL_REQUIREMENT, TELEGRAM_BOT_TOKEN, TELEGRAM_BOT_USERNAME,
+    GAME_ACTION_BATCH_MAX, GAME_ACTION_BATCHABLE, ADMIN_USERS_PAGE_SIZE,
+    CSV_EXPORT_BATCH_SIZE, MARKET_CANDLES_MAX
+)
 
 # Development mode flag - set to True to bypass Telegram login requirement
 DEV_MODE = True
@@ -89,12 +117,12 @@ def dashboard():
         return redirect(url_for('index'))
     
     # Get user data
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id)
+    if not ctx:
         flash('User not found. Please register through the Telegram bot', 'danger')
         return redirect(url_for('index'))
     
-    game_state = GameState.query.filter_by(user_id=user.id).first()
+    user, game_state = ctx.user, ctx.game_state
     if not game_state:
         flash('Game state not found', 'danger')
         return redirect(url_for('index'))
@@ -245,9 +273,9 @@ def web_game():
         
         # For existing Telegram users
         if telegram_id:
-            user = User.query.filter_by(telegram_id=telegram_id).first()
-            if user:
-                game_state = GameState.query.filter_by(user_id=user.id).first()
+            ctx = load_player_context(telegram_id, with_tasks=True)
+            if ctx:
+                user, game_state = ctx.user, ctx.game_state
                 if game_state:
                     # Get recent transactions
                     transactions = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.timestamp.desc()).limit(5).all()
@@ -260,8 +288,10 @@ def web_game():
                     
                     # Check if user has a referral code
                     if not user.referral_code and game_state.level >= REFERRER_LEVEL_REQUIREMENT:
-                        user.referral_code = generate_referral_code()
-                        db.session.commit()
+                        user.referral_code = generate_referral_code(user.id)
+                    
+                    # Commit the page visit's task updates in one go
+                    db.session.commit()
                     
                     logging.debug(f"Rendering web_game with user: {user.username}")
                     return render_template(
@@ -347,6 +377,7 @@ def dev_game_access():
         game_state = GameState.query.filter_by(user_id=dev_user.id).first()
         transactions = Transaction.query.filter_by(user_id=dev_user.id).order_by(Transaction.timestamp.desc()).limit(10).all()
         user_tasks = get_user_tasks(dev_user.id)
+        db.session.commit()
         
         logging.debug(f"Rendering dev game access with user: {dev_user.username}")
         return render_template(
@@ -372,13 +403,15 @@ def tasks():
         flash('Please access this page through the game', 'danger')
         return redirect(url_for('index'))
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id, with_tasks=True)
+    if not ctx:
         flash('User not found', 'danger')
         return redirect(url_for('index'))
+    user = ctx.user
     
     # Get user tasks
     user_tasks = get_user_tasks(user.id)
+    db.session.commit()
     
     # Group tasks by type
     one_time_tasks = []
@@ -409,19 +442,19 @@ def referrals():
         flash('Please access this page through the game', 'danger')
         return redirect(url_for('index'))
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id)
+    if not ctx:
         flash('User not found', 'danger')
         return redirect(url_for('index'))
     
-    game_state = GameState.query.filter_by(user_id=user.id).first()
+    user, game_state = ctx.user, ctx.game_state
     if not game_state:
         flash('Game state not found', 'danger')
         return redirect(url_for('index'))
     
     # Generate referral code if user doesn't have one but meets level requirement
     if not user.referral_code and game_state.level >= REFERRER_LEVEL_REQUIREMENT:
-        user.referral_code = generate_referral_code()
+        user.referral_code = generate_referral_code(user.id)
         db.session.commit()
     
     # Get referred users
@@ -438,15 +471,22 @@ def referrals():
 @app.route('/leaderboard')
 def leaderboard():
     # Get top 20 users by token balance
-    top_users = db.session.query(
-        User, GameState
-    ).join(
-        GameState, User.id == GameState.user_id
-    ).order_by(
-        GameState.token_balance.desc()
-    ).limit(20).all()
+    top_users = token_leaderboard.top_players(20)
     
-    return render_template('leaderboard.html', top_users=top_users)
+    # Optional rank of the player viewing the page
+    player_rank = None
+    telegram_id = request.args.get('id')
+    if telegram_id:
+        ctx = load_player_context(telegram_id)
+        if ctx:
+            player_rank = token_leaderboard.rank(ctx.user.id)
+    
+    return render_template(
+        'leaderboard.html',
+        top_users=top_users,
+        player_rank=player_rank,
+        total_players=token_leaderboard.size()
+    )
 
 @app.route('/admin', methods=['GET', 'POST'])
 def admin():
@@ -466,20 +506,22 @@ def admin():
     
     # Initialize default values in case of database issues
     users = []
-    total_users = 0
-    users_with_wallet = 0
-    total_tokens = 0
-    total_pixels = 0
-    total_energy = 0
-    total_materials = 0
-    total_gems = 0
-    total_buildings = 0
-    total_art_created = 0
-    active_today = 0
-    users_level_5 = 0
-    users_with_buildings = 0
-    users_with_pixel_art = 0
-    eligible_users = 0
+    stats = {
+        'total_users': 0,
+        'users_with_wallet': 0,
+        'total_tokens': 0,
+        'total_pixels': 0,
+        'total_energy': 0,
+        'total_materials': 0,
+        'total_gems': 0,
+        'total_buildings': 0,
+        'total_art_created': 0,
+        'active_today': 0,
+        'users_level_5': 0,
+        'users_with_buildings': 0,
+        'users_with_pixel_art': 0,
+        'eligible_users': 0
+    }
     active_tasks = 8  # Default value for content management stats
     
     # Sample announcements list for the template
@@ -493,73 +535,21 @@ def admin():
     help_articles = 5
     
     try:
-        # Get all users with their game states
-        from sqlalchemy import text
-        db.session.execute(text("SELECT 1"))  # Test connection query
-        
-        users = db.session.query(
-            User, GameState
-        ).join(
-            GameState, User.id == GameState.user_id
-        ).order_by(
-            GameState.token_balance.desc()
-        ).all()
-        
-        # Calculate stats for the admin dashboard
-        from datetime import datetime, timedelta
-        
-        # User stats
-        total_users = len(users)
-        users_with_wallet = sum(1 for user, _ in users if user.wallet_address)
-        
-        # Game economy stats
-        total_tokens = sum(gs.token_balance for _, gs in users) if users else 0
-        total_pixels = sum(gs.pixels for _, gs in users) if users else 0
-        total_energy = sum(gs.energy for _, gs in users) if users else 0
-        total_materials = sum(gs.materials for _, gs in users) if users else 0
-        total_gems = sum(gs.gems for _, gs in users) if users else 0
-        total_buildings = sum(gs.buildings_owned for _, gs in users) if users else 0
-        total_art_created = sum(gs.pixel_art_created for _, gs in users) if users else 0
-        
-        # Active users counts
-        today = datetime.utcnow().date()
-        active_today = 0
-        for _, gs in users:
-            if gs.last_active and gs.last_active.date() == today:
-                active_today += 1
-                
-        # Airdrop eligibility stats
-        users_level_5 = sum(1 for _, gs in users if gs.level >= 5)
-        users_with_buildings = sum(1 for _, gs in users if gs.buildings_owned > 0)
-        users_with_pixel_art = sum(1 for _, gs in users if gs.pixel_art_created > 0)
-        eligible_users = sum(1 for user, gs in users 
-                             if gs.level >= 5 
-                             and gs.buildings_owned > 0 
-                             and gs.pixel_art_created > 0 
-                             and user.wallet_address)
+        # Totals and eligibility counts are aggregated in the database
+        stats = get_dashboard_stats()
+        
+        # Only the richest players are listed in the user table
+        users = token_leaderboard.top_players(ADMIN_USERS_PAGE_SIZE)
     except Exception as e:
         # Log the error but continue rendering the template with default values
-        print(f"Database error in admin panel: {e}")
+        logging.error(f"Database error in admin panel: {e}")
         flash("There was an issue connecting to the database. Some statistics may not be available.", "warning")
     
     return render_template(
         'admin.html', 
         authenticated=True, 
         users=users,
-        total_users=total_users,
-        users_with_wallet=users_with_wallet,
-        active_today=active_today,
-        total_tokens=total_tokens,
-        total_pixels=total_pixels,
-        total_energy=total_energy,
-        total_materials=total_materials,
-        total_gems=total_gems,
-        total_buildings=total_buildings,
-        total_art_created=total_art_created,
-        users_level_5=users_level_5,
-        users_with_buildings=users_with_buildings,
-        users_with_pixel_art=users_with_pixel_art,
-        eligible_users=eligible_users,
+        **stats,
         active_tasks=active_tasks,
         announcements=announcements,
         active_events=active_events,
@@ -567,131 +557,370 @@ def admin():
         telegram_bot_username=os.environ.get('TELEGRAM_BOT_USERNAME', 'PixelPlazaTokenBot')
     )
 
+@app.route('/api/admin/dashboard-stats')
+def admin_dashboard_stats():
+    """Serve the admin dashboard statistics polled by the admin page."""
+    if not session.get('admin'):
+        return jsonify({'success': False, 'message': 'Admin authentication required'}), 403
+    
+    try:
+        stats = get_dashboard_stats()
+        # Pool and retry counters are per process and always current, so they bypass the snapshot
+        return jsonify({
+            'success': True,
+            **stats,
+            'puzzle_pools': puzzle_pool.stats(),
+            'optimistic_retries': retry_stats.snapshot()
+        })
+    except Exception as e:
+        logging.error(f"Error computing dashboard stats: {str(e)}")
+        return jsonify({'success': False, 'message': 'Statistics are temporarily unavailable'}), 500
+
 @app.route('/export_csv')
 def export_csv():
     if not session.get('admin'):
         flash('Admin authentication required', 'danger')
         return redirect(url_for('admin'))
     
-    # Create CSV file
-    si = StringIO()
-    csv_writer = csv.writer(si)
-    
-    # Write headers
-    csv_writer.writerow(['Username', 'Telegram ID', 'Wallet Address', 'Token Balance', 'Last Active'])
+    use_gzip = request.args.get('gzip') in ('1', 'true', 'yes')
     
-    # Get all eligible users (with wallet address filled)
-    users = db.session.query(
-        User, GameState
+    # Only the exported columns are selected; yield_per streams them from a
+    # server-side cursor in batches instead of loading every row
+    rows = db.session.query(
+        User.username,
+        User.telegram_id,
+        User.wallet_address,
+        GameState.token_balance,
+        GameState.last_active
     ).join(
         GameState, User.id == GameState.user_id
     ).filter(
         User.wallet_address.isnot(None)
     ).order_by(
         GameState.token_balance.desc()
-    ).all()
-    
-    # Write user data
-    for user, game_state in users:
-        csv_writer.writerow([
-            user.username, 
-            user.telegram_id, 
-            user.wallet_address, 
-            game_state.token_balance,
-            game_state.last_active.strftime('%Y-%m-%d %H:%M:%S') if game_state.last_active else 'Never'
-        ])
+    ).execution_options(
+        yield_per=CSV_EXPORT_BATCH_SIZE
+    )
     
-    output = si.getvalue()
+    def generate_csv():
+        si = StringIO()
+        csv_writer = csv.writer(si)
+        
+        def take_chunk():
+            chunk = si.getvalue()
+            si.seek(0)
+            si.truncate(0)
+            return chunk
+        
+        # Write headers
+        csv_writer.writerow(['Username', 'Telegram ID', 'Wallet Address', 'Token Balance', 'Last Active'])
+        yield take_chunk()
+        
+        # Write user data one batch at a time
+        pending = 0
+        for username, telegram_id, wallet_address, token_balance, last_active in rows:
+            csv_writer.writerow([
+                username,
+                telegram_id,
+                wallet_address,
+                token_balance,
+                last_active.strftime('%Y-%m-%d %H:%M:%S') if last_active else 'Never'
+            ])
+            pending += 1
+            if pending >= CSV_EXPORT_BATCH_SIZE:
+                pending = 0
+                yield take_chunk()
+        
+        if pending:
+            yield take_chunk()
+    
+    def generate_gzip():
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in generate_csv():
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    filename = f"pixel_plaza_airdrop_{datetime.now().strftime('%Y%m%d')}.csv"
+    if use_gzip:
+        return app.response_class(
+            stream_with_context(generate_gzip()),
+            mimetype='application/gzip',
+            headers={"Content-Disposition": f"attachment;filename={filename}.gz"}
+        )
     
     return app.response_class(
-        output,
+        stream_with_context(generate_csv()),
         mimetype='text/csv',
-        headers={"Content-Disposition": f"attachment;filename=pixel_plaza_airdrop_{datetime.now().strftime('%Y%m%d')}.csv"}
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
     )
 
+# Task objective advanced by each successful game action
+ACTION_TASK_OBJECTIVES = {
+    'mine': 'mining',
+    'create': 'pixel_art',
+    'build': 'building'
+}
+
+def perform_game_action(user, game_state, action, params=None):
+    """
+    Run a game action and its task progress without committing.
+    
+    Args:
+        user: User model instance
+        game_state: GameState model instance
+        action: String indicating the action to perform
+        params: Optional dictionary with additional parameters
+        
+    Returns:
+        dict: Result of the action
+    """
+    result = game.process_action(user, game_state, action, params)
+    
+    # Update task progress based on action type
+    if result['success'] and action in ACTION_TASK_OBJECTIVES:
+        update_task_progress(user.id, ACTION_TASK_OBJECTIVES[action], 1)
+    
+    game_state.last_active = datetime.now()
+    return result
+
+def serialize_transactions(user_id, limit=5, since=None):
+    """Get a user's most recent transactions (optionally only those after `since`) as API dictionaries."""
+    query = Transaction.query.filter_by(user_id=user_id)
+    if since is not None:
+        query = query.filter(Transaction.timestamp >= since)
+    transactions = query.order_by(Transaction.timestamp.desc()).limit(limit).all()
+    return [{
+        'id': transaction.id,
+        'type': transaction.type,
+        'amount': transaction.amount,
+        'description': transaction.description,
+        'timestamp': transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    } for transaction in transactions]
+
+def serialize_tasks(user_tasks):
+    """Convert (UserTask, Task) pairs to API dictionaries."""
+    return [{
+        'id': user_task.id,
+        'name': task.name,
+        'description': task.description,
+        'task_type': task.task_type,
+        'objective_type': task.objective_type,
+        'objective_value': task.objective_value,
+        'current_progress': user_task.current_progress,
+        'completed': user_task.completed,
+        'token_reward': task.token_reward,
+        'pixel_reward': task.pixel_reward,
+        'experience_reward': task.experience_reward
+    } for user_task, task in user_tasks]
+
+def serialize_game_state(game_state):
+    """Convert a GameState to the dictionary returned by the game action API."""
+    return {
+        'token_balance': game_state.token_balance,
+        'pixels': game_state.pixels,
+        'energy': game_state.energy,
+        'level': game_state.level,
+        'experience': game_state.experience,
+        'buildings_owned': game_state.buildings_owned,
+        'pixel_art_created': game_state.pixel_art_created,
+        'daily_streak': game_state.daily_streak,
+        'last_daily_claim': game_state.last_daily_claim.strftime('%Y-%m-%d %H:%M:%S') if game_state.last_daily_claim else None,
+        'referral_count': game_state.referral_count,
+        'tasks_completed': game_state.tasks_completed
+    }
+
+def snapshot_tasks(user_tasks):
+    """Capture the progress of (UserTask, Task) pairs so changes can be detected later."""
+    return {user_task.id: (user_task.current_progress, user_task.completed) for user_task, _ in user_tasks}
+
+def run_game_actions(ctx, actions, since_version=None):
+    """
+    Run a list of game actions for one player and build the resulting state.
+    
+    Nothing is committed; the caller commits once for all the actions.
+    
+    Args:
+        ctx: PlayerContext loaded with tasks
+        actions: List of (action, params) tuples, run in order
+        since_version: State version the client already holds, if any
+        
+    Returns:
+        tuple: (list of per-action results, dict with the final state payload)
+    """
+    user, game_state = ctx.user, ctx.game_state
+    
+    # Clients that already hold the current state only get what changed
+    delta = since_version is not None and since_version == game_state.state_version
+    if delta:
+        started_at = datetime.utcnow()
+        state_before = serialize_game_state(game_state)
+        tasks_before = snapshot_tasks(ctx.user_tasks)
+    
+    results = [perform_game_action(user, game_state, action, params) for action, params in actions]
+    # Flush the actions before the task helpers run, so a concurrent change to the
+    # player's state surfaces here as StaleDataError instead of inside a helper
+    db.session.flush()
+    user_tasks = get_user_tasks(user.id)
+    db.session.flush()
+    
+    state_after = serialize_game_state(game_state)
+    if delta:
+        payload = {
+            'delta': True,
+            'game_state': {key: value for key, value in state_after.items() if state_before.get(key) != value},
+            'transactions': serialize_transactions(user.id, limit=max(5, len(actions)), since=started_at),
+            'tasks': serialize_tasks([
+                (user_task, task) for user_task, task in user_tasks
+                if tasks_before.get(user_task.id) != (user_task.current_progress, user_task.completed)
+            ])
+        }
+    else:
+        payload = {
+            'delta': False,
+            'game_state': state_after,
+            'transactions': serialize_transactions(user.id),
+            'tasks': serialize_tasks(user_tasks)
+        }
+    payload['state_version'] = game_state.state_version
+    
+    return results, payload
+
 @app.route('/api/game_action', methods=['POST'])
 def game_action():
     telegram_id = request.form.get('telegram_id')
     action = request.form.get('action')
     
+    # Clients that already hold the full state send the version they last saw
+    # and get back only what changed since then
+    since_version = request.form.get('since_version', type=int)
+    
+    # The action's parameters (e.g. a market order), parsed to their types
+    params = parse_action_params(action, request.form)
+    
     if not telegram_id or not action:
         return jsonify({'success': False, 'message': 'Missing parameters'})
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id, with_tasks=True)
+    if not ctx:
         return jsonify({'success': False, 'message': 'User not found'})
     
-    game_state = GameState.query.filter_by(user_id=user.id).first()
-    if not game_state:
+    if not ctx.game_state:
         return jsonify({'success': False, 'message': 'Game state not found'})
     
-    # Process game action
-    result = game.process_action(user, game_state, action)
+    # The whole action - game mechanics, task progress and last_active - is one
+    # transaction with a single commit at the end. The response is built before
+    # committing so the commit does not expire the objects being serialized.
+    # If another request changed the player's state meanwhile, the action is
+    # rolled back and run again on the fresh state.
+    def attempt():
+        ctx = load_player_context(telegram_id, with_tasks=True)
+        results, payload = run_game_actions(ctx, [(action, params or None)], since_version)
+        result = results[0]
+        result.update(payload)
+        return result
     
-    # Update task progress based on action type
-    if result['success']:
-        if action == 'mine':
-            update_task_progress(user.id, 'mining', 1)
-        elif action == 'create':
-            update_task_progress(user.id, 'pixel_art', 1)
-        elif action == 'build':
-            update_task_progress(user.id, 'building', 1)
-    
-    # Update game state
-    game_state.last_active = datetime.now()
-    db.session.commit()
+    try:
+        result = run_with_retry('game_action', attempt, retry_on=(MarketConflict,))
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error in game action {action}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error occurred: {str(e)}'})
     
-    # Get recent transactions for the updated state
-    recent_transactions = []
-    transactions = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.timestamp.desc()).limit(5).all()
+    return jsonify(result)
+
+@app.route('/api/game_actions/batch', methods=['POST'])
+def game_actions_batch():
+    """
+    API endpoint to run several game actions in one request and one transaction.
     
-    for transaction in transactions:
-        recent_transactions.append({
-            'id': transaction.id,
-            'type': transaction.type,
-            'amount': transaction.amount,
-            'description': transaction.description,
-            'timestamp': transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
+    Expects a JSON body: {"telegram_id": ..., "actions": ["mine", {"action": "build",
+    "params": {"building_type": "mine"}}, ...], "since_version": optional int}.
+    """
+    data = request.get_json(silent=True) or {}
+    telegram_id = data.get('telegram_id')
+    raw_actions = data.get('actions')
+    since_version = data.get('since_version')
     
-    # Get updated user tasks
-    user_tasks_data = []
-    user_tasks = get_user_tasks(user.id)
-    for user_task, task in user_tasks:
-        user_tasks_data.append({
-            'id': user_task.id,
-            'name': task.name,
-            'description': task.description,
-            'task_type': task.task_type,
-            'objective_type': task.objective_type,
-            'objective_value': task.objective_value,
-            'current_progress': user_task.current_progress,
-            'completed': user_task.completed,
-            'token_reward': task.token_reward,
-            'pixel_reward': task.pixel_reward,
-            'experience_reward': task.experience_reward
-        })
+    if not telegram_id or not isinstance(raw_actions, list) or not raw_actions:
+        return jsonify({'success': False, 'message': 'Missing parameters'})
+    
+    if len(raw_actions) > GAME_ACTION_BATCH_MAX:
+        return jsonify({'success': False, 'message': f'Too many actions (maximum {GAME_ACTION_BATCH_MAX})'})
     
-    # Add complete game state to the result
-    result.update({
-        'game_state': {
-            'token_balance': game_state.token_balance,
-            'pixels': game_state.pixels,
-            'energy': game_state.energy,
-            'level': game_state.level,
-            'experience': game_state.experience,
-            'buildings_owned': game_state.buildings_owned,
-            'pixel_art_created': game_state.pixel_art_created,
-            'daily_streak': game_state.daily_streak,
-            'last_daily_claim': game_state.last_daily_claim.strftime('%Y-%m-%d %H:%M:%S') if game_state.last_daily_claim else None,
-            'referral_count': game_state.referral_count,
-            'tasks_completed': game_state.tasks_completed
-        },
-        'transactions': recent_transactions,
-        'tasks': user_tasks_data
+    actions = []
+    for item in raw_actions:
+        if isinstance(item, dict):
+            action, params = item.get('action'), item.get('params')
+        else:
+            action, params = item, None
+        if action not in GAME_ACTION_BATCHABLE or (params is not None and not isinstance(params, dict)):
+            return jsonify({'success': False, 'message': f'Unsupported action in batch: {action}'})
+        actions.append((action, parse_action_params(action, params or {}) or None))
+    
+    ctx = load_player_context(telegram_id, with_tasks=True)
+    if not ctx:
+        return jsonify({'success': False, 'message': 'User not found'})
+    
+    if not ctx.game_state:
+        return jsonify({'success': False, 'message': 'Game state not found'})
+    
+    def attempt():
+        ctx = load_player_context(telegram_id, with_tasks=True)
+        return run_game_actions(
+            ctx, actions, since_version if isinstance(since_version, int) else None
+        )
+    
+    try:
+        results, payload = run_with_retry('game_actions_batch', attempt)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error in game action batch: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error occurred: {str(e)}'})
+    
+    # Each action reports its own outcome; the state is only returned once, at the end
+    for (action, _), result in zip(actions, results):
+        result.pop('game_state', None)
+        result['action'] = action
+    
+    return jsonify({
+        'success': any(result['success'] for result in results),
+        'message': f"{sum(1 for result in results if result['success'])} of {len(results)} actions succeeded",
+        'results': results,
+        **payload
     })
+
+@app.route('/api/market/candles')
+def market_candles():
+    """
+    API endpoint serving market price candles for charts.
     
-    return jsonify(result)
+    Query parameters: resource_type, period ('1m', '1h' or '1d'), optional
+    start and end (ISO timestamps) and limit.
+    """
+    resource_type = request.args.get('resource_type', 'pixels')
+    period = request.args.get('period', '1h')
+    limit = min(request.args.get('limit', 200, type=int), MARKET_CANDLES_MAX)
+    
+    if resource_type not in MARKET_RESOURCES:
+        return jsonify({"success": False, "message": f"Unknown resource: {resource_type}"})
+    if period not in CANDLE_PERIODS:
+        return jsonify({"success": False, "message": f"Unknown period: {period}"})
+    
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"success": False, "message": "start and end must be ISO timestamps"})
+    
+    return jsonify({
+        "success": True,
+        "resource_type": resource_type,
+        "period": period,
+        "candles": get_candles(resource_type, period, start, end, max(limit, 1))
+    })
 
 @app.route('/api/mini-games/available', methods=['POST'])
 def get_available_mini_games():
@@ -701,11 +930,11 @@ def get_available_mini_games():
     if not telegram_id:
         return jsonify({"success": False, "message": "Telegram ID is required"})
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id)
+    if not ctx:
         return jsonify({"success": False, "message": "User not found"})
     
-    game_state = GameState.query.filter_by(user_id=user.id).first()
+    user, game_state = ctx.user, ctx.game_state
     if not game_state:
         return jsonify({"success": False, "message": "Game state not found"})
     
@@ -717,9 +946,97 @@ def get_available_mini_games():
         "games": available_games
     })
 
+@app.route('/api/mini-games/start', methods=['POST'])
+def start_mini_game():
+    """API endpoint to start a mini-game session"""
+    telegram_id = request.form.get('telegram_id')
+    game_type = request.form.get('game_type')
+    
+    if not telegram_id or not game_type:
+        return jsonify({"success": False, "message": "Telegram ID and game type are required"})
+    
+    ctx = load_player_context(telegram_id)
+    if not ctx:
+        return jsonify({"success": False, "message": "User not found"})
+    
+    user, game_state = ctx.user, ctx.game_state
+    if not game_state:
+        return jsonify({"success": False, "message": "Game state not found"})
+    
+    # The session is stored in the database so any worker can score the game
+    result = mini_games.start_game(user, game_state, game_type)
+    db.session.commit()
+    return jsonify(result)
+
+@app.route('/api/mini-games/reveal', methods=['POST'])
+def reveal_mini_game_card():
+    """API endpoint to flip one card of a started Pixel Match game"""
+    telegram_id = request.form.get('telegram_id')
+    session_id = request.form.get('session_id')
+    index = request.form.get('index', type=int)
+
+    if not telegram_id or not session_id or index is None:
+        return jsonify({"success": False, "message": "Telegram ID, session ID and card index are required"})
+
+    ctx = load_player_context(telegram_id)
+    if not ctx:
+        return jsonify({"success": False, "message": "User not found"})
+
+    result = mini_games.reveal_card(ctx.user, session_id, index)
+    db.session.commit()
+    return jsonify(result)
+
+@app.route('/api/mini-games/submit', methods=['POST'])
+def submit_mini_game():
+    """API endpoint to submit the answer to a started mini-game"""
+    telegram_id = request.form.get('telegram_id')
+    session_id = request.form.get('session_id')
+    answer_json = request.form.get('answer', '{}')
+    
+    try:
+        answer = json.loads(answer_json)
+    except json.JSONDecodeError:
+        answer = {}
+    
+    if not telegram_id or not session_id:
+        return jsonify({"success": False, "message": "Telegram ID and session ID are required"})
+    
+    ctx = load_player_context(telegram_id)
+    if not ctx:
+        return jsonify({"success": False, "message": "User not found"})
+    
+    if not ctx.game_state:
+        return jsonify({"success": False, "message": "Game state not found"})
+    
+    return _submit_mini_game(telegram_id, session_id, answer)
+
+def _submit_mini_game(telegram_id, session_id, answer):
+    """Score a mini-game session and commit its result and rewards, retrying on concurrent changes."""
+    def attempt():
+        ctx = load_player_context(telegram_id)
+        user, game_state = ctx.user, ctx.game_state
+        result = mini_games.submit_game(user, game_state, session_id, answer)
+        
+        # Update task progress if game was successful
+        if result.get('success', False) and result.get('score', 0) > 0:
+            update_task_progress(user.id, 'mini_game', 1)
+        
+        # Get recent transactions for the updated state
+        result['transactions'] = serialize_transactions(user.id) if result.get('success', False) else []
+        return result
+    
+    try:
+        result = run_with_retry('mini_game_submit', attempt)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error submitting mini-game session: {str(e)}")
+        return jsonify({"success": False, "message": f"Error occurred: {str(e)}"})
+    
+    return jsonify(result)
+
 @app.route('/api/mini-games/play', methods=['POST'])
 def play_mini_game():
-    """API endpoint to play a mini-game"""
+    """API endpoint to play a mini-game in one call: starts a game, or submits one when game_data has a session_id"""
     telegram_id = request.form.get('telegram_id')
     game_type = request.form.get('game_type')
     game_data_json = request.form.get('game_data', '{}')
@@ -728,41 +1045,25 @@ def play_mini_game():
         game_data = json.loads(game_data_json)
     except json.JSONDecodeError:
         game_data = {}
+    if not isinstance(game_data, dict):
+        game_data = {}
     
     if not telegram_id or not game_type:
         return jsonify({"success": False, "message": "Telegram ID and game type are required"})
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id)
+    if not ctx:
         return jsonify({"success": False, "message": "User not found"})
     
-    game_state = GameState.query.filter_by(user_id=user.id).first()
+    user, game_state = ctx.user, ctx.game_state
     if not game_state:
         return jsonify({"success": False, "message": "Game state not found"})
     
-    # Play the selected mini-game
-    result = mini_games.play_game(user, game_state, game_type, game_data)
-    
-    # Update task progress if game was successful
-    if result.get('success', False) and 'score' in result and result['score'] > 0:
-        update_task_progress(user.id, 'mini_game', 1)
-    
-    # Get recent transactions for the updated state
-    recent_transactions = []
-    if result.get('success', False):
-        transactions = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.timestamp.desc()).limit(5).all()
-        for transaction in transactions:
-            recent_transactions.append({
-                'id': transaction.id,
-                'type': transaction.type,
-                'amount': transaction.amount,
-                'description': transaction.description,
-                'timestamp': transaction.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            })
-    
-    # Add transactions to result
-    result['transactions'] = recent_transactions
-    
+    if game_data.get('session_id'):
+        return _submit_mini_game(telegram_id, game_data['session_id'], game_data)
+    # The session is stored in the database so any worker can score the game
+    result = mini_games.start_game(user, game_state, game_type)
+    db.session.commit()
     return jsonify(result)
 
 @app.route('/api/update_wallet', methods=['POST'])
@@ -777,9 +1078,10 @@ def update_wallet():
     if not wallet_address.startswith('0x') or len(wallet_address) != 42:
         return jsonify({'success': False, 'message': 'Invalid wallet address format'})
     
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if not user:
+    ctx = load_player_context(telegram_id, with_tasks=True)
+    if not ctx:
         return jsonify({'success': False, 'message': 'User not found'})
+    user = ctx.user
     
     # Update wallet address
     user.wallet_address = wallet_address
@@ -870,31 +1172,36 @@ def claim_task_reward():
     if not telegram_id or not task_id:
         return jsonify({'success': False, 'message': 'Missing parameters'})
     
-    try:
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return jsonify({'success': False, 'message': 'User not found'})
+    # Loading, claiming and committing are retried together if another request
+    # changed the player's state meanwhile
+    def attempt():
+        ctx = load_player_context(telegram_id, with_tasks=True)
+        if not ctx:
+            return {'success': False, 'message': 'User not found'}
+        user = ctx.user
         
-        user_task = UserTask.query.filter_by(user_id=user.id, task_id=task_id).first()
+        user_task = next((ut for ut in user.user_tasks if str(ut.task_id) == str(task_id)), None)
         if not user_task:
-            return jsonify({'success': False, 'message': 'Task not found for this user'})
+            return {'success': False, 'message': 'Task not found for this user'}
         
-        task = Task.query.get(task_id)
+        task = user_task.task
         if not task:
-            return jsonify({'success': False, 'message': 'Task not found'})
+            return {'success': False, 'message': 'Task not found'}
         
         if not user_task.completed:
-            return jsonify({'success': False, 'message': 'Task not completed yet'})
+            return {'success': False, 'message': 'Task not completed yet'}
         
         # Award the rewards
-        game_state = GameState.query.filter_by(user_id=user.id).first()
+        game_state = ctx.game_state
         if not game_state:
-            return jsonify({'success': False, 'message': 'Game state not found'})
+            return {'success': False, 'message': 'Game state not found'}
         
         # Update game state
-        game_state.token_balance += task.token_reward
-        game_state.pixels += task.pixel_reward
-        game_state.experience += task.experience_reward
+        apply_resources(game_state, {
+            'token_balance': task.token_reward,
+            'pixels': task.pixel_reward,
+            'experience': task.experience_reward
+        })
         
         # Record transaction
         transaction = Transaction(
@@ -909,16 +1216,19 @@ def claim_task_reward():
         user_task.completed = False
         user_task.current_progress = 0
         
-        db.session.commit()
-        
-        return jsonify({
+        return {
             'success': True, 
             'message': f'Task reward claimed: +{task.token_reward} $PXPT, +{task.pixel_reward} Pixels, +{task.experience_reward} XP'
-        })
+        }
+    
+    try:
+        result = run_with_retry('claim_task_reward', attempt)
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error claiming task reward: {str(e)}")
         return jsonify({'success': False, 'message': f'Failed to claim reward: {str(e)}'})
+    
+    return jsonify(result)
 
 @app.route('/api/generate_referral_code', methods=['POST'])
 def generate_referral_code_api():
@@ -929,11 +1239,11 @@ def generate_referral_code_api():
         return jsonify({'success': False, 'message': 'Missing parameters'})
     
     try:
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        if not user:
+        ctx = load_player_context(telegram_id)
+        if not ctx:
             return jsonify({'success': False, 'message': 'User not found'})
         
-        game_state = GameState.query.filter_by(user_id=user.id).first()
+        user, game_state = ctx.user, ctx.game_state
         if not game_state:
             return jsonify({'success': False, 'message': 'Game state not found'})
         
@@ -951,7 +1261,7 @@ def generate_referral_code_api():
                 'message': f'You already have a referral code: {user.referral_code}'
             })
         
-        user.referral_code = generate_referral_code()
+        user.referral_code = generate_referral_code(user.id)
         db.session.commit()
         
         return jsonify({
@@ -0,0 +1,29 @@
+"""
+One-time script to give referral codes to existing users who qualify for one.
+Codes are derived from user IDs, so the script can be re-run safely.
+"""
+
+import logging
+from app import app
+from utils import backfill_referral_codes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_backfill():
+    """Backfill referral codes for users at or above the referrer level requirement."""
+    try:
+        logger.info("Starting referral code backfill...")
+        
+        with app.app_context():
+            updated = backfill_referral_codes()
+            logger.info(f"Referral code backfill completed: {updated} users updated")
+    
+    except Exception as e:
+        logger.error(f"Error during referral code backfill: {str(e)}")
+        return False
+    
+    return True
+
+if __name__ == "__main__":
+    run_backfill()
@@ -0,0 +1,227 @@
+"""
+Closed-form building production for the Pixel Plaza Token game.
+Each GameState keeps the summed production of all its buildings (one rate per
+resource, per collection period) and the time income last started accruing, so
+pending income is computed from the player's own row in O(1) instead of
+visiting every building. Buildings are stored as BuildingGroup rows, one per
+type and level with a count; building something bumps its group and folds its
+rate into the vector, and collecting is a single update of the game state.
+"""
+
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import db
+from models import BuildingGroup
+from building_catalog import get_building_level
+from config import COLLECTION_COOLDOWN_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Components of the production vector. 'interest' is the bank's percentage of
+# the token balance paid per period, the others are amounts per period.
+PRODUCTION_RESOURCES = ('tokens', 'pixels', 'materials', 'gems', 'interest')
+
+
+def _load_vector(raw):
+    values = json.loads(raw) if raw else {}
+    return {resource: float(values.get(resource, 0.0)) for resource in PRODUCTION_RESOURCES}
+
+
+def dump_production_vector(vector, **extra):
+    """Serialize a production vector (and any extra fields) for a GameState column."""
+    values = {resource: round(amount, 6) for resource, amount in vector.items() if amount}
+    values.update(extra)
+    return json.dumps(values, sort_keys=True, separators=(',', ':'))
+
+
+def production_rates(game_state):
+    """A player's production per collection period, by resource."""
+    return _load_vector(game_state.production_rates)
+
+
+def rated_building_count(game_state):
+    """Number of buildings folded into the player's production rates."""
+    raw = json.loads(game_state.production_rates) if game_state.production_rates else {}
+    return int(raw.get('buildings', 0))
+
+
+def building_production(building_type, level=1, efficiency=1.0):
+    """
+    Production vector of a single building.
+
+    Args:
+        building_type: String indicating the building type
+        level: Integer level of the building
+        efficiency: Production multiplier the building was built with
+
+    Returns:
+        dict mapping each of PRODUCTION_RESOURCES to the building's production
+        per collection period, or None if the building type does not exist
+    """
+    info = get_building_level(building_type, level)
+    if not info:
+        return None
+    vector = dict.fromkeys(PRODUCTION_RESOURCES, 0.0)
+    rate = info['production_rate'] * (efficiency if efficiency is not None else 1.0)
+    if building_type == 'bank':
+        vector['interest'] = rate
+    else:
+        vector[info['produces']] = rate
+    return vector
+
+
+def add_to_building_group(game_state, building_type, level=1, efficiency=1.0, now=None):
+    """
+    Count a new building in the player's group for its type and level.
+
+    The group is incremented in place with a single UPDATE, and only created
+    when the player has no building of that type and level yet.
+    """
+    now = now or datetime.utcnow()
+    table = BuildingGroup.__table__
+    result = db.session.execute(
+        update(table).where(
+            table.c.game_state_id == game_state.id,
+            table.c.building_type == building_type,
+            table.c.level == level
+        ).values(
+            count=table.c.count + 1,
+            efficiency_total=table.c.efficiency_total + efficiency,
+            updated_at=now
+        )
+    )
+    if result.rowcount == 0:
+        db.session.add(BuildingGroup(
+            game_state_id=game_state.id,
+            building_type=building_type,
+            level=level,
+            count=1,
+            efficiency_total=efficiency,
+            created_at=now,
+            updated_at=now
+        ))
+
+
+def rebuild_production_rates(game_state, groups, now=None):
+    """
+    Recompute a player's production vector from their building groups.
+
+    Used for players whose rates were never stored. Each group is credited with
+    the time since it last changed, up to one collection period.
+    """
+    now = now or datetime.utcnow()
+    cooldown_seconds = COLLECTION_COOLDOWN_HOURS * 3600
+    rates = dict.fromkeys(PRODUCTION_RESOURCES, 0.0)
+    banked = dict.fromkeys(PRODUCTION_RESOURCES, 0.0)
+    buildings = 0
+
+    for group in groups:
+        # A group produces like one building with the summed efficiency of its members
+        vector = building_production(group.building_type, group.level, group.efficiency_total)
+        if vector is None:
+            continue
+        since = group.updated_at or now
+        time_factor = min(1.0, max(0.0, (now - since).total_seconds() / cooldown_seconds))
+        for resource, rate in vector.items():
+            rates[resource] += rate
+            banked[resource] += rate * time_factor
+        buildings += group.count
+
+    game_state.production_rates = dump_production_vector(rates, buildings=buildings)
+    game_state.production_banked = dump_production_vector(banked) if any(banked.values()) else None
+    game_state.production_accrued_at = now
+
+
+def accrued_production(game_state, now=None):
+    """
+    Production accrued since the last collection, before skill and event bonuses.
+
+    Every building produces at most one collection period's worth between
+    collections, so each component is capped at one period of the current rate.
+
+    Returns:
+        dict mapping each of PRODUCTION_RESOURCES to the accrued amount
+    """
+    rates = production_rates(game_state)
+    banked = _load_vector(game_state.production_banked)
+    accrued_at = game_state.production_accrued_at
+    if accrued_at is None:
+        return banked
+
+    now = now or datetime.utcnow()
+    periods = max(0.0, (now - accrued_at).total_seconds() / (COLLECTION_COOLDOWN_HOURS * 3600))
+    return {
+        resource: min(banked[resource] + rates[resource] * periods, rates[resource])
+        for resource in PRODUCTION_RESOURCES
+    }
+
+
+def add_building_production(game_state, building_type, level=1, efficiency=1.0, now=None):
+    """
+    Fold a new building into the player's production vector.
+
+    Production accrued so far is banked first, so the new building only starts
+    earning from now.
+    """
+    vector = building_production(building_type, level, efficiency)
+    if vector is None:
+        return
+    now = now or datetime.utcnow()
+
+    banked = accrued_production(game_state, now)
+    rates = production_rates(game_state)
+    for resource, rate in vector.items():
+        rates[resource] += rate
+
+    game_state.production_rates = dump_production_vector(rates, buildings=rated_building_count(game_state) + 1)
+    game_state.production_banked = dump_production_vector(banked) if any(banked.values()) else None
+    game_state.production_accrued_at = now
+
+
+def pending_income(game_state, multiplier=1.0, now=None):
+    """
+    Income the player would get by collecting now.
+
+    Args:
+        game_state: GameState to read
+        multiplier: Skill and event bonus applied to every resource
+        now: Optional time to compute the income at
+
+    Returns:
+        dict with the pending tokens (including bank interest), pixels,
+        materials and gems
+    """
+    accrued = accrued_production(game_state, now)
+
+    interest = game_state.token_balance * accrued['interest'] * multiplier * 0.01
+    income = {
+        'tokens': round(accrued['tokens'] * multiplier + round(interest, 2), 2),
+        'pixels': round(accrued['pixels'] * multiplier),
+        'materials': round(accrued['materials'] * multiplier),
+        'gems': round(accrued['gems'] * multiplier * 0.1)  # Gems are valuable, produce fewer
+    }
+    if accrued['gems'] > 0:
+        income['gems'] = max(1, income['gems'])
+    return income
+
+
+def collect_production(game_state, multiplier=1.0, now=None):
+    """
+    Take the player's accrued production and restart accrual.
+
+    The income is not added to the player's resources here; the caller pays
+    it out together with the rest of the action.
+
+    Returns:
+        dict with the collected tokens, pixels, materials and gems
+    """
+    now = now or datetime.utcnow()
+    income = pending_income(game_state, multiplier, now)
+
+    game_state.production_banked = None
+    game_state.production_accrued_at = now
+    return income
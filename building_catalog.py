@@ -0,0 +1,98 @@
+"""
+Precompiled building catalog for the Pixel Plaza Token game.
+Compiles config.BUILDING_TYPES once at import into read-only per-type,
+per-level tables so building and collection actions only do lookups.
+"""
+
+import logging
+from functools import lru_cache
+from types import MappingProxyType
+
+from config import (
+    BUILDING_TYPES, BUILDING_UPGRADE_MULTIPLIER, BUILDING_CATALOG_MAX_LEVEL,
+    SKILL_LEVEL_BONUS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _compile_level(building_type, info, level):
+    """Build the read-only table entry for one building type at one level."""
+    entry = dict(info)
+    entry['type'] = building_type
+    entry['level'] = level
+    entry['unlock_level'] = info.get('unlock_level', 1)
+    if level > 1:
+        entry['production_rate'] = info['production_rate'] * info['level_multiplier'] ** (level - 1)
+        entry['base_cost'] = info['base_cost'] * BUILDING_UPGRADE_MULTIPLIER ** (level - 1)
+    return MappingProxyType(entry)
+
+
+def _compile_catalog():
+    catalog = {}
+    for building_type, info in BUILDING_TYPES.items():
+        # Index 0 is unused so that a building's level is its index
+        catalog[building_type] = (None,) + tuple(
+            _compile_level(building_type, info, level)
+            for level in range(1, BUILDING_CATALOG_MAX_LEVEL + 1)
+        )
+    return MappingProxyType(catalog)
+
+
+_CATALOG = _compile_catalog()
+
+# Building types ordered by the player level that unlocks them
+_UNLOCK_ORDER = tuple(sorted(
+    ((levels[1]['unlock_level'], building_type) for building_type, levels in _CATALOG.items()),
+    key=lambda item: item[0]
+))
+
+
+@lru_cache(maxsize=256)
+def _compile_uncached_level(building_type, level):
+    return _compile_level(building_type, BUILDING_TYPES[building_type], level)
+
+
+def get_building_level(building_type, level=1):
+    """
+    Get the catalog entry for a building type at a given level.
+
+    Args:
+        building_type: String indicating the building type
+        level: Integer level of the building
+
+    Returns:
+        Read-only mapping with the building's properties at that level, or None
+        if the building type does not exist
+    """
+    levels = _CATALOG.get(building_type)
+    if levels is None:
+        return None
+    level = max(1, level or 1)
+    if level < len(levels):
+        return levels[level]
+    return _compile_uncached_level(building_type, level)
+
+
+def unlocked_building_types(player_level):
+    """Building types a player of the given level may build, in unlock order."""
+    return tuple(building_type for unlock_level, building_type in _UNLOCK_ORDER
+                 if unlock_level <= player_level)
+
+
+@lru_cache(maxsize=128)
+def build_cost_curve(skill_level):
+    """
+    Token cost of a new (level 1) building of each type for a building skill level.
+
+    Args:
+        skill_level: Integer building skill level
+
+    Returns:
+        Read-only mapping of building type to token cost before event modifiers
+    """
+    skill_bonus = 1.0 + (skill_level * SKILL_LEVEL_BONUS)
+    return MappingProxyType({
+        building_type: levels[1]['base_cost'] * (1.0 - (skill_bonus - 1.0) * 0.5)  # Skill reduces cost
+        for building_type, levels in _CATALOG.items()
+    })
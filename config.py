@@ -7,10 +7,14 @@ REFERRER_BONUS = 5  # $PXPT bonus for referring someone
 REFEREE_BONUS = 3   # $PXPT bonus for being referred
 REFERRER_LEVEL_REQUIREMENT = 3  # Minimum level to generate a referral code
 REFERRAL_CODE_LENGTH = 8  # Length of generated referral codes
+REFERRAL_BACKFILL_BATCH_SIZE = 1000  # Users updated per statement when backfilling referral codes
 
 # Task System
 # Task types: 'one_time', 'daily', 'weekly'
 # Objective types: 'login', 'mining', 'pixel_art', 'building', 'wallet', 'referral'
+TASK_CATALOG_TTL_SECONDS = 300  # How long a process may serve its cached catalog of active tasks
+TASK_RESET_BATCH_SIZE = 5000  # UserTask IDs covered by each UPDATE of the scheduled reset job
+TASK_RESET_GRACE_SECONDS = 5  # Delay after midnight UTC before the reset job runs
 DEFAULT_TASKS = [
     # One-time tasks
     {
@@ -180,6 +184,7 @@ BUILDING_TYPES = {
         'produces': 'pixels',
         'production_rate': 10,  # Pixels per collection
         'material_cost': 0,
+        'unlock_level': 1,  # Player level required to build
         'level_multiplier': 1.5  # Production increases by this factor per level
     },
     'studio': {
@@ -189,6 +194,7 @@ BUILDING_TYPES = {
         'produces': 'tokens',
         'production_rate': 2,  # Tokens per collection
         'material_cost': 10,
+        'unlock_level': 3,
         'level_multiplier': 1.3
     },
     'factory': {
@@ -198,6 +204,7 @@ BUILDING_TYPES = {
         'produces': 'materials',
         'production_rate': 5,  # Materials per collection
         'material_cost': 20,
+        'unlock_level': 5,
         'level_multiplier': 1.4
     },
     'market': {
@@ -207,6 +214,7 @@ BUILDING_TYPES = {
         'produces': 'tokens',
         'production_rate': 5,  # Tokens per collection
         'material_cost': 30,
+        'unlock_level': 7,
         'level_multiplier': 1.2
     },
     'bank': {
@@ -216,6 +224,7 @@ BUILDING_TYPES = {
         'produces': 'tokens',
         'production_rate': 0.01,  # % of balance per collection
         'material_cost': 50,
+        'unlock_level': 10,
         'level_multiplier': 1.2
     }
 }
@@ -225,6 +234,7 @@ BUILDING_COST_MULTIPLIER = 1.5
 BUILDING_INCOME_BASE = 1
 COLLECTION_COOLDOWN_HOURS = 4
 BUILDING_UPGRADE_MULTIPLIER = 2.0  # Cost multiplier for each level upgrade
+BUILDING_CATALOG_MAX_LEVEL = 25  # Building levels precomputed at startup; higher levels are computed on demand
 
 # Market economy
 MARKET_FEE_PERCENTAGE = 5  # 5% fee on market transactions
@@ -232,6 +242,22 @@ MARKET_ORDER_EXPIRY_DAYS = 7  # Orders expire after 7 days
 MARKET_MIN_TOKEN_BALANCE = 1.0  # Minimum token balance required to place orders
 MARKET_MAX_ACTIVE_ORDERS = 5  # Maximum active orders per user
 MARKET_PRICE_FLUCTUATION = 0.1  # 10% max random price fluctuation daily
+MARKET_BOOK_RELOAD_SECONDS = 60  # How often a process reloads its in-memory order books from the database
+MARKET_CANDLES_MAX = 1000  # Most candles returned by one /api/market/candles request
+MARK_PRICE_MAX_STALENESS_SECONDS = 15  # A cached mark price older than this is reloaded from the latest candle
+DEFAULT_RESOURCE_PRICES = {  # Mark prices of resources that have never traded
+    'pixels': 0.1,
+    'materials': 0.5,
+    'gems': 5.0
+}
+
+# Game action batching
+GAME_ACTION_BATCH_MAX = 25  # Maximum actions accepted by /api/game_actions/batch
+GAME_ACTION_BATCHABLE = ['mine', 'create', 'build', 'collect', 'daily']
+
+# Optimistic concurrency
+GAME_STATE_MAX_RETRIES = 3  # Times an action is retried after a concurrent change to the player's state
+GAME_STATE_RETRY_BACKOFF_SECONDS = 0.02  # Base of the jittered exponential backoff between retries
 
 # Skill progression
 SKILL_UP_THRESHOLD = 100  # Actions needed to level up a skill
@@ -241,17 +267,35 @@ SKILL_LEVEL_BONUS = 0.1  # 10% bonus per skill level
 EVENT_CHANCE_DAILY = 0.2  # 20% chance of a random event each day
 EVENT_DURATION_DAYS_MIN = 1
 EVENT_DURATION_DAYS_MAX = 7
+EVENT_CACHE_TTL_SECONDS = 60  # How long a process may serve its cached set of active events
 
 # Progression
 XP_PER_LEVEL = 100  # Experience points needed per level
 
+# Leaderboard
+LEADERBOARD_RECONCILE_SECONDS = 300  # How often the in-memory leaderboard is rebuilt from the database
+
+# Admin dashboard
+ADMIN_STATS_TTL_SECONDS = 30  # Matches the admin page's polling interval
+ADMIN_STATS_GROWTH_WEEKS = 6  # Weeks shown in the user growth chart
+ADMIN_STATS_ACTIVITY_DAYS = 30  # Window for the token distribution and activity charts
+ADMIN_USERS_PAGE_SIZE = 100  # Players listed in the admin user table
+CSV_EXPORT_BATCH_SIZE = 1000  # Rows fetched and sent per chunk by the airdrop CSV export
+
 # Telegram Bot Configuration
 import os
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_BOT_USERNAME = os.environ.get("TELEGRAM_BOT_USERNAME", "")
 
+# Key for the referral code permutation - changing it changes the codes given to users from then on
+REFERRAL_CODE_SECRET = os.environ.get("REFERRAL_CODE_SECRET", os.environ.get("SESSION_SECRET", "pixel_plaza_referral_key"))
+
 # Mini-Games System
 MINI_GAME_COOLDOWN_HOURS = 12  # Hours before a player can play the same mini-game again
+MINI_GAME_SESSION_TTL_SECONDS = 600  # How long a started mini-game waits for the player's answer
+MINI_GAME_POOLED_GAMES = ['pixel_match', 'token_puzzle', 'gem_hunter', 'pattern_predictor']  # Games dealt from pregenerated puzzle pools
+MINI_GAME_POOL_SIZE = 200  # Ready puzzles kept per pooled game
+MINI_GAME_POOL_REFILL_THRESHOLD = 50  # The refill worker tops a pool up once it drops below this
 MINI_GAME_TOKEN_REWARDS = {
     'pixel_match': 5,
     'token_puzzle': 7,
@@ -1,9 +1,12 @@
 import random
 import logging
 import math
+import threading
 from datetime import datetime, timedelta
 from flask import request
-from models import User, GameState, Transaction, Building, MarketOrder, MarketHistory, GameEvent
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+from models import User, GameState, Transaction, MarketOrder, GameEvent
 from app import db
 from config import (
     DAILY_REWARD, DAILY_STREAK_BONUS, 
@@ -17,12 +20,162 @@ from config import (
     MARKET_FEE_PERCENTAGE, MARKET_ORDER_EXPIRY_DAYS, MARKET_MIN_TOKEN_BALANCE,
     MARKET_MAX_ACTIVE_ORDERS, MARKET_PRICE_FLUCTUATION,
     SKILL_UP_THRESHOLD, SKILL_LEVEL_BONUS,
-    EVENT_CHANCE_DAILY, EVENT_DURATION_DAYS_MIN, EVENT_DURATION_DAYS_MAX,
+    EVENT_CHANCE_DAILY, EVENT_DURATION_DAYS_MIN, EVENT_DURATION_DAYS_MAX, EVENT_CACHE_TTL_SECONDS,
     XP_PER_LEVEL
 )
+from building_catalog import get_building_level, unlocked_building_types, build_cost_curve
+from building_accrual import (
+    add_building_production, add_to_building_group, collect_production, pending_income,
+    production_rates, rated_building_count, rebuild_production_rates
+)
+from market import market_engine, MARKET_RESOURCES
+from mark_price import mark_prices
+from resource_updates import apply_resources, apply_level_up
 
 logger = logging.getLogger(__name__)
 
+# GameEvent multiplier column for each activity
+EVENT_ACTIVITY_MULTIPLIERS = {
+    'mining': 'mining_multiplier',
+    'art': 'art_multiplier',
+    'building': 'building_multiplier',
+    'market': 'market_fee_multiplier'
+}
+
+def _parse_flag(value):
+    """Parse a submitted boolean; form fields arrive as strings like 'false' or '0'."""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+# Parameters each action accepts, with the parser for their submitted value
+ACTION_PARAMS = {
+    'build': {'building_type': str, 'check_only': _parse_flag},
+    'market': {'order_type': str, 'resource_type': str, 'quantity': int, 'price': float, 'order_id': int}
+}
+
+def parse_action_params(action, values):
+    """
+    Pick and parse the parameters an action accepts from submitted values.
+
+    Args:
+        action: String indicating the action
+        values: Form data or JSON dict with the submitted parameters
+
+    Returns:
+        dict of parsed parameters; unknown keys and values that do not parse are left out
+    """
+    params = {}
+    for key, parse in ACTION_PARAMS.get(action, {}).items():
+        value = values.get(key)
+        if value is None:
+            continue
+        try:
+            params[key] = parse(value)
+        except (TypeError, ValueError):
+            continue
+    return params
+
+class CachedEvent:
+    """Read-only copy of an active GameEvent that can outlive the session it was loaded in."""
+    
+    __slots__ = (
+        'id', 'name', 'description', 'event_type',
+        'mining_multiplier', 'art_multiplier', 'building_multiplier', 'market_fee_multiplier',
+        'start_time', 'end_time'
+    )
+    
+    def __init__(self, game_event):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(game_event, attr))
+    
+    def __repr__(self):
+        return f'<CachedEvent {self.name} ({self.event_type})>'
+
+class ActiveEventCache:
+    """
+    Process-local cache of the active game events.
+    
+    The set is reloaded when the TTL runs out, when a cached event ends or a
+    scheduled one starts, and after any commit that writes a GameEvent. Combined
+    multipliers are precomputed per activity so the game actions do no event
+    queries at all.
+    """
+    
+    def __init__(self, ttl_seconds=EVENT_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._events = ()
+        self._events_by_activity = {}
+        self._multipliers = {}
+        self._expires_at = None
+    
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._expires_at = None
+    
+    def _ensure_fresh(self):
+        now = datetime.utcnow()
+        with self._lock:
+            if self._expires_at is not None and now < self._expires_at:
+                return
+            
+            # Load current and scheduled events in one query; scheduled ones only
+            # tell us when the cache has to be reloaded
+            rows = GameEvent.query.filter(
+                GameEvent.is_active == True,
+                GameEvent.end_time >= now
+            ).all()
+            events = tuple(CachedEvent(e) for e in rows if e.start_time <= now)
+            
+            expires_at = now + timedelta(seconds=self.ttl_seconds)
+            for e in rows:
+                boundary = e.end_time if e.start_time <= now else e.start_time
+                expires_at = min(expires_at, boundary)
+            
+            self._events = events
+            self._events_by_activity = {}
+            self._multipliers = {}
+            for activity, attr in EVENT_ACTIVITY_MULTIPLIERS.items():
+                affecting = tuple(e for e in events if getattr(e, attr) != 1.0)
+                multiplier = 1.0
+                for e in affecting:
+                    multiplier *= getattr(e, attr)
+                self._events_by_activity[activity] = affecting
+                self._multipliers[activity] = multiplier
+            self._expires_at = expires_at
+    
+    def events(self, activity=None):
+        """Active events, optionally only those affecting an activity."""
+        self._ensure_fresh()
+        if activity is None:
+            return self._events
+        return self._events_by_activity.get(activity, ())
+    
+    def multiplier(self, activity):
+        """Combined multiplier of all active events for an activity."""
+        self._ensure_fresh()
+        return self._multipliers.get(activity, 1.0)
+
+active_event_cache = ActiveEventCache()
+
+@sa_event.listens_for(Session, 'after_flush')
+def _track_game_event_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, GameEvent):
+            session.info['game_events_changed'] = True
+            break
+
+@sa_event.listens_for(Session, 'after_commit')
+def _invalidate_active_events(session):
+    if session.info.pop('game_events_changed', False):
+        active_event_cache.invalidate()
+
+@sa_event.listens_for(Session, 'after_rollback')
+def _discard_game_event_writes(session):
+    session.info.pop('game_events_changed', None)
+
 class GameMechanics:
     """
     Game mechanics for the Pixel Plaza Token game.
@@ -37,6 +190,10 @@ class GameMechanics:
         """
         Process a game action from the web interface.
         
+        The action's changes are flushed but not committed; the caller commits
+        the whole action (including task progress) as a single transaction and
+        rolls it back if this raises.
+        
         Args:
             user: User model instance
             game_state: GameState model instance
@@ -67,12 +224,7 @@ class GameMechanics:
             elif action == "collect":
                 return self._process_collection(user, game_state)
             elif action == "market":
-                # TODO: Implement market actions
-                return {
-                    "success": False,
-                    "message": "Market functionality is coming soon!",
-                    "game_state": self._get_game_state_dict(game_state)
-                }
+                return self._process_market(user, game_state, params)
             elif action == "upgrade":
                 # TODO: Implement building upgrade functionality
                 return {
@@ -86,11 +238,9 @@ class GameMechanics:
                     "message": f"Unknown action: {action}"
                 }
         except Exception as e:
+            # Let the caller roll back the transaction it owns
             logger.error(f"Error processing action {action}: {str(e)}")
-            return {
-                "success": False,
-                "message": f"Error occurred: {str(e)}"
-            }
+            raise
     
     def _process_daily_claim(self, user, game_state):
         """Process daily claim action."""
@@ -123,9 +273,12 @@ class GameMechanics:
         total_reward = DAILY_REWARD + (streak_bonus - 1) * DAILY_STREAK_BONUS
         
         # Update game state
-        game_state.token_balance += total_reward
         game_state.last_daily_claim = now
-        game_state.energy = min(game_state.energy + 50, 100)  # Refill energy
+        apply_resources(
+            game_state,
+            {'token_balance': total_reward, 'energy': 50},  # Refill energy
+            caps={'energy': 100}
+        )
         
         # Record transaction
         daily_transaction = Transaction(
@@ -136,7 +289,7 @@ class GameMechanics:
         )
         db.session.add(daily_transaction)
         
-        db.session.commit()
+        db.session.flush()
         
         return {
             "success": True,
@@ -158,10 +311,8 @@ class GameMechanics:
             }
         
         # Get active events that affect mining
-        active_events = self._get_active_events(affecting_activity='mining')
-        mining_multiplier = 1.0
-        for event in active_events:
-            mining_multiplier *= event.mining_multiplier
+        active_events = active_event_cache.events('mining')
+        mining_multiplier = active_event_cache.multiplier('mining')
         
         # Apply skill level bonus
         skill_bonus = 1.0 + (game_state.mining_skill * SKILL_LEVEL_BONUS)
@@ -178,33 +329,37 @@ class GameMechanics:
         material_found = 0
         if random.random() < MINING_MATERIAL_CHANCE * skill_bonus * mining_multiplier:
             material_found = random.randint(MINING_MATERIAL_MIN, MINING_MATERIAL_MAX)
-            game_state.materials += material_found
         
         # Chance to find gems based on events and skill (rare resource)
         gems_found = 0
         if random.random() < MINING_GEM_CHANCE * skill_bonus * mining_multiplier:
             gems_found = random.randint(MINING_GEM_MIN, MINING_GEM_MAX)
-            game_state.gems += gems_found
-        
-        # Update game state
-        game_state.token_balance += reward
-        game_state.energy -= MINING_ENERGY_COST
-        game_state.pixels += pixel_gain
         
         # Always add experience
         xp_gained = 5 + round(2 * mining_multiplier)  # Bonus XP during events
-        game_state.experience += xp_gained
+        
+        # Update game state, spending the energy only if it is still there
+        updated = apply_resources(game_state, {
+            'token_balance': reward,
+            'energy': -MINING_ENERGY_COST,
+            'pixels': pixel_gain,
+            'materials': material_found,
+            'gems': gems_found,
+            'experience': xp_gained
+        })
+        if updated is None:
+            return {
+                "success": False,
+                "message": f"Not enough energy! Current: {game_state.energy}/100, Need: {MINING_ENERGY_COST}",
+                "game_state": self._get_game_state_dict(game_state)
+            }
         
         # Progress mining skill
         mining_skill_progress = random.randint(1, 3)
         new_skill_level = self._progress_skill(game_state, 'mining', mining_skill_progress)
         
         # Check for level up
-        level_up = False
-        if game_state.experience >= game_state.level * XP_PER_LEVEL:
-            game_state.experience -= game_state.level * XP_PER_LEVEL
-            game_state.level += 1
-            level_up = True
+        level_up = apply_level_up(game_state, XP_PER_LEVEL)
         
         # Record transaction
         reward_description = 'Mining reward'
@@ -222,7 +377,7 @@ class GameMechanics:
         # Check if we should trigger a random event
         self._maybe_trigger_random_event(user, game_state)
         
-        db.session.commit()
+        db.session.flush()
         
         # Build response message
         message = f"Mining successful! +{reward} $PXPT, +{pixel_gain} Pixels"
@@ -271,10 +426,8 @@ class GameMechanics:
             }
         
         # Get active events that affect art creation
-        active_events = self._get_active_events(affecting_activity='art')
-        art_multiplier = 1.0
-        for event in active_events:
-            art_multiplier *= event.art_multiplier
+        active_events = active_event_cache.events('art')
+        art_multiplier = active_event_cache.multiplier('art')
             
         # Apply skill level bonus
         skill_bonus = 1.0 + (game_state.art_skill * SKILL_LEVEL_BONUS)
@@ -290,31 +443,35 @@ class GameMechanics:
         gems_found = 0
         if random.random() < ART_GEM_CHANCE * skill_bonus * art_multiplier:
             gems_found = random.randint(ART_GEM_MIN, ART_GEM_MAX)
-            game_state.gems += gems_found
         
         # Calculate pixel cost reduction based on skill (more efficient art creation)
         actual_pixel_cost = max(10, ART_PIXEL_COST - math.floor(game_state.art_skill / 2) * 5)
         
-        # Update game state
-        game_state.token_balance += reward
-        game_state.pixels -= actual_pixel_cost
-        game_state.energy -= ART_ENERGY_COST
-        game_state.pixel_art_created += 1
-        
         # Always add experience with potential event bonus
         xp_gained = 10 + round(3 * art_multiplier)
-        game_state.experience += xp_gained
+        
+        # Update game state, spending the pixels and energy only if they are still there
+        updated = apply_resources(game_state, {
+            'token_balance': reward,
+            'pixels': -actual_pixel_cost,
+            'energy': -ART_ENERGY_COST,
+            'gems': gems_found,
+            'pixel_art_created': 1,
+            'experience': xp_gained
+        })
+        if updated is None:
+            return {
+                "success": False,
+                "message": f"Not enough pixels or energy! Pixels: {game_state.pixels}, Energy: {game_state.energy}/100",
+                "game_state": self._get_game_state_dict(game_state)
+            }
         
         # Progress art skill
         art_skill_progress = random.randint(2, 4) # Art creation is better for skill progression
         new_skill_level = self._progress_skill(game_state, 'art', art_skill_progress)
         
         # Check for level up
-        level_up = False
-        if game_state.experience >= game_state.level * XP_PER_LEVEL:
-            game_state.experience -= game_state.level * XP_PER_LEVEL
-            game_state.level += 1
-            level_up = True
+        level_up = apply_level_up(game_state, XP_PER_LEVEL)
         
         # Record transaction with quality info
         quality_desc = "Standard"
@@ -340,7 +497,7 @@ class GameMechanics:
         # Check if we should trigger a random event
         self._maybe_trigger_random_event(user, game_state)
         
-        db.session.commit()
+        db.session.flush()
         
         # Build response message
         message = f"Pixel art created! +{reward} $PXPT ({quality_desc})"
@@ -375,48 +532,37 @@ class GameMechanics:
     def _process_building(self, user, game_state, building_type='mine', check_only=False):
         """Process building purchase action with enhanced mechanics."""
         # Get active events that affect building
-        active_events = self._get_active_events(affecting_activity='building')
-        building_multiplier = 1.0
-        for event in active_events:
-            building_multiplier *= event.building_multiplier
+        active_events = active_event_cache.events('building')
+        building_multiplier = active_event_cache.multiplier('building')
             
-        # Apply skill level bonus
-        skill_bonus = 1.0 + (game_state.building_skill * SKILL_LEVEL_BONUS)
+        # Skill-adjusted costs come from the catalog's cached cost curve
+        cost_curve = build_cost_curve(game_state.building_skill)
         
         # Check available building types based on level
         available_buildings = []
-        for b_type, b_info in BUILDING_TYPES.items():
-            # Unlock buildings gradually based on level
-            required_level = {
-                'mine': 1,  # Available from start
-                'studio': 3,
-                'factory': 5,
-                'market': 7,
-                'bank': 10
-            }
+        for b_type in unlocked_building_types(game_state.level):
+            b_info = get_building_level(b_type, 1)
+            token_cost = cost_curve[b_type]
+            if building_multiplier < 1.0:  # Crisis event increases cost
+                token_cost *= (2.0 - building_multiplier)  # Inverse effect on cost
             
-            if game_state.level >= required_level.get(b_type, 1):
-                # Get actual cost with modifiers
-                token_cost = b_info['base_cost'] * (1.0 - (skill_bonus - 1.0) * 0.5)  # Skill reduces cost
-                if building_multiplier < 1.0:  # Crisis event increases cost
-                    token_cost *= (2.0 - building_multiplier)  # Inverse effect on cost
-                material_cost = b_info['material_cost']
-                
-                available_buildings.append({
-                    'type': b_type,
-                    'name': b_info['name'],
-                    'description': b_info['description'],
-                    'token_cost': round(token_cost, 2),
-                    'material_cost': material_cost,
-                    'produces': b_info['produces'],
-                    'production_rate': b_info['production_rate']
-                })
+            available_buildings.append({
+                'type': b_type,
+                'name': b_info['name'],
+                'description': b_info['description'],
+                'token_cost': round(token_cost, 2),
+                'material_cost': b_info['material_cost'],
+                'produces': b_info['produces'],
+                'production_rate': b_info['production_rate']
+            })
         
         # If the request is just to check available buildings
         if check_only:
+            skill_bonus = 1.0 + (game_state.building_skill * SKILL_LEVEL_BONUS)
             return {
                 "success": True,
                 "buildings": available_buildings,
+                "pending_income": pending_income(game_state, skill_bonus * building_multiplier),
                 "game_state": self._get_game_state_dict(game_state)
             }
         
@@ -447,38 +593,35 @@ class GameMechanics:
                 "game_state": self._get_game_state_dict(game_state)
             }
         
-        # Create the new building
-        new_building = Building(
-            game_state_id=game_state.id,
-            building_type=building_type,
-            level=1,
-            production_rate=selected_building['production_rate'],
-            produces_tokens=selected_building['produces'] == 'tokens',
-            produces_pixels=selected_building['produces'] == 'pixels',
-            produces_materials=selected_building['produces'] == 'materials',
-            produces_gems=selected_building['produces'] == 'gems',
-            efficiency=building_multiplier  # Apply event multiplier to efficiency
-        )
+        # Add experience for building
+        xp_gained = 20
+        
+        # Pay for the building, only if the player can still afford it
+        updated = apply_resources(game_state, {
+            'token_balance': -token_cost,
+            'materials': -material_cost,
+            'experience': xp_gained
+        })
+        if updated is None:
+            return {
+                "success": False,
+                "message": f"Not enough $PXPT or materials! Current: {game_state.token_balance:.2f} $PXPT, {game_state.materials} Materials",
+                "game_state": self._get_game_state_dict(game_state)
+            }
         
         # Update game state
-        game_state.token_balance -= token_cost
-        if material_cost > 0:
-            game_state.materials -= material_cost
         game_state.buildings_owned += 1
         
-        # Add experience and progress building skill
-        xp_gained = 20
-        game_state.experience += xp_gained
+        # Count the new building in its group (efficiency carries the event multiplier)
+        add_to_building_group(game_state, building_type, 1, building_multiplier)
+        add_building_production(game_state, building_type, 1, building_multiplier)
         
+        # Progress building skill
         building_skill_progress = random.randint(3, 5)  # Building gives good skill progress
         new_skill_level = self._progress_skill(game_state, 'building', building_skill_progress)
         
         # Check for level up
-        level_up = False
-        if game_state.experience >= game_state.level * XP_PER_LEVEL:
-            game_state.experience -= game_state.level * XP_PER_LEVEL
-            game_state.level += 1
-            level_up = True
+        level_up = apply_level_up(game_state, XP_PER_LEVEL)
         
         # Record transaction
         building_transaction = Transaction(
@@ -488,13 +631,12 @@ class GameMechanics:
             description=f'Purchased {selected_building["name"]}'
         )
         
-        db.session.add(new_building)
         db.session.add(building_transaction)
         
         # Check if we should trigger a random event
         self._maybe_trigger_random_event(user, game_state)
         
-        db.session.commit()
+        db.session.flush()
         
         # Build response message
         message = f"New {selected_building['name']} constructed! Cost: {token_cost} $PXPT"
@@ -529,25 +671,30 @@ class GameMechanics:
         }
     
     def _process_collection(self, user, game_state):
-        """Process building income collection action with enhanced mechanics."""
-        # Check if user has buildings in database
-        buildings = Building.query.filter_by(game_state_id=game_state.id).all()
+        """
+        Process building income collection action with enhanced mechanics.
         
-        if not buildings and game_state.buildings_owned == 0:
+        Income comes from the player's aggregated production vector, so the
+        cost does not depend on how many buildings they own.
+        """
+        if game_state.buildings_owned == 0 and not game_state.production_rates:
             return {
                 "success": False,
                 "message": "You don't own any buildings yet!",
                 "game_state": self._get_game_state_dict(game_state)
             }
         
+        # Players whose rates were never stored get them from their building groups
+        if game_state.production_rates is None and game_state.building_groups:
+            rebuild_production_rates(game_state, game_state.building_groups)
+        
         # Get active events that affect building income
-        active_events = self._get_active_events(affecting_activity='building')
-        building_multiplier = 1.0
-        for event in active_events:
-            building_multiplier *= event.building_multiplier
+        active_events = active_event_cache.events('building')
+        building_multiplier = active_event_cache.multiplier('building')
             
         # Apply skill level bonus
         skill_bonus = 1.0 + (game_state.building_skill * SKILL_LEVEL_BONUS)
+        collection_multiplier = skill_bonus * building_multiplier
         
         # Check if collection is available
         now = datetime.utcnow()
@@ -566,103 +713,41 @@ class GameMechanics:
             return {
                 "success": False,
                 "message": f"Collection not available yet. Next collection in {hours_remaining}h {minutes_remaining}m",
+                "pending_income": pending_income(game_state, collection_multiplier, now),
                 "game_state": self._get_game_state_dict(game_state)
             }
         
         # Processing legacy buildings (old system) if any
-        if game_state.buildings_owned > len(buildings):
-            legacy_buildings = game_state.buildings_owned - len(buildings)
-            legacy_income = BUILDING_INCOME_BASE * legacy_buildings * skill_bonus * building_multiplier
+        legacy_buildings = game_state.buildings_owned - rated_building_count(game_state)
+        if legacy_buildings > 0:
+            legacy_income = BUILDING_INCOME_BASE * legacy_buildings * collection_multiplier
             legacy_income = round(legacy_income, 2)
-            
-            # Update game state for legacy buildings
-            game_state.token_balance += legacy_income
         else:
             legacy_income = 0
-            
-        # Process each building based on its type
-        total_tokens = legacy_income
-        total_pixels = 0
-        total_materials = 0
-        total_gems = 0
-        
-        building_details = []
         
-        for building in buildings:
-            # Get time since last collection for this building
-            time_factor = min(1.0, (now - building.last_collection).total_seconds() / cooldown_seconds)
-            building_efficiency = building.efficiency * skill_bonus * building_multiplier * time_factor
-            
-            # Calculate production based on building type and level
-            building_info = self._get_building_info(building.building_type, building.level)
-            if not building_info:
-                continue
-                
-            production_rate = building_info['production_rate'] * building_efficiency
-            
-            # Update game state based on what the building produces
-            production_info = {
-                'type': building.building_type,
-                'name': building_info['name'],
-                'level': building.level,
-                'efficiency': round(building_efficiency * 100, 1),
-                'produced': {}
-            }
-            
-            if building.produces_tokens:
-                # Special case for bank
-                if building.building_type == 'bank':
-                    # Bank produces interest on token balance
-                    interest = game_state.token_balance * production_rate * 0.01  # Convert to percentage
-                    interest = round(interest, 2)
-                    game_state.token_balance += interest
-                    total_tokens += interest
-                    production_info['produced']['tokens'] = interest
-                else:
-                    # Normal token production
-                    tokens = round(production_rate, 2)
-                    game_state.token_balance += tokens
-                    total_tokens += tokens
-                    production_info['produced']['tokens'] = tokens
-                    
-            if building.produces_pixels:
-                pixels = round(production_rate)
-                game_state.pixels += pixels
-                total_pixels += pixels
-                production_info['produced']['pixels'] = pixels
-                
-            if building.produces_materials:
-                materials = round(production_rate)
-                game_state.materials += materials
-                total_materials += materials
-                production_info['produced']['materials'] = materials
-                
-            if building.produces_gems:
-                gems = max(1, round(production_rate * 0.1))  # Gems are valuable, produce fewer
-                game_state.gems += gems
-                total_gems += gems
-                production_info['produced']['gems'] = gems
-                
-            # Update building last collection time
-            building.last_collection = now
-            
-            # Add to building details for response
-            building_details.append(production_info)
-            
         # Always give some XP for collection
         xp_gained = 5
-        game_state.experience += xp_gained
+            
+        income = collect_production(game_state, collection_multiplier, now)
+        total_tokens = round(legacy_income + income['tokens'], 2)
+        total_pixels = income['pixels']
+        total_materials = income['materials']
+        total_gems = income['gems']
+        
+        apply_resources(game_state, {
+            'token_balance': total_tokens,
+            'pixels': total_pixels,
+            'materials': total_materials,
+            'gems': total_gems,
+            'experience': xp_gained
+        })
         
         # Progress building skill
         building_skill_progress = random.randint(1, 2)  # Small progress for collection
         new_skill_level = self._progress_skill(game_state, 'building', building_skill_progress)
         
         # Check for level up
-        level_up = False
-        if game_state.experience >= game_state.level * XP_PER_LEVEL:
-            game_state.experience -= game_state.level * XP_PER_LEVEL
-            game_state.level += 1
-            level_up = True
+        level_up = apply_level_up(game_state, XP_PER_LEVEL)
         
         # Record transaction
         resources_collected = []
@@ -688,7 +773,7 @@ class GameMechanics:
         # Check if we should trigger a random event
         self._maybe_trigger_random_event(user, game_state)
         
-        db.session.commit()
+        db.session.flush()
         
         # Build response message
         message = f"Income collected!"
@@ -718,7 +803,10 @@ class GameMechanics:
                 "materials": total_materials,
                 "gems": total_gems
             },
-            "building_details": building_details,
+            "production_rates": {
+                resource: round(rate * collection_multiplier, 4)
+                for resource, rate in production_rates(game_state).items()
+            },
             "xp_gained": xp_gained,
             "level_up": level_up,
             "skill_up": new_skill_level,
@@ -726,6 +814,126 @@ class GameMechanics:
             "active_events": [{"name": e.name, "multiplier": e.building_multiplier} for e in active_events] if active_events else []
         }
     
+    def _process_market(self, user, game_state, params):
+        """
+        Process a market action.
+        
+        Params:
+            order_type: 'buy' or 'sell' to place a limit order, 'cancel' to cancel
+                one; without it the order books and the player's orders are returned
+            resource_type: 'pixels', 'materials' or 'gems'
+            quantity: Units to buy or sell
+            price: Limit price per unit in $PXPT
+            order_id: Order to cancel
+        """
+        order_type = params.get('order_type')
+        
+        if not order_type:
+            prices = mark_prices.snapshot(MARKET_RESOURCES)
+            holdings_value = sum(
+                (getattr(game_state, resource_type) or 0) * prices[resource_type]['price']
+                for resource_type in MARKET_RESOURCES
+            )
+            return {
+                "success": True,
+                "message": "Market overview",
+                "market": market_engine.overview(game_state),
+                "prices": prices,
+                "portfolio_value": round(game_state.token_balance + holdings_value, 2),
+                "fee_percentage": round(MARKET_FEE_PERCENTAGE * active_event_cache.multiplier('market'), 2),
+                "game_state": self._get_game_state_dict(game_state)
+            }
+        
+        if order_type == 'cancel':
+            try:
+                order_id = int(params.get('order_id'))
+            except (TypeError, ValueError):
+                order_id = None
+            cancelled = market_engine.cancel_order(user, game_state, order_id) if order_id else None
+            if not cancelled:
+                return {
+                    "success": False,
+                    "message": "Order not found or no longer active",
+                    "game_state": self._get_game_state_dict(game_state)
+                }
+            db.session.flush()
+            return {
+                "success": True,
+                "message": f"Order cancelled. {cancelled['refunded']} unfilled {cancelled['resource_type']} released.",
+                "order": cancelled,
+                "game_state": self._get_game_state_dict(game_state)
+            }
+        
+        # Validate the order
+        resource_type = params.get('resource_type')
+        try:
+            quantity = int(params.get('quantity'))
+            price = round(float(params.get('price')), 2)
+        except (TypeError, ValueError):
+            quantity, price = 0, 0.0
+        
+        error = None
+        if order_type not in ('buy', 'sell'):
+            error = f"Unknown order type: {order_type}"
+        elif resource_type not in MARKET_RESOURCES:
+            error = f"Unknown resource: {resource_type}"
+        elif quantity <= 0 or price <= 0 or not math.isfinite(price):
+            error = "Quantity and price must be positive"
+        elif game_state.token_balance < MARKET_MIN_TOKEN_BALANCE:
+            error = f"You need at least {MARKET_MIN_TOKEN_BALANCE} $PXPT to trade on the market"
+        elif order_type == 'buy' and game_state.token_balance < quantity * price:
+            error = f"Not enough $PXPT. This order needs {round(quantity * price, 2)} $PXPT."
+        elif order_type == 'sell' and (getattr(game_state, resource_type) or 0) < quantity:
+            error = f"Not enough {resource_type}. You have {getattr(game_state, resource_type) or 0}."
+        elif market_engine.active_order_count(game_state.id) >= MARKET_MAX_ACTIVE_ORDERS:
+            error = f"You already have {MARKET_MAX_ACTIVE_ORDERS} active orders"
+        else:
+            # Orders never trade against the player's own resting orders
+            book = market_engine.book(resource_type)
+            for own in book.owner_orders(game_state.id):
+                if own.order_type != order_type and (
+                    own.price <= price if order_type == 'buy' else own.price >= price
+                ):
+                    error = "This order would trade with one of your own orders"
+                    break
+        
+        if error:
+            return {
+                "success": False,
+                "message": error,
+                "game_state": self._get_game_state_dict(game_state)
+            }
+        
+        # Sellers pay the market fee, scaled by any active market event
+        fee_rate = MARKET_FEE_PERCENTAGE / 100 * active_event_cache.multiplier('market')
+        order, fills = market_engine.place_order(
+            user, game_state, order_type, resource_type, quantity, price, fee_rate
+        )
+        
+        filled = order.filled_quantity
+        if filled == quantity:
+            message = f"Order filled: {'bought' if order_type == 'buy' else 'sold'} {filled} {resource_type}"
+        elif filled:
+            message = f"Order partly filled ({filled}/{quantity} {resource_type}); the rest is on the order book"
+        else:
+            message = f"Order placed on the {resource_type} order book"
+        
+        return {
+            "success": True,
+            "message": message,
+            "order": {
+                "id": order.id,
+                "order_type": order.order_type,
+                "resource_type": order.resource_type,
+                "quantity": order.quantity,
+                "filled_quantity": filled,
+                "price_per_unit": order.price_per_unit,
+                "is_active": order.is_active
+            },
+            "fills": [{"price": fill_price, "quantity": fill} for fill_price, fill in fills],
+            "game_state": self._get_game_state_dict(game_state)
+        }
+    
     def _get_game_state_dict(self, game_state):
         """Convert GameState model to dictionary for API response."""
         return {
@@ -788,30 +996,9 @@ class GameMechanics:
             affecting_activity: Optional string to filter events by activity ('mining', 'art', 'building', 'market')
             
         Returns:
-            List of GameEvent instances that are currently active
+            Tuple of CachedEvent instances that are currently active
         """
-        now = datetime.utcnow()
-        query = GameEvent.query.filter(
-            GameEvent.is_active == True,
-            GameEvent.start_time <= now,
-            GameEvent.end_time >= now
-        )
-        
-        # Filter by activity if requested
-        if affecting_activity == 'mining':
-            # Events with mining multiplier not equal to 1.0
-            query = query.filter(GameEvent.mining_multiplier != 1.0)
-        elif affecting_activity == 'art':
-            # Events with art multiplier not equal to 1.0
-            query = query.filter(GameEvent.art_multiplier != 1.0)
-        elif affecting_activity == 'building':
-            # Events with building multiplier not equal to 1.0
-            query = query.filter(GameEvent.building_multiplier != 1.0)
-        elif affecting_activity == 'market':
-            # Events with market fee multiplier not equal to 1.0
-            query = query.filter(GameEvent.market_fee_multiplier != 1.0)
-            
-        return query.all()
+        return active_event_cache.events(affecting_activity)
     
     def _get_active_event_message(self, events):
         """
@@ -935,7 +1122,8 @@ class GameMechanics:
         )
         
         db.session.add(event)
-        # Don't commit here - the caller will handle the commit
+        # Don't commit here - the caller will handle the commit, which also
+        # invalidates the active event cache
         
         return event
         
@@ -948,19 +1136,9 @@ class GameMechanics:
             level: Optional integer level of the building
             
         Returns:
-            dict with building properties or None if type not found
+            Read-only mapping with building properties or None if type not found
         """
-        if building_type not in BUILDING_TYPES:
-            return None
-            
-        building_info = BUILDING_TYPES[building_type].copy()
-        
-        # Calculate level-based values
-        if level > 1:
-            building_info['production_rate'] *= building_info['level_multiplier'] ** (level - 1)
-            building_info['base_cost'] *= BUILDING_UPGRADE_MULTIPLIER ** (level - 1)
-            
-        return building_info
+        return get_building_level(building_type, level)
         
     def _get_resource_market_price(self, resource_type):
         """
@@ -972,24 +1150,11 @@ class GameMechanics:
         Returns:
             Float price per unit
         """
-        # Get latest market history for this resource
-        latest = MarketHistory.query.filter_by(
-            resource_type=resource_type
-        ).order_by(MarketHistory.timestamp.desc()).first()
-        
-        if not latest:
-            # Default prices if no history exists
-            if resource_type == 'pixels':
-                return 0.1
-            elif resource_type == 'materials':
-                return 0.5
-            elif resource_type == 'gems':
-                return 5.0
-            else:
-                return 1.0
+        # Cached mark price - no query unless the cached price has gone stale
+        mark_price = mark_prices.get(resource_type)
                 
         # Add some small random variation to the price (-5% to +5%)
         variation = random.uniform(-0.05, 0.05)
-        price = latest.avg_price * (1 + variation)
+        price = mark_price * (1 + variation)
         
         return round(price, 2)
@@ -0,0 +1,215 @@
+"""
+Token balance leaderboard for the Pixel Plaza Token game.
+Keeps every player's balance in a sorted in-memory index that is updated
+incrementally when a commit changes a balance, so the top N and any player's
+rank are answered without sorting the game_state table.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from models import User, GameState
+from config import LEADERBOARD_RECONCILE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """
+    Sorted index of (balance, user_id) pairs for the players of this process.
+
+    Entries are kept in ascending order of (-balance, user_id), so the richest
+    player is first and ties rank the older account first. Ranks are found by
+    bisection. Writes from other processes are picked up by the periodic
+    reconciliation against the database, run by one request at a time while
+    the others keep reading the current index.
+    """
+
+    def __init__(self, reconcile_seconds=LEADERBOARD_RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.RLock()
+        self._keys = []
+        self._balances = {}
+        self._loaded_at = None
+        # Held by the request rebuilding the index
+        self._reconcile_lock = threading.Lock()
+        # Changes committed while a reconcile is reading the database, one dict per running reconcile
+        self._journals = []
+
+    def _key(self, user_id, balance):
+        return (-(balance or 0.0), user_id)
+
+    def _move(self, keys, balances, user_id, balance):
+        """
+        Move a player to a new balance (None removes them) in a sorted key list.
+
+        Finding the entries is O(log n), but deleting and inserting shift the
+        list, so a move is O(n); the shift is a memmove of pointers.
+        """
+        old_balance = balances.pop(user_id, None)
+        if old_balance is not None:
+            index = bisect.bisect_left(keys, self._key(user_id, old_balance))
+            if index < len(keys) and keys[index] == self._key(user_id, old_balance):
+                del keys[index]
+        if balance is not None:
+            bisect.insort(keys, self._key(user_id, balance))
+            balances[user_id] = balance
+
+    def reconcile(self):
+        """
+        Rebuild the index from the database.
+
+        Changes committed while the rows are being read may be missing from
+        them, so they are replayed onto the new index before it is swapped in.
+        """
+        journal = {}
+        with self._lock:
+            self._journals.append(journal)
+        try:
+            rows = GameState.query.with_entities(GameState.user_id, GameState.token_balance).all()
+            balances = {user_id: balance or 0.0 for user_id, balance in rows}
+            keys = sorted(self._key(user_id, balance) for user_id, balance in balances.items())
+
+            with self._lock:
+                for user_id, balance in journal.items():
+                    self._move(keys, balances, user_id, balance)
+                if self._loaded_at is not None:
+                    drift = sum(1 for user_id, balance in balances.items()
+                                if self._balances.get(user_id) != balance)
+                    if drift:
+                        logger.info(f"Leaderboard reconciliation corrected {drift} balances")
+                self._keys = keys
+                self._balances = balances
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journals.remove(journal)
+
+    def _is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reconcile_seconds
+
+    def _ensure_fresh(self):
+        if not self._is_stale():
+            return
+        # Until the first load there is nothing to serve, so wait for it
+        if not self._reconcile_lock.acquire(blocking=self._loaded_at is None):
+            return  # Another request is reconciling; serve the current index
+        try:
+            if self._is_stale():
+                self.reconcile()
+        finally:
+            self._reconcile_lock.release()
+
+    def update(self, user_id, balance):
+        """Move a player to their new balance."""
+        balance = balance or 0.0
+        with self._lock:
+            for journal in self._journals:
+                journal[user_id] = balance
+            if self._loaded_at is None:
+                return  # Loaded lazily from the database on first read
+            if self._balances.get(user_id) == balance:
+                return
+            self._move(self._keys, self._balances, user_id, balance)
+
+    def remove(self, user_id):
+        """Drop a player from the leaderboard."""
+        with self._lock:
+            for journal in self._journals:
+                journal[user_id] = None
+            self._move(self._keys, self._balances, user_id, None)
+
+    def top(self, limit=10):
+        """
+        Get the highest balances.
+
+        Returns:
+            List of (user_id, token_balance) tuples, richest first
+        """
+        self._ensure_fresh()
+        with self._lock:
+            return [(user_id, -negative_balance) for negative_balance, user_id in self._keys[:limit]]
+
+    def rank(self, user_id):
+        """
+        Get a player's 1-based rank.
+
+        Returns:
+            Integer rank, or None if the player has no game state
+        """
+        self._ensure_fresh()
+        with self._lock:
+            balance = self._balances.get(user_id)
+            if balance is None:
+                return None
+            return bisect.bisect_left(self._keys, self._key(user_id, balance)) + 1
+
+    def size(self):
+        """Number of ranked players."""
+        self._ensure_fresh()
+        with self._lock:
+            return len(self._keys)
+
+    def top_players(self, limit=10):
+        """
+        Get the top players with their User and GameState rows.
+
+        Returns:
+            List of (User, GameState) tuples, richest first
+        """
+        ranked = self.top(limit)
+        if not ranked:
+            return []
+        user_ids = [user_id for user_id, _ in ranked]
+        rows = User.query.join(
+            GameState, GameState.user_id == User.id
+        ).with_entities(
+            User, GameState
+        ).filter(
+            User.id.in_(user_ids)
+        ).all()
+        by_user_id = {user.id: (user, game_state) for user, game_state in rows}
+        return [by_user_id[user_id] for user_id in user_ids if user_id in by_user_id]
+
+
+leaderboard = Leaderboard()
+
+
+def record_balance(session, user_id, balance):
+    """Queue a balance change to be applied to the leaderboard when the session commits."""
+    session.info.setdefault('leaderboard_balances', {})[user_id] = balance
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_balance_changes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, GameState):
+            record_balance(session, obj.user_id, obj.token_balance)
+    for obj in session.dirty:
+        if isinstance(obj, GameState) and get_history(obj, 'token_balance').has_changes():
+            record_balance(session, obj.user_id, obj.token_balance)
+    for obj in session.deleted:
+        if isinstance(obj, GameState):
+            record_balance(session, obj.user_id, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_balance_changes(session):
+    changes = session.info.pop('leaderboard_balances', None)
+    if not changes:
+        return
+    for user_id, balance in changes.items():
+        if balance is None:
+            leaderboard.remove(user_id)
+        else:
+            leaderboard.update(user_id, balance)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_balance_changes(session):
+    session.info.pop('leaderboard_balances', None)
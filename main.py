@@ -1,7 +1,19 @@
-from app import app
+from app import app, GAME_STATE_SPLIT_PENDING
+from task_scheduler import start_task_reset_scheduler
+from puzzle_pool import start_puzzle_pool_refiller
 import os
 import logging
 
+# Players are invisible to the split GameState model until their balances are moved
+if GAME_STATE_SPLIT_PENDING:
+    raise RuntimeError("Run migrate_game_state_split.py before starting the server")
+
+# Reset daily and weekly tasks in the background instead of on each request
+start_task_reset_scheduler(app)
+
+# Keep pregenerated mini-game puzzles ready
+start_puzzle_pool_refiller()
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     # Start the web application on port 5000
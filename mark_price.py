@@ -0,0 +1,142 @@
+"""
+Mark prices for the Pixel Plaza Token market.
+Keeps the current reference price of each resource in memory, shared by every
+caller in the process. A price is updated when a commit writes market fills or
+candles, and reloaded from the latest candle once it is older than
+MARK_PRICE_MAX_STALENESS_SECONDS, which bounds how stale a price can get when
+other processes are trading.
+"""
+
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import MarketHistory
+from config import MARK_PRICE_MAX_STALENESS_SECONDS, DEFAULT_RESOURCE_PRICES
+
+logger = logging.getLogger(__name__)
+
+
+class MarkPrice:
+    """A resource's reference price and when this process last confirmed it."""
+
+    __slots__ = ('price', 'price_change_24h', 'updated_at')
+
+    def __init__(self, price, price_change_24h, updated_at):
+        self.price = price
+        self.price_change_24h = price_change_24h
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f'<MarkPrice {self.price} ({self.price_change_24h:+}%)>'
+
+
+class MarkPriceService:
+    """
+    Process-local mark prices, one per resource.
+
+    Prices come from the close of the latest one-minute candle, or the default
+    price of a resource that has never traded.
+    """
+
+    def __init__(self, max_staleness_seconds=MARK_PRICE_MAX_STALENESS_SECONDS):
+        self.max_staleness_seconds = max_staleness_seconds
+        self._lock = threading.Lock()
+        self._prices = {}
+
+    def _load(self, resource_type):
+        candle = MarketHistory.query.with_entities(
+            MarketHistory.close_price, MarketHistory.price_change_24h
+        ).filter(
+            MarketHistory.resource_type == resource_type,
+            MarketHistory.period == '1m'
+        ).order_by(MarketHistory.timestamp.desc()).first()
+
+        if candle and candle.close_price is not None:
+            return MarkPrice(candle.close_price, candle.price_change_24h or 0.0, time.monotonic())
+        return MarkPrice(DEFAULT_RESOURCE_PRICES.get(resource_type, 1.0), 0.0, time.monotonic())
+
+    def quote(self, resource_type):
+        """
+        Get a resource's mark price, reloading it if it is too stale.
+
+        Returns:
+            MarkPrice
+        """
+        with self._lock:
+            mark = self._prices.get(resource_type)
+        if mark is not None and time.monotonic() - mark.updated_at < self.max_staleness_seconds:
+            return mark
+
+        mark = self._load(resource_type)
+        with self._lock:
+            self._prices[resource_type] = mark
+        return mark
+
+    def get(self, resource_type):
+        """Current mark price of a resource in $PXPT per unit."""
+        return self.quote(resource_type).price
+
+    def update(self, resource_type, price, price_change_24h=None):
+        """Set a resource's mark price from a committed trade or candle."""
+        with self._lock:
+            previous = self._prices.get(resource_type)
+            if price_change_24h is None:
+                price_change_24h = previous.price_change_24h if previous else 0.0
+            self._prices[resource_type] = MarkPrice(price, price_change_24h, time.monotonic())
+
+    def invalidate(self, resource_type=None):
+        """Reload a resource's price, or every price, on next use."""
+        with self._lock:
+            if resource_type is None:
+                self._prices.clear()
+            else:
+                self._prices.pop(resource_type, None)
+
+    def snapshot(self, resource_types):
+        """
+        Mark prices of several resources for an API response.
+
+        Returns:
+            dict mapping resource type to its price and 24 hour change
+        """
+        return {
+            resource_type: {
+                'price': mark.price,
+                'price_change_24h': mark.price_change_24h
+            }
+            for resource_type, mark in ((rt, self.quote(rt)) for rt in resource_types)
+        }
+
+
+mark_prices = MarkPriceService()
+
+
+def record_price(session, resource_type, price, price_change_24h=None):
+    """Queue a new mark price to be applied when the session commits."""
+    session.info.setdefault('mark_prices', {})[resource_type] = (price, price_change_24h)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_candle_prices(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, MarketHistory) and obj.period in (None, '1m'):
+            price = obj.close_price if obj.close_price is not None else obj.avg_price
+            if price is not None:
+                record_price(session, obj.resource_type, price, obj.price_change_24h)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_mark_prices(session):
+    prices = session.info.pop('mark_prices', None)
+    if not prices:
+        return
+    for resource_type, (price, price_change_24h) in prices.items():
+        mark_prices.update(resource_type, price, price_change_24h)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_mark_prices(session):
+    session.info.pop('mark_prices', None)
@@ -0,0 +1,599 @@
+"""
+Order book market for the Pixel Plaza Token game.
+Players trade pixels, materials and gems for $PXPT with limit orders. Each
+resource has an in-memory order book with price-time priority, so an incoming
+order is matched against the best resting orders with heap operations instead
+of scanning the open orders in SQL. The resting orders, counterparties,
+transactions and price candles touched by a submit are written back in a
+fixed number of statements, whatever the number of fills.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, update, case
+from sqlalchemy.orm import Session
+
+from app import db
+from models import GameState, MarketOrder, Transaction, game_state_hot_table
+from leaderboard import record_balance
+from resource_updates import apply_resources
+from market_candles import record_fills
+from config import MARKET_ORDER_EXPIRY_DAYS, MARKET_BOOK_RELOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Tradable resources; each is also the GameState column holding the player's stock
+MARKET_RESOURCES = ('pixels', 'materials', 'gems')
+
+# Crossing orders looked up in the database before an order is matched
+BOOK_CHECK_LIMIT = 50
+
+
+class MarketConflict(Exception):
+    """Raised when resting orders changed in the database after the in-memory book was loaded."""
+
+
+class BookOrder:
+    """A resting order in an order book."""
+
+    __slots__ = (
+        'id', 'game_state_id', 'user_id', 'order_type', 'resource_type',
+        'price', 'quantity', 'filled', 'created_at'
+    )
+
+    def __init__(self, id, game_state_id, user_id, order_type, resource_type, price, quantity, filled, created_at):
+        self.id = id
+        self.game_state_id = game_state_id
+        self.user_id = user_id
+        self.order_type = order_type
+        self.resource_type = resource_type
+        self.price = price
+        self.quantity = quantity
+        self.filled = filled
+        self.created_at = created_at
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+    def is_expired(self, now):
+        return self.created_at + timedelta(days=MARKET_ORDER_EXPIRY_DAYS) <= now
+
+    def __repr__(self):
+        return f'<BookOrder {self.order_type} {self.remaining} {self.resource_type} at {self.price}>'
+
+
+class OrderBook:
+    """
+    Resting buy and sell orders for one resource.
+
+    Bids and asks are heaps keyed on (price, order ID), so the best price is
+    matched first and orders at the same price in the order they were placed.
+    Removed orders are dropped from the heaps lazily when they reach the top.
+    """
+
+    def __init__(self, resource_type):
+        self.resource_type = resource_type
+        self.lock = threading.RLock()
+        self.loaded_at = None
+        self._orders = {}
+        self._bids = []
+        self._asks = []
+        self._by_owner = {}
+
+    def load(self):
+        """Rebuild the book from the active orders in the database."""
+        rows = db.session.query(MarketOrder, GameState.user_id).join(
+            GameState, GameState.id == MarketOrder.game_state_id
+        ).filter(
+            MarketOrder.resource_type == self.resource_type,
+            MarketOrder.is_active == True
+        ).all()
+
+        with self.lock:
+            self._orders = {}
+            self._bids = []
+            self._asks = []
+            self._by_owner = {}
+            for order, user_id in rows:
+                if order.is_cancelled:
+                    continue
+                self.add(BookOrder(
+                    order.id, order.game_state_id, user_id, order.order_type, order.resource_type,
+                    order.price_per_unit, order.quantity, order.filled_quantity or 0, order.created_at
+                ))
+            self.loaded_at = time.monotonic()
+
+    def add(self, order):
+        self._orders[order.id] = order
+        self._by_owner.setdefault(order.game_state_id, set()).add(order.id)
+        if order.order_type == 'buy':
+            heapq.heappush(self._bids, (-order.price, order.id))
+        else:
+            heapq.heappush(self._asks, (order.price, order.id))
+
+    def discard(self, order_id):
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            owned = self._by_owner.get(order.game_state_id)
+            if owned is not None:
+                owned.discard(order_id)
+                if not owned:
+                    del self._by_owner[order.game_state_id]
+        return order
+
+    def best(self, order_type):
+        """The best resting order on one side of the book, or None."""
+        heap = self._bids if order_type == 'buy' else self._asks
+        while heap:
+            order = self._orders.get(heap[0][1])
+            if order is not None and order.remaining > 0:
+                return order
+            heapq.heappop(heap)
+        return None
+
+    def owner_orders(self, game_state_id):
+        """A player's resting orders in this book."""
+        return [self._orders[order_id] for order_id in self._by_owner.get(game_state_id, ())]
+
+    def depth(self, order_type, levels=5):
+        """
+        Aggregated quantity at the best price levels of one side.
+
+        Returns:
+            List of (price, quantity) tuples, best price first
+        """
+        heap = self._bids if order_type == 'buy' else self._asks
+        totals = {}
+        for key, order_id in heapq.nsmallest(len(heap), heap):
+            order = self._orders.get(order_id)
+            if order is None or order.remaining <= 0:
+                continue
+            if order.price not in totals and len(totals) == levels:
+                break
+            totals[order.price] = totals.get(order.price, 0) + order.remaining
+        return list(totals.items())
+
+
+class Settlement:
+    """Database changes collected while matching one order, written by MarketEngine._settle."""
+
+    def __init__(self, now):
+        self.now = now
+        self.maker_updates = {}  # order ID -> (filled before, filled after, still active)
+        self.credits = {}  # game state ID -> {column: delta}
+        self.owners = {}  # game state ID -> user ID
+        self.transactions = []
+
+    def credit(self, order, column, amount):
+        """Add to a column of the game state owning an order."""
+        game_state_id = order.game_state_id
+        self.owners[game_state_id] = order.user_id
+        deltas = self.credits.setdefault(game_state_id, {})
+        deltas[column] = deltas.get(column, 0) + amount
+
+    def update_maker(self, order, filled_before, active):
+        previous = self.maker_updates.get(order.id)
+        if previous is not None:
+            filled_before = previous[0]
+        self.maker_updates[order.id] = (filled_before, order.filled, active)
+
+    def record(self, user_id, tx_type, amount, description):
+        self.transactions.append({
+            'user_id': user_id,
+            'type': tx_type,
+            'amount': round(amount, 2),
+            'description': description,
+            'timestamp': self.now
+        })
+
+
+class MarketEngine:
+    """
+    Matching engine over one order book per resource.
+
+    The books are loaded from the database on first use and reloaded
+    periodically to pick up orders placed by other processes; an order is
+    also checked against the crossing orders in the database before it is
+    matched, and resting orders left crossing each other are matched first. Matching
+    updates a book right away; if the transaction is rolled back, the books
+    it touched are reloaded. Resting orders are only updated if they still
+    hold the fill quantity the book expected, so a stale book fails the
+    submit with MarketConflict instead of double-filling an order.
+    """
+
+    def __init__(self, reload_seconds=MARKET_BOOK_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._books = {}
+
+    def book(self, resource_type):
+        """The loaded order book of a resource."""
+        with self._lock:
+            book = self._books.get(resource_type)
+            if book is None:
+                book = self._books[resource_type] = OrderBook(resource_type)
+        with book.lock:
+            if book.loaded_at is None or time.monotonic() - book.loaded_at >= self.reload_seconds:
+                book.load()
+        return book
+
+    def invalidate(self, resource_type=None):
+        """Reload a book, or all books, on next use."""
+        with self._lock:
+            books = [self._books[resource_type]] if resource_type in self._books else (
+                list(self._books.values()) if resource_type is None else []
+            )
+        for book in books:
+            with book.lock:
+                book.loaded_at = None
+
+    def active_order_count(self, game_state_id, now=None):
+        """Number of a player's resting orders across all resources."""
+        now = now or datetime.utcnow()
+        return sum(
+            1 for resource_type in MARKET_RESOURCES
+            for order in self.book(resource_type).owner_orders(game_state_id)
+            if not order.is_expired(now)
+        )
+
+    def place_order(self, user, game_state, order_type, resource_type, quantity, price, fee_rate):
+        """
+        Match a limit order against the book and rest any remainder.
+
+        The player's side of the trade is applied to their GameState; the
+        remainder of the order is held in escrow (tokens for a buy, the
+        resource for a sell) until it fills, is cancelled or expires. Sellers
+        pay fee_rate on their proceeds. Nothing is committed.
+
+        Args:
+            user: User model instance
+            game_state: GameState model instance
+            order_type: 'buy' or 'sell'
+            resource_type: One of MARKET_RESOURCES
+            quantity: Units to trade
+            price: Limit price per unit in $PXPT
+            fee_rate: Fraction of the proceeds taken as the market fee
+
+        Returns:
+            tuple: (MarketOrder row of the new order, list of (price, quantity) fills)
+        """
+        now = datetime.utcnow()
+        settlement = Settlement(now)
+        fills = []
+        remaining = quantity
+        opposite = 'sell' if order_type == 'buy' else 'buy'
+        crosses = (lambda p: p <= price) if order_type == 'buy' else (lambda p: p >= price)
+
+        book = self.book(resource_type)
+        _track_book(db.session, resource_type)
+
+        with book.lock:
+            # Pick up crossing orders another process rested since the book was loaded
+            if self._missing_crossing_orders(book, opposite, order_type, price):
+                book.load()
+            crossed_fills = self._uncross(book, settlement, fee_rate)
+
+            while remaining > 0:
+                maker = book.best(opposite)
+                if maker is None or not crosses(maker.price):
+                    break
+                if maker.is_expired(now):
+                    self._expire(book, maker, settlement)
+                    continue
+
+                fill = min(remaining, maker.remaining)
+                filled_before = maker.filled
+                maker.filled += fill
+                remaining -= fill
+                fills.append((maker.price, fill))
+
+                value = maker.price * fill
+                if maker.order_type == 'sell':
+                    proceeds = value * (1 - fee_rate)
+                    settlement.credit(maker, 'token_balance', proceeds)
+                    settlement.record(maker.user_id, 'market_sell', proceeds,
+                                      f'Sold {fill} {resource_type} at {maker.price} $PXPT')
+                else:
+                    settlement.credit(maker, resource_type, fill)
+                    settlement.record(maker.user_id, 'market_buy', -value,
+                                      f'Bought {fill} {resource_type} at {maker.price} $PXPT')
+                settlement.credit(maker, 'market_transactions', 1)
+
+                if maker.remaining <= 0:
+                    book.discard(maker.id)
+                settlement.update_maker(maker, filled_before, maker.remaining > 0)
+
+        filled = quantity - remaining
+        spent = sum(fill_price * fill for fill_price, fill in fills)
+
+        # The player's own side of the fills, plus escrow for the remainder,
+        # applied atomically so a concurrent spend can not overdraw the player
+        if order_type == 'buy':
+            escrow = remaining * price
+            deltas = {'token_balance': -(spent + escrow), resource_type: filled}
+            if filled:
+                settlement.record(user.id, 'market_buy', -spent, f'Bought {filled} {resource_type}')
+            if remaining:
+                settlement.record(user.id, 'market_order', -escrow,
+                                  f'Buy order for {remaining} {resource_type} at {price} $PXPT')
+        else:
+            proceeds = spent * (1 - fee_rate)
+            deltas = {resource_type: -quantity, 'token_balance': proceeds}
+            if filled:
+                settlement.record(user.id, 'market_sell', proceeds, f'Sold {filled} {resource_type}')
+        deltas['market_transactions'] = 1
+        if apply_resources(game_state, deltas) is None:
+            raise MarketConflict("Your balance changed while matching; please retry")
+        game_state.last_market_action = now
+
+        order = MarketOrder(
+            game_state_id=game_state.id,
+            order_type=order_type,
+            resource_type=resource_type,
+            quantity=quantity,
+            price_per_unit=price,
+            filled_quantity=filled,
+            is_active=remaining > 0,
+            is_cancelled=False,
+            created_at=now,
+            completed_at=None if remaining else now
+        )
+        db.session.add(order)
+        db.session.flush()
+
+        if remaining:
+            with book.lock:
+                book.add(BookOrder(
+                    order.id, game_state.id, user.id, order_type, resource_type,
+                    price, quantity, filled, now
+                ))
+
+        self._settle(settlement, game_state)
+        record_fills(resource_type, crossed_fills + fills, now)
+        return order, fills
+
+    def cancel_order(self, user, game_state, order_id):
+        """
+        Cancel one of a player's active orders and release its escrow.
+
+        Nothing is committed.
+
+        Returns:
+            Cancelled order as a dict, or None if the player has no such active order
+        """
+        now = datetime.utcnow()
+        row = db.session.execute(
+            update(MarketOrder).where(
+                MarketOrder.id == order_id,
+                MarketOrder.game_state_id == game_state.id,
+                MarketOrder.is_active == True
+            ).values(
+                is_active=False,
+                is_cancelled=True,
+                completed_at=now
+            ).returning(
+                MarketOrder.order_type, MarketOrder.resource_type, MarketOrder.quantity,
+                MarketOrder.filled_quantity, MarketOrder.price_per_unit
+            ),
+            execution_options={'synchronize_session': False}
+        ).first()
+        if row is None:
+            return None
+
+        order_type, resource_type, quantity, filled, price = row
+        remaining = quantity - (filled or 0)
+        if order_type == 'buy':
+            refund = remaining * price
+            apply_resources(game_state, {'token_balance': refund})
+            db.session.add(Transaction(
+                user_id=user.id,
+                type='market_refund',
+                amount=round(refund, 2),
+                description=f'Cancelled buy order for {remaining} {resource_type}'
+            ))
+        else:
+            apply_resources(game_state, {resource_type: remaining})
+        game_state.last_market_action = now
+
+        _track_book(db.session, resource_type)
+        book = self.book(resource_type)
+        with book.lock:
+            book.discard(order_id)
+
+        return {
+            'id': order_id,
+            'order_type': order_type,
+            'resource_type': resource_type,
+            'quantity': quantity,
+            'filled_quantity': filled or 0,
+            'price_per_unit': price,
+            'refunded': remaining
+        }
+
+    def _missing_crossing_orders(self, book, opposite, order_type, price):
+        """Whether the database has resting orders crossing price that the book does not hold."""
+        crossing = MarketOrder.price_per_unit <= price if order_type == 'buy' else MarketOrder.price_per_unit >= price
+        order_ids = db.session.query(MarketOrder.id).filter(
+            MarketOrder.resource_type == book.resource_type,
+            MarketOrder.order_type == opposite,
+            MarketOrder.is_active == True,
+            crossing
+        ).limit(BOOK_CHECK_LIMIT).all()
+        return any(order_id not in book._orders for order_id, in order_ids)
+
+    def _uncross(self, book, settlement, fee_rate):
+        """
+        Match resting bids and asks that cross each other.
+
+        Two processes resting crossing orders at the same time leave them both
+        in the book after a reload; they trade at the older order's price here,
+        before the next order for the resource is matched.
+
+        Returns:
+            List of (price, quantity) fills
+        """
+        now = settlement.now
+        resource_type = book.resource_type
+        fills = []
+        while True:
+            bid, ask = book.best('buy'), book.best('sell')
+            if bid is None or ask is None or bid.price < ask.price:
+                break
+            expired = bid if bid.is_expired(now) else ask if ask.is_expired(now) else None
+            if expired is not None:
+                self._expire(book, expired, settlement)
+                continue
+            if bid.game_state_id == ask.game_state_id:
+                break  # Orders never trade against their owner's other orders
+
+            price = bid.price if bid.id < ask.id else ask.price
+            fill = min(bid.remaining, ask.remaining)
+            fills.append((price, fill))
+            for order in (bid, ask):
+                filled_before = order.filled
+                order.filled += fill
+                if order.remaining <= 0:
+                    book.discard(order.id)
+                settlement.update_maker(order, filled_before, order.remaining > 0)
+                settlement.credit(order, 'market_transactions', 1)
+
+            # The buyer escrowed their bid price and gets the difference back
+            settlement.credit(bid, resource_type, fill)
+            refund = (bid.price - price) * fill
+            if refund:
+                settlement.credit(bid, 'token_balance', refund)
+            settlement.record(bid.user_id, 'market_buy', -price * fill,
+                              f'Bought {fill} {resource_type} at {price} $PXPT')
+            proceeds = price * fill * (1 - fee_rate)
+            settlement.credit(ask, 'token_balance', proceeds)
+            settlement.record(ask.user_id, 'market_sell', proceeds,
+                              f'Sold {fill} {resource_type} at {price} $PXPT')
+        return fills
+
+    def _expire(self, book, order, settlement):
+        """Take an expired order off the book and return its escrow to the owner."""
+        book.discard(order.id)
+        if order.order_type == 'buy':
+            refund = order.remaining * order.price
+            settlement.credit(order, 'token_balance', refund)
+            settlement.record(order.user_id, 'market_refund', refund,
+                              f'Expired buy order for {order.remaining} {order.resource_type}')
+        else:
+            settlement.credit(order, order.resource_type, order.remaining)
+        settlement.update_maker(order, order.filled, False)
+
+    def _settle(self, settlement, game_state=None):
+        """
+        Write the resting order updates, counterparty credits and transactions of a match.
+
+        Credits to game_state, the loaded state of the player placing the
+        order (whose resting orders may have been uncrossed), go through
+        apply_resources so its version stays in step with the session.
+        """
+        now = settlement.now
+
+        own_credits = settlement.credits.pop(game_state.id, None) if game_state is not None else None
+        if own_credits and apply_resources(game_state, own_credits) is None:
+            raise MarketConflict("Your balance changed while matching; please retry")
+
+        if settlement.maker_updates:
+            updates = settlement.maker_updates
+            order_ids = list(updates)
+            values = {
+                'filled_quantity': case(
+                    {order_id: after for order_id, (_, after, _) in updates.items()},
+                    value=MarketOrder.id
+                ),
+                'is_active': case(
+                    {order_id: active for order_id, (_, _, active) in updates.items()},
+                    value=MarketOrder.id
+                )
+            }
+            closed = {order_id: now for order_id, (_, _, active) in updates.items() if not active}
+            if closed:
+                values['completed_at'] = case(closed, value=MarketOrder.id, else_=MarketOrder.completed_at)
+            updated = db.session.execute(
+                update(MarketOrder).where(
+                    MarketOrder.id.in_(order_ids),
+                    MarketOrder.is_active == True,
+                    MarketOrder.filled_quantity == case(
+                        {order_id: before for order_id, (before, _, _) in updates.items()},
+                        value=MarketOrder.id
+                    )
+                ).values(**values).returning(MarketOrder.id),
+                execution_options={'synchronize_session': False}
+            ).scalars().all()
+            if len(updated) != len(order_ids):
+                raise MarketConflict("Resting orders changed while matching; please retry")
+
+        if settlement.credits:
+            # Every credited column lives in the narrow game_state_hot row
+            credits = settlement.credits
+            hot = game_state_hot_table
+            values = {}
+            for column in ('token_balance', 'pixels', 'materials', 'gems', 'market_transactions'):
+                deltas = {gs_id: deltas[column] for gs_id, deltas in credits.items() if column in deltas}
+                if deltas:
+                    values[column] = hot.c[column] + case(deltas, value=hot.c.game_state_id, else_=0)
+            # Counterparties are not loaded in this session, so bump their
+            # version here for clients fetching state deltas
+            values['state_version'] = hot.c.state_version + 1
+            rows = db.session.execute(
+                update(hot).where(
+                    hot.c.game_state_id.in_(list(credits))
+                ).values(**values).returning(hot.c.game_state_id, hot.c.token_balance)
+            ).all()
+            for game_state_id, balance in rows:
+                record_balance(db.session, settlement.owners[game_state_id], balance)
+
+        if settlement.transactions:
+            db.session.execute(insert(Transaction), settlement.transactions)
+
+    def overview(self, game_state, levels=5):
+        """
+        Order book depth for every resource and the player's resting orders.
+
+        Returns:
+            dict with 'books' (bids and asks per resource) and 'orders'
+        """
+        books = {}
+        orders = []
+        for resource_type in MARKET_RESOURCES:
+            book = self.book(resource_type)
+            with book.lock:
+                books[resource_type] = {
+                    'bids': book.depth('buy', levels),
+                    'asks': book.depth('sell', levels)
+                }
+                orders.extend({
+                    'id': order.id,
+                    'order_type': order.order_type,
+                    'resource_type': order.resource_type,
+                    'quantity': order.quantity,
+                    'filled_quantity': order.filled,
+                    'price_per_unit': order.price
+                } for order in book.owner_orders(game_state.id))
+        return {'books': books, 'orders': sorted(orders, key=lambda order: order['id'])}
+
+
+market_engine = MarketEngine()
+
+
+def _track_book(session, resource_type):
+    """Remember that this transaction changed a book, so a rollback reloads it."""
+    session.info.setdefault('market_books_touched', set()).add(resource_type)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_touched_books(session):
+    session.info.pop('market_books_touched', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reload_touched_books(session):
+    for resource_type in session.info.pop('market_books_touched', ()):
+        market_engine.invalidate(resource_type)
@@ -0,0 +1,194 @@
+"""
+OHLCV candles for the Pixel Plaza Token market.
+Every match is folded into the 1-minute, 1-hour and 1-day MarketHistory
+candles of its resource with a single upsert, so price charts and the 24 hour
+price change are read from a handful of candle rows instead of raw fills.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, insert, case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import MarketHistory
+from mark_price import record_price
+
+logger = logging.getLogger(__name__)
+
+# Candle period -> length
+CANDLE_PERIODS = {
+    '1m': timedelta(minutes=1),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1)
+}
+
+CANDLE_KEY = ('resource_type', 'period', 'timestamp')
+
+
+def period_start(timestamp, period):
+    """Start of the candle period containing a timestamp."""
+    if period == '1m':
+        return timestamp.replace(second=0, microsecond=0)
+    if period == '1h':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class ReferencePrices:
+    """
+    Closing price of each resource 24 hours ago, used for price_change_24h.
+
+    The reference is the close of the latest hourly candle starting at or
+    before the same hour yesterday. It only changes when the hour rolls over,
+    so it is looked up once per resource per hour.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices = {}  # resource type -> (reference hour, close price or None)
+
+    def get(self, resource_type, now):
+        reference_hour = period_start(now - timedelta(hours=24), '1h')
+        with self._lock:
+            cached = self._prices.get(resource_type)
+            if cached is not None and cached[0] == reference_hour:
+                return cached[1]
+
+        candle = MarketHistory.query.with_entities(MarketHistory.close_price).filter(
+            MarketHistory.resource_type == resource_type,
+            MarketHistory.period == '1h',
+            MarketHistory.timestamp <= reference_hour
+        ).order_by(MarketHistory.timestamp.desc()).first()
+        price = candle.close_price if candle else None
+
+        with self._lock:
+            self._prices[resource_type] = (reference_hour, price)
+        return price
+
+
+reference_prices = ReferencePrices()
+
+
+def record_fills(resource_type, fills, now=None):
+    """
+    Fold the fills of one match into the resource's candles.
+
+    Nothing is committed; the candles are updated in the transaction that
+    settles the fills.
+
+    Args:
+        resource_type: Traded resource
+        fills: List of (price, quantity) tuples in the order they were matched
+        now: Optional time of the match
+    """
+    if not fills:
+        return
+    now = now or datetime.utcnow()
+
+    volume = sum(quantity for _, quantity in fills)
+    close_price = fills[-1][0]
+    reference = reference_prices.get(resource_type, now)
+    price_change = round((close_price - reference) / reference * 100, 2) if reference else 0.0
+
+    rows = [{
+        'resource_type': resource_type,
+        'period': period,
+        'timestamp': period_start(now, period),
+        'open_price': fills[0][0],
+        'close_price': close_price,
+        'highest_price': max(price for price, _ in fills),
+        'lowest_price': min(price for price, _ in fills),
+        'avg_price': sum(price * quantity for price, quantity in fills) / volume,
+        'volume': volume,
+        'trade_count': len(fills),
+        'price_change_24h': price_change
+    } for period in CANDLE_PERIODS]
+
+    _upsert_candles(rows)
+    record_price(db.session, resource_type, close_price, price_change)
+
+
+def _merged_values(table, new):
+    """SET clause merging a new partial candle (new) into a stored one."""
+    return {
+        'close_price': new.close_price,
+        'highest_price': case((new.highest_price > table.c.highest_price, new.highest_price), else_=table.c.highest_price),
+        'lowest_price': case((new.lowest_price < table.c.lowest_price, new.lowest_price), else_=table.c.lowest_price),
+        'avg_price': (table.c.avg_price * table.c.volume + new.avg_price * new.volume) / (table.c.volume + new.volume),
+        'volume': table.c.volume + new.volume,
+        'trade_count': table.c.trade_count + new.trade_count,
+        'price_change_24h': new.price_change_24h
+    }
+
+
+def _upsert_candles(rows):
+    """Insert candles, merging into any stored candle for the same resource, period and start."""
+    table = MarketHistory.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(CANDLE_KEY),
+            set_=_merged_values(table, stmt.excluded)
+        )
+        db.session.execute(stmt)
+        return
+
+    # Other databases: update the stored candle, inserting it if there is none
+    for row in rows:
+        new = _CandleValues(row)
+        result = db.session.execute(
+            update(table).where(
+                *(table.c[key] == row[key] for key in CANDLE_KEY)
+            ).values(**_merged_values(table, new))
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(table).values(**row))
+
+
+class _CandleValues:
+    """Attribute access to a candle row's values, standing in for the excluded row of an upsert."""
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+
+def get_candles(resource_type, period, start=None, end=None, limit=200):
+    """
+    Get a resource's candles for a chart.
+
+    Args:
+        resource_type: Traded resource
+        period: One of CANDLE_PERIODS
+        start: Optional earliest candle start
+        end: Optional latest candle start
+        limit: Maximum number of candles, the most recent ones are kept
+
+    Returns:
+        List of candle dicts, oldest first
+    """
+    query = MarketHistory.query.filter(
+        MarketHistory.resource_type == resource_type,
+        MarketHistory.period == period
+    )
+    if start is not None:
+        query = query.filter(MarketHistory.timestamp >= start)
+    if end is not None:
+        query = query.filter(MarketHistory.timestamp <= end)
+    candles = query.order_by(MarketHistory.timestamp.desc()).limit(limit).all()
+
+    return [{
+        'time': candle.timestamp.isoformat(),
+        'open': candle.open_price,
+        'high': candle.highest_price,
+        'low': candle.lowest_price,
+        'close': candle.close_price,
+        'volume': candle.volume,
+        'avg_price': round(candle.avg_price, 4),
+        'trades': candle.trade_count,
+        'price_change_24h': candle.price_change_24h
+    } for candle in reversed(candles)]
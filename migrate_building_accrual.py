@@ -0,0 +1,111 @@
+"""
+Database migration script to store aggregated building production on the GameState table.
+Adds the production_rates, production_banked and production_accrued_at columns and
+fills them from the Building rows, banking what each building has produced since its
+last collection, so collecting income no longer needs to visit every building.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from datetime import datetime
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+from building_accrual import PRODUCTION_RESOURCES, building_production, dump_production_vector
+from config import COLLECTION_COOLDOWN_HOURS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+NEW_COLUMNS = [
+    ('production_rates', 'TEXT'),
+    ('production_banked', 'TEXT'),
+    ('production_accrued_at', 'TIMESTAMP')
+]
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace(' ', 'T'))
+    return value
+
+def run_migration():
+    """Run the database migration to add and backfill the building production columns."""
+    try:
+        logger.info("Starting database migration for building production accrual...")
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            existing_columns = {col['name'] for col in inspector.get_columns('game_state')}
+
+            with db.engine.begin() as connection:
+                for column_name, column_type in NEW_COLUMNS:
+                    if column_name not in existing_columns:
+                        connection.execute(sql_text(
+                            f"ALTER TABLE game_state ADD COLUMN {column_name} {column_type}"
+                        ))
+                        logger.info(f"Added column {column_name} to game_state table")
+                    else:
+                        logger.info(f"Column {column_name} already exists in game_state table")
+
+            if 'building' not in inspector.get_table_names():
+                logger.info("No building table, nothing to backfill")
+                logger.info("Database migration completed successfully!")
+                return True
+
+            now = datetime.utcnow()
+            cooldown_seconds = COLLECTION_COOLDOWN_HOURS * 3600
+            rates = {}
+            banked = {}
+            counts = {}
+
+            with db.engine.connect() as connection:
+                rows = connection.execute(sql_text("""
+                    SELECT game_state_id, building_type, level, efficiency, last_collection
+                    FROM building
+                """))
+                for game_state_id, building_type, level, efficiency, last_collection in rows:
+                    vector = building_production(building_type, level, efficiency)
+                    if vector is None:
+                        continue
+                    last_collection = _parse_timestamp(last_collection) or now
+                    time_factor = min(1.0, max(0.0, (now - last_collection).total_seconds() / cooldown_seconds))
+
+                    player_rates = rates.setdefault(game_state_id, dict.fromkeys(PRODUCTION_RESOURCES, 0.0))
+                    player_banked = banked.setdefault(game_state_id, dict.fromkeys(PRODUCTION_RESOURCES, 0.0))
+                    for resource, rate in vector.items():
+                        player_rates[resource] += rate
+                        player_banked[resource] += rate * time_factor
+                    counts[game_state_id] = counts.get(game_state_id, 0) + 1
+
+            updates = [
+                {
+                    'id': game_state_id,
+                    'rates': dump_production_vector(player_rates, buildings=counts[game_state_id]),
+                    'banked': dump_production_vector(banked[game_state_id]) if any(banked[game_state_id].values()) else None,
+                    'accrued_at': now
+                }
+                for game_state_id, player_rates in rates.items()
+            ]
+            for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+                with db.engine.begin() as connection:
+                    connection.execute(sql_text("""
+                        UPDATE game_state
+                        SET production_rates = :rates, production_banked = :banked,
+                            production_accrued_at = :accrued_at
+                        WHERE id = :id AND production_rates IS NULL
+                    """), updates[start:start + BACKFILL_BATCH_SIZE])
+            logger.info(f"Backfilled building production for {len(updates)} players")
+
+            logger.info("Database migration completed successfully!")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    run_migration()
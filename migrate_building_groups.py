@@ -0,0 +1,99 @@
+"""
+Database migration script to store buildings as counted groups.
+Creates the building_group table and collapses the Building rows into one row per
+player, building type and level, with the number of buildings and the sum of their
+efficiencies, then removes the collapsed Building rows.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+from models import BuildingGroup
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """Run the database migration to collapse buildings into building groups."""
+    try:
+        logger.info("Starting database migration for building groups...")
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            table_names = inspector.get_table_names()
+
+            if 'building_group' not in table_names:
+                BuildingGroup.__table__.create(db.engine)
+                logger.info("Created building_group table")
+            else:
+                logger.info("Table building_group already exists")
+
+            if 'building' not in table_names:
+                logger.info("No building table, nothing to collapse")
+                logger.info("Database migration completed successfully!")
+                return True
+
+            # Merge into existing groups and insert the rest, then drop the
+            # collapsed rows, all in one transaction
+            with db.engine.begin() as connection:
+                connection.execute(sql_text("""
+                    CREATE TEMPORARY TABLE building_group_collapse AS
+                    SELECT game_state_id, building_type, COALESCE(level, 1) AS level,
+                           COUNT(*) AS building_count,
+                           SUM(COALESCE(efficiency, 1.0)) AS efficiency_sum,
+                           MIN(created_at) AS first_created,
+                           MAX(COALESCE(last_upgraded, created_at)) AS last_changed
+                    FROM building
+                    GROUP BY game_state_id, building_type, COALESCE(level, 1)
+                """))
+
+                merged = connection.execute(sql_text("""
+                    UPDATE building_group
+                    SET count = count + (
+                            SELECT c.building_count FROM building_group_collapse c
+                            WHERE c.game_state_id = building_group.game_state_id
+                              AND c.building_type = building_group.building_type
+                              AND c.level = building_group.level),
+                        efficiency_total = efficiency_total + (
+                            SELECT c.efficiency_sum FROM building_group_collapse c
+                            WHERE c.game_state_id = building_group.game_state_id
+                              AND c.building_type = building_group.building_type
+                              AND c.level = building_group.level)
+                    WHERE EXISTS (
+                        SELECT 1 FROM building_group_collapse c
+                        WHERE c.game_state_id = building_group.game_state_id
+                          AND c.building_type = building_group.building_type
+                          AND c.level = building_group.level)
+                """)).rowcount
+
+                inserted = connection.execute(sql_text("""
+                    INSERT INTO building_group
+                        (game_state_id, building_type, level, count, efficiency_total, created_at, updated_at)
+                    SELECT c.game_state_id, c.building_type, c.level, c.building_count,
+                           c.efficiency_sum, c.first_created, c.last_changed
+                    FROM building_group_collapse c
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM building_group g
+                        WHERE g.game_state_id = c.game_state_id
+                          AND g.building_type = c.building_type
+                          AND g.level = c.level)
+                """)).rowcount
+
+                collapsed = connection.execute(sql_text("DELETE FROM building")).rowcount
+                connection.execute(sql_text("DROP TABLE building_group_collapse"))
+
+            logger.info(f"Collapsed {collapsed} buildings into {inserted} new and {merged} existing building groups")
+
+            logger.info("Database migration completed successfully!")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    run_migration()
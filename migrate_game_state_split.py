@@ -0,0 +1,88 @@
+"""
+Database migration script to split the frequently mutated GameState columns into game_state_hot.
+Creates the narrow game_state_hot table, copies each player's balances, resources and
+per-action counters into it, then drops those columns from the wide game_state table.
+Run it after migrate_state_version.py (the version column is moved here too; a
+state_version added to game_state afterwards is dropped by re-running this script)
+and before the new code serves traffic: GameState joins the two tables, so players
+without a game_state_hot row are invisible. Until it has run, the app does not create
+game_state_hot itself and main.py refuses to start the server.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+from models import game_state_hot_table
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Columns moving to game_state_hot, with the value used where game_state has NULL
+HOT_COLUMNS = [
+    ('token_balance', '0.0'),
+    ('pixels', '100'),
+    ('energy', '100'),
+    ('gems', '0'),
+    ('materials', '0'),
+    ('experience', '0'),
+    ('pixel_art_created', '0'),
+    ('market_transactions', '0'),
+    ('last_active', 'CURRENT_TIMESTAMP'),
+    ('state_version', '0')
+]
+
+def run_migration():
+    """Run the database migration to move the hot GameState columns to game_state_hot."""
+    try:
+        logger.info("Starting database migration for the game state hot/cold split...")
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+
+            if 'game_state' not in inspector.get_table_names():
+                logger.info("No game_state table, it will be created split")
+                logger.info("Database migration completed successfully!")
+                return True
+
+            if 'game_state_hot' not in inspector.get_table_names():
+                game_state_hot_table.create(db.engine)
+                logger.info("Created game_state_hot table")
+            else:
+                logger.info("Table game_state_hot already exists")
+
+            existing_columns = {col['name'] for col in inspector.get_columns('game_state')}
+            moving = [(name, default) for name, default in HOT_COLUMNS if name in existing_columns]
+
+            # Copy the hot columns and drop them from game_state in one transaction
+            with db.engine.begin() as connection:
+                target_columns = ', '.join(['game_state_id'] + [name for name, _ in HOT_COLUMNS])
+                source_columns = ', '.join(['id'] + [
+                    f"COALESCE({name}, {default})" if name in existing_columns else default
+                    for name, default in HOT_COLUMNS
+                ])
+                copied = connection.execute(sql_text(f"""
+                    INSERT INTO game_state_hot ({target_columns})
+                    SELECT {source_columns} FROM game_state
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM game_state_hot h WHERE h.game_state_id = game_state.id
+                    )
+                """)).rowcount
+                logger.info(f"Copied hot columns of {copied} game states to game_state_hot")
+
+                for name, _ in moving:
+                    connection.execute(sql_text(f"ALTER TABLE game_state DROP COLUMN {name}"))
+                    logger.info(f"Dropped column {name} from game_state table")
+
+            logger.info("Database migration completed successfully!")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,115 @@
+"""
+Database migration script to index the predicates used by the hot queries.
+Every index is recorded in the schema_migrations table under MIGRATION_VERSION.
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY so the
+tables stay writable while the migration runs against a live database.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIGRATION_VERSION = '007_hot_query_indexes'
+
+# (index name, table, columns) - keep in sync with __table_args__ in models.py
+INDEXES = [
+    ('ix_transaction_user_type_timestamp', 'transaction', ['user_id', 'type', 'timestamp']),
+    ('ix_mini_game_result_user_type_played', 'mini_game_result', ['user_id', 'game_type', 'played_at']),
+    ('ix_game_state_user_id', 'game_state', ['user_id']),
+    ('ix_user_task_user_task', 'user_task', ['user_id', 'task_id']),
+    ('ix_game_event_active_window', 'game_event', ['is_active', 'start_time', 'end_time']),
+    ('ix_market_history_resource_timestamp', 'market_history', ['resource_type', 'timestamp']),
+    ('ix_user_referred_by_id', 'user', ['referred_by_id']),
+]
+
+def _ensure_migrations_table(connection):
+    connection.execute(sql_text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+def _is_applied(connection, version):
+    row = connection.execute(
+        sql_text("SELECT version FROM schema_migrations WHERE version = :version"),
+        {'version': version}
+    ).first()
+    return row is not None
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+def run_migration():
+    """Run the database migration to create the hot query indexes."""
+    try:
+        logger.info(f"Starting database migration {MIGRATION_VERSION}...")
+        
+        with app.app_context():
+            with db.engine.begin() as connection:
+                _ensure_migrations_table(connection)
+                if _is_applied(connection, MIGRATION_VERSION):
+                    logger.info(f"Migration {MIGRATION_VERSION} already applied")
+                    return True
+            
+            inspector = inspect(db.engine)
+            table_names = set(inspector.get_table_names())
+            is_postgres = db.engine.dialect.name == 'postgresql'
+            
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+            engine = db.engine.execution_options(isolation_level='AUTOCOMMIT') if is_postgres else db.engine
+            
+            for index_name, table_name, columns in INDEXES:
+                if table_name not in table_names:
+                    logger.info(f"Table {table_name} does not exist, skipping index {index_name}")
+                    continue
+                
+                existing_indexes = {ix['name'] for ix in inspector.get_indexes(table_name)}
+                
+                with engine.connect() as connection:
+                    if is_postgres:
+                        # A failed concurrent build leaves an INVALID index behind; drop it and retry
+                        invalid = connection.execute(sql_text("""
+                            SELECT 1 FROM pg_class c
+                            JOIN pg_index i ON i.indexrelid = c.oid
+                            WHERE c.relname = :name AND NOT i.indisvalid
+                        """), {'name': index_name}).first()
+                        if invalid:
+                            logger.warning(f"Dropping invalid index {index_name} left by an earlier run")
+                            connection.execute(sql_text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(connection, index_name)}"))
+                            existing_indexes.discard(index_name)
+                    
+                    if index_name in existing_indexes:
+                        logger.info(f"Index {index_name} already exists on {table_name} table")
+                        continue
+                    
+                    column_list = ', '.join(_quote(connection, column) for column in columns)
+                    concurrently = 'CONCURRENTLY ' if is_postgres else ''
+                    connection.execute(sql_text(
+                        f"CREATE INDEX {concurrently}IF NOT EXISTS {_quote(connection, index_name)} "
+                        f"ON {_quote(connection, table_name)} ({column_list})"
+                    ))
+                    if not is_postgres:
+                        connection.commit()
+                    logger.info(f"Created index {index_name} on {table_name} table")
+            
+            with db.engine.begin() as connection:
+                connection.execute(
+                    sql_text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                    {'version': MIGRATION_VERSION}
+                )
+            
+            logger.info("Database migration completed successfully!")
+    
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+    
+    return True
+
+if __name__ == "__main__":
+    run_migration()
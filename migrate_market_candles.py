@@ -0,0 +1,68 @@
+"""
+Database migration script to store OHLCV candles in the MarketHistory table.
+Adds the period, open_price, close_price and trade_count columns and the unique
+index the candle upserts conflict on. Existing rows keep a NULL period and are
+not served as candles.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NEW_COLUMNS = [
+    ('period', 'VARCHAR(3)'),
+    ('open_price', 'FLOAT'),
+    ('close_price', 'FLOAT'),
+    ('trade_count', 'INTEGER DEFAULT 0')
+]
+
+def run_migration():
+    """Run the database migration to add the candle columns to market_history."""
+    try:
+        logger.info("Starting database migration for market candles...")
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+
+            if 'market_history' not in inspector.get_table_names():
+                logger.info("No market_history table, it will be created with the candle columns")
+                logger.info("Database migration completed successfully!")
+                return True
+
+            existing_columns = {col['name'] for col in inspector.get_columns('market_history')}
+            existing_indexes = {ix['name'] for ix in inspector.get_indexes('market_history')}
+
+            with db.engine.begin() as connection:
+                for column_name, column_type in NEW_COLUMNS:
+                    if column_name not in existing_columns:
+                        connection.execute(sql_text(
+                            f"ALTER TABLE market_history ADD COLUMN {column_name} {column_type}"
+                        ))
+                        logger.info(f"Added column {column_name} to market_history table")
+                    else:
+                        logger.info(f"Column {column_name} already exists in market_history table")
+
+                if 'ux_market_history_candle' not in existing_indexes:
+                    connection.execute(sql_text(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS ux_market_history_candle "
+                        "ON market_history (resource_type, period, timestamp)"
+                    ))
+                    logger.info("Created index ux_market_history_candle on market_history table")
+                else:
+                    logger.info("Index ux_market_history_candle already exists on market_history table")
+
+            logger.info("Database migration completed successfully!")
+
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    run_migration()
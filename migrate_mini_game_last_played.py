@@ -0,0 +1,79 @@
+"""
+Database migration script to store mini-game last-played times on the GameState table.
+Adds the mini_game_last_played column and fills it from the MiniGameResult history,
+so mini-game cooldowns no longer need to scan a player's results.
+This is a one-time script to update the database schema.
+"""
+
+import json
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+def run_migration():
+    """Run the database migration to add and backfill the mini_game_last_played column."""
+    try:
+        logger.info("Starting database migration for mini-game last played times...")
+        
+        with app.app_context():
+            inspector = inspect(db.engine)
+            existing_columns = {col['name'] for col in inspector.get_columns('game_state')}
+            
+            with db.engine.begin() as connection:
+                if 'mini_game_last_played' not in existing_columns:
+                    connection.execute(sql_text(
+                        "ALTER TABLE game_state ADD COLUMN mini_game_last_played TEXT"
+                    ))
+                    logger.info("Added column mini_game_last_played to game_state table")
+                else:
+                    logger.info("Column mini_game_last_played already exists in game_state table")
+            
+            if 'mini_game_result' not in inspector.get_table_names():
+                logger.info("No mini_game_result table, nothing to backfill")
+                logger.info("Database migration completed successfully!")
+                return True
+            
+            # Latest play per user and game type, aggregated in the database
+            with db.engine.connect() as connection:
+                rows = connection.execute(sql_text("""
+                    SELECT user_id, game_type, MAX(played_at) AS last_played
+                    FROM mini_game_result
+                    GROUP BY user_id, game_type
+                """)).all()
+            
+            last_played = {}
+            for user_id, game_type, played_at in rows:
+                if isinstance(played_at, str):
+                    played_at = played_at.replace(' ', 'T')
+                else:
+                    played_at = played_at.isoformat()
+                last_played.setdefault(user_id, {})[game_type] = played_at
+            
+            updates = [
+                {'user_id': user_id, 'last_played': json.dumps(games, sort_keys=True)}
+                for user_id, games in last_played.items()
+            ]
+            for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+                with db.engine.begin() as connection:
+                    connection.execute(sql_text("""
+                        UPDATE game_state SET mini_game_last_played = :last_played
+                        WHERE user_id = :user_id AND mini_game_last_played IS NULL
+                    """), updates[start:start + BACKFILL_BATCH_SIZE])
+            logger.info(f"Backfilled mini-game last played times for {len(updates)} players")
+            
+            logger.info("Database migration completed successfully!")
+    
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+    
+    return True
+
+if __name__ == "__main__":
+    run_migration()
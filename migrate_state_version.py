@@ -0,0 +1,57 @@
+"""
+Database migration script to add state versioning to the GameState table.
+The version lets the web client request delta responses from /api/game_action.
+Run it before migrate_game_state_split.py, which moves state_version to game_state_hot.
+Once game_state_hot exists the column lives there and this script does nothing; a
+state_version column left on game_state is dropped by re-running the split migration.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """Run the database migration to add the state_version column."""
+    try:
+        logger.info("Starting database migration for state versioning...")
+        
+        with app.app_context():
+            inspector = inspect(db.engine)
+            table_names = inspector.get_table_names()
+            
+            if 'game_state_hot' in table_names:
+                logger.info("state_version is kept on the game_state_hot table, nothing to do")
+                logger.info("Database migration completed successfully!")
+                return True
+            
+            if 'game_state' not in table_names:
+                logger.info("No game_state table, it will be created with state_version")
+                logger.info("Database migration completed successfully!")
+                return True
+            
+            existing_columns = {col['name'] for col in inspector.get_columns('game_state')}
+            
+            with db.engine.begin() as connection:
+                if 'state_version' not in existing_columns:
+                    connection.execute(sql_text(
+                        "ALTER TABLE game_state ADD COLUMN state_version INTEGER NOT NULL DEFAULT 0"
+                    ))
+                    logger.info("Added column state_version to game_state table")
+                else:
+                    logger.info("Column state_version already exists in game_state table")
+            
+            logger.info("Database migration completed successfully!")
+    
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+    
+    return True
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,42 @@
+"""
+Database migration script to add task catalog versioning to the GameState table.
+The version lets assign_tasks_to_user skip players already assigned from the current catalog.
+This is a one-time script to update the database schema.
+"""
+
+import logging
+from app import app, db
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """Run the database migration to add the task_catalog_version column."""
+    try:
+        logger.info("Starting database migration for task catalog versioning...")
+        
+        with app.app_context():
+            inspector = inspect(db.engine)
+            existing_columns = {col['name'] for col in inspector.get_columns('game_state')}
+            
+            with db.engine.begin() as connection:
+                if 'task_catalog_version' not in existing_columns:
+                    connection.execute(sql_text(
+                        "ALTER TABLE game_state ADD COLUMN task_catalog_version INTEGER NOT NULL DEFAULT 0"
+                    ))
+                    logger.info("Added column task_catalog_version to game_state table")
+                else:
+                    logger.info("Column task_catalog_version already exists in game_state table")
+            
+            logger.info("Database migration completed successfully!")
+    
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        return False
+    
+    return True
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,148 @@
+"""
+Server-side mini-game sessions for the Pixel Plaza Token game.
+Starting a mini-game keeps its puzzle and solution in the mini_game_session table
+keyed by an unguessable session ID; submitting takes the session out again, so
+the client never sees the solution. The table is shared by every app process, so
+start, reveal and submit may be served by different workers.
+Games played card by card (Pixel Match) reveal single cards from the open session.
+"""
+
+import json
+import logging
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, update
+
+from app import db
+from models import MiniGameSession
+from config import MINI_GAME_SESSION_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class StartedGame:
+    """A started mini-game waiting for the player's answer."""
+
+    __slots__ = ('session_id', 'user_id', 'game_type', 'state', 'expires_at')
+
+    def __init__(self, session_id, user_id, game_type, state, expires_at):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.game_type = game_type
+        self.state = state
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f'<StartedGame {self.game_type} user={self.user_id}>'
+
+
+class MiniGameSessionStore:
+    """
+    Database-backed store of started mini-games.
+
+    Sessions expire after a fixed TTL and are single-use. A player has at most
+    one open session per game type; starting the game again replaces the
+    earlier puzzle. The store only executes statements in the current
+    transaction; the caller commits. Taking a session is part of the submit's
+    transaction, so a rolled back submit leaves the session open to be sent again.
+    """
+
+    def __init__(self, ttl_seconds=MINI_GAME_SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+
+    def _select(self, session_id, user_id, now):
+        table = MiniGameSession.__table__
+        row = db.session.execute(
+            select(table.c.game_type, table.c.state, table.c.expires_at).where(
+                table.c.session_id == session_id,
+                table.c.user_id == user_id,
+                table.c.expires_at > now
+            )
+        ).first()
+        if row is None:
+            return None
+        return StartedGame(session_id, user_id, row.game_type, json.loads(row.state), row.expires_at)
+
+    def create(self, user_id, game_type, state):
+        """
+        Open a session for a started game.
+
+        Args:
+            user_id: User ID of the player
+            game_type: Mini-game type
+            state: JSON-serializable dict with the puzzle and its solution
+
+        Returns:
+            The new StartedGame
+        """
+        table = MiniGameSession.__table__
+        now = datetime.utcnow()
+        session = StartedGame(
+            secrets.token_urlsafe(16), user_id, game_type, state,
+            now + timedelta(seconds=self.ttl_seconds)
+        )
+
+        # Drop expired sessions and the player's earlier puzzle for this game
+        db.session.execute(delete(table).where(
+            (table.c.expires_at <= now) |
+            ((table.c.user_id == user_id) & (table.c.game_type == game_type))
+        ))
+        db.session.execute(insert(table).values(
+            session_id=session.session_id,
+            user_id=user_id,
+            game_type=game_type,
+            state=json.dumps(state, separators=(',', ':')),
+            expires_at=session.expires_at
+        ))
+        return session
+
+    def get(self, session_id, user_id):
+        """
+        Look up a player's open session without taking it out of the store.
+
+        Args:
+            session_id: Session ID returned when the game was started
+            user_id: User ID of the player
+
+        Returns:
+            StartedGame, or None if it does not exist, has expired or belongs to another player
+        """
+        return self._select(session_id, user_id, datetime.utcnow())
+
+    def save_state(self, session):
+        """Write back the state of an open session (e.g. the cards revealed so far)."""
+        table = MiniGameSession.__table__
+        db.session.execute(
+            update(table).where(table.c.session_id == session.session_id).values(
+                state=json.dumps(session.state, separators=(',', ':'))
+            )
+        )
+
+    def pop(self, session_id, user_id):
+        """
+        Take a player's session out of the store.
+
+        The row is deleted in the current transaction. Of two concurrent
+        submits of the same session only one deletes it; the other gets None.
+
+        Args:
+            session_id: Session ID returned when the game was started
+            user_id: User ID of the player submitting the game
+
+        Returns:
+            StartedGame, or None if it does not exist, has expired or belongs to another player
+        """
+        table = MiniGameSession.__table__
+        now = datetime.utcnow()
+        session = self._select(session_id, user_id, now)
+        if session is None:
+            return None
+        taken = db.session.execute(delete(table).where(
+            table.c.session_id == session_id,
+            table.c.user_id == user_id,
+            table.c.expires_at > now
+        )).rowcount
+        return session if taken else None
+
+
+mini_game_sessions = MiniGameSessionStore()
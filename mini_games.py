@@ -1,6 +1,8 @@
 """
 Mini-games and challenges for the Pixel Plaza Token game.
 These provide additional ways for players to earn tokens, resources, and experience.
+A game is played in two steps: starting it deals a puzzle held in a server-side
+session, and submitting the player's answer scores it against that session.
 """
 
 import random
@@ -9,6 +11,9 @@ import json
 from datetime import datetime, timedelta
 from models import User, GameState, Transaction, MiniGameResult
 from app import db
+from mini_game_sessions import mini_game_sessions
+from puzzle_pool import puzzle_pool
+from resource_updates import apply_resources, apply_level_up
 import config
 
 logger = logging.getLogger(__name__)
@@ -19,14 +24,20 @@ class MiniGames:
     def __init__(self):
         """Initialize mini-games."""
         logger.info("Initializing mini-games system")
+        # Game type -> (setup function, scoring function)
         self.games = {
-            'pixel_match': self._pixel_match_game,
-            'token_puzzle': self._token_puzzle_game,
-            'resource_rush': self._resource_rush_game,
-            'gem_hunter': self._gem_hunter_game,
-            'pattern_predictor': self._pattern_predictor_game
+            'pixel_match': (self._setup_pixel_match, self._score_pixel_match),
+            'token_puzzle': (self._setup_token_puzzle, self._score_token_puzzle),
+            'resource_rush': (self._setup_resource_rush, self._score_resource_rush),
+            'gem_hunter': (self._setup_gem_hunter, self._score_gem_hunter),
+            'pattern_predictor': (self._setup_pattern_predictor, self._score_pattern_predictor)
         }
         
+        # Puzzles of the pooled games are generated ahead of time by the refill worker
+        for game_type in config.MINI_GAME_POOLED_GAMES:
+            setup, _ = self.games[game_type]
+            puzzle_pool.register(game_type, setup)
+        
     def get_available_games(self, user, game_state):
         """Get list of available games for a user.
         
@@ -40,19 +51,11 @@ class MiniGames:
         now = datetime.utcnow()
         available_games = []
         
-        # Get user's most recent mini-game results
-        recent_games = MiniGameResult.query.filter_by(
-            user_id=user.id
-        ).order_by(MiniGameResult.played_at.desc()).all()
-        
-        # Track when each game was last played
-        last_played = {}
-        for result in recent_games:
-            if result.game_type not in last_played:
-                last_played[result.game_type] = result.played_at
+        # When each game was last played, kept on the game state
+        last_played = self._get_last_played(game_state)
         
         # Check availability for each game
-        for game_type, game_func in self.games.items():
+        for game_type in self.games:
             game_info = {
                 'type': game_type,
                 'name': self._get_game_name(game_type),
@@ -79,17 +82,20 @@ class MiniGames:
             
         return available_games
     
-    def play_game(self, user, game_state, game_type, game_data=None):
-        """Play a mini-game.
+    def start_game(self, user, game_state, game_type):
+        """Start a mini-game.
+        
+        The puzzle and its solution are kept in the session store; only what
+        the player needs to play is returned. The session is written in the
+        current transaction; the caller commits.
         
         Args:
             user: User model instance
             game_state: GameState model instance
             game_type: String indicating which game to play
-            game_data: Optional dict with game-specific parameters
             
         Returns:
-            dict with game results
+            dict with the session ID and the public game data
         """
         if game_type not in self.games:
             return {
@@ -97,32 +103,64 @@ class MiniGames:
                 "message": f"Unknown mini-game: {game_type}"
             }
         
-        # Check if game is on cooldown
-        now = datetime.utcnow()
-        last_game = MiniGameResult.query.filter_by(
-            user_id=user.id,
-            game_type=game_type
-        ).order_by(MiniGameResult.played_at.desc()).first()
+        cooldown_message = self._cooldown_message(game_state, game_type, datetime.utcnow())
+        if cooldown_message:
+            return {"success": False, "message": cooldown_message}
+        
+        if puzzle_pool.is_pooled(game_type):
+            game = puzzle_pool.take(game_type)
+        else:
+            setup, _ = self.games[game_type]
+            game = setup()
+        session = mini_game_sessions.create(user.id, game_type, game['state'])
+        
+        return {
+            "success": True,
+            "message": game['message'],
+            "game_type": game_type,
+            "session_id": session.session_id,
+            "expires_in": mini_game_sessions.ttl_seconds,
+            "game_data": game['game_data']
+        }
+    
+    def submit_game(self, user, game_state, session_id, answer=None):
+        """Score a started mini-game and apply its rewards.
+        
+        The session is single-use. One MiniGameResult row with a compact
+        summary of the outcome is recorded.
         
-        if last_game:
-            time_since_played = now - last_game.played_at
-            cooldown_seconds = config.MINI_GAME_COOLDOWN_HOURS * 3600
+        Args:
+            user: User model instance
+            game_state: GameState model instance
+            session_id: Session ID returned by start_game
+            answer: dict with the player's game-specific answer
             
-            if time_since_played.total_seconds() < cooldown_seconds:
-                cooldown_remaining = cooldown_seconds - time_since_played.total_seconds()
-                hours = int(cooldown_remaining // 3600)
-                minutes = int((cooldown_remaining % 3600) // 60)
-                
-                return {
-                    "success": False,
-                    "message": f"This game is on cooldown. Available again in {hours}h {minutes}m"
-                }
-        
-        # Call the appropriate game function
-        if game_data is None:
-            game_data = {}
+        Returns:
+            dict with game results
+        """
+        # Taking the session is part of this transaction, so a rolled back submit
+        # (e.g. one retried after a concurrent change) can be sent again
+        session = mini_game_sessions.pop(session_id, user.id)
+        if session is None:
+            return {
+                "success": False,
+                "message": "This game has expired. Please start a new game."
+            }
+        
+        game_type = session.game_type
+        
+        # The game may have been finished in another session since this one started
+        now = datetime.utcnow()
+        cooldown_message = self._cooldown_message(game_state, game_type, now)
+        if cooldown_message:
+            return {"success": False, "message": cooldown_message}
+        
+        if not isinstance(answer, dict):
+            answer = {}
             
-        result = self.games[game_type](user, game_state, game_data)
+        _, score_game = self.games[game_type]
+        result = score_game(user, game_state, session.state, answer)
+        result['game_type'] = game_type
         
         # Record the result
         game_result = MiniGameResult(
@@ -134,26 +172,24 @@ class MiniGames:
             reward_materials=result.get('reward_materials', 0),
             reward_gems=result.get('reward_gems', 0),
             reward_xp=result.get('reward_xp', 0),
-            game_data=json.dumps(result.get('game_data', {})),
+            game_data=json.dumps(result.get('game_data', {}), separators=(',', ':')),
             played_at=now
         )
         db.session.add(game_result)
+        self._set_last_played(game_state, game_type, now)
         
         # Update user's game state with rewards
         if result['success']:
-            game_state.token_balance += result.get('reward_tokens', 0)
-            game_state.pixels += result.get('reward_pixels', 0)
-            game_state.materials += result.get('reward_materials', 0)
-            game_state.gems += result.get('reward_gems', 0)
-            game_state.experience += result.get('reward_xp', 0)
+            apply_resources(game_state, {
+                'token_balance': result.get('reward_tokens', 0),
+                'pixels': result.get('reward_pixels', 0),
+                'materials': result.get('reward_materials', 0),
+                'gems': result.get('reward_gems', 0),
+                'experience': result.get('reward_xp', 0)
+            })
             
             # Check for level up
-            if game_state.experience >= game_state.level * 100:
-                game_state.experience -= game_state.level * 100
-                game_state.level += 1
-                result['level_up'] = True
-            else:
-                result['level_up'] = False
+            result['level_up'] = apply_level_up(game_state, 100)
             
             # Record transaction
             transaction = Transaction(
@@ -164,7 +200,8 @@ class MiniGames:
             )
             db.session.add(transaction)
             
-            db.session.commit()
+        # Flush only - the caller commits the play as a single transaction
+        db.session.flush()
             
         result['game_state'] = {
             "token_balance": game_state.token_balance,
@@ -177,6 +214,88 @@ class MiniGames:
         
         return result
     
+    def reveal_card(self, user, session_id, index):
+        """Flip one card of a started Pixel Match game.
+        
+        The board stays in the session; each flipped card is remembered, and
+        only pairs of flipped cards count when the game is submitted. The
+        session is updated in the current transaction; the caller commits.
+        
+        Args:
+            user: User model instance
+            session_id: Session ID returned by start_game
+            index: Position of the card on the board
+        
+        Returns:
+            dict with the card's symbol
+        """
+        session = mini_game_sessions.get(session_id, user.id)
+        if session is None:
+            return {
+                "success": False,
+                "message": "This game has expired. Please start a new game."
+            }
+        if session.game_type != 'pixel_match':
+            return {"success": False, "message": "This game has no cards to reveal"}
+        
+        game_board = session.state['game_board']
+        if not 0 <= index < len(game_board):
+            return {"success": False, "message": "Invalid card index"}
+        
+        revealed = session.state.setdefault('revealed', [])
+        if index not in revealed:
+            revealed.append(index)
+            mini_game_sessions.save_state(session)
+        return {
+            "success": True,
+            "index": index,
+            "symbol": game_board[index]
+        }
+    
+    def _cooldown_message(self, game_state, game_type, now):
+        """Get the cooldown message for a game type, or None if it can be played."""
+        last_played = self._get_last_played(game_state).get(game_type)
+        if not last_played:
+            return None
+        
+        time_since_played = now - last_played
+        cooldown_seconds = config.MINI_GAME_COOLDOWN_HOURS * 3600
+        
+        if time_since_played.total_seconds() >= cooldown_seconds:
+            return None
+        
+        cooldown_remaining = cooldown_seconds - time_since_played.total_seconds()
+        hours = int(cooldown_remaining // 3600)
+        minutes = int((cooldown_remaining % 3600) // 60)
+        return f"This game is on cooldown. Available again in {hours}h {minutes}m"
+    
+    def _get_last_played(self, game_state):
+        """Get the last play time of each mini-game type from the game state.
+        
+        Args:
+            game_state: GameState model instance
+            
+        Returns:
+            dict mapping game type to datetime
+        """
+        if not game_state.mini_game_last_played:
+            return {}
+        try:
+            stored = json.loads(game_state.mini_game_last_played)
+            return {game_type: datetime.fromisoformat(played_at) for game_type, played_at in stored.items()}
+        except (ValueError, TypeError, AttributeError):
+            logger.warning(f"Invalid mini-game last played data for game state {game_state.id}")
+            return {}
+    
+    def _set_last_played(self, game_state, game_type, played_at):
+        """Record when a mini-game type was last played on the game state."""
+        last_played = self._get_last_played(game_state)
+        last_played[game_type] = played_at
+        game_state.mini_game_last_played = json.dumps(
+            {t: when.isoformat() for t, when in last_played.items()},
+            sort_keys=True
+        )
+    
     def _get_game_name(self, game_type):
         """Get display name for a game type."""
         names = {
@@ -222,64 +341,76 @@ class MiniGames:
         }
     
     # Individual mini-game implementations
-    def _pixel_match_game(self, user, game_state, game_data):
+    #
+    # Each game has a setup function returning the public game data shown to
+    # the player and the private state kept in the session, and a scoring
+    # function that checks the player's answer against that state.
+    
+    def _setup_pixel_match(self):
         """
         Memory-based game where players match pixel patterns.
         
-        Game data:
-            player_choices: List of indices the player selected
-            
         Returns:
-            Game result dict
+            Game setup dict with message, public game_data and private state
         """
-        # Parse player data
-        player_choices = game_data.get('player_choices', [])
-        
-        # Generate game if needed
-        if 'game_board' not in game_data:
-            # For first-time access, return game board configuration
-            # Generate a board of matching pairs
-            symbols = ['🎮', '🎲', '🎯', '🎨', '🎭', '🎪', '🎫', '🎟️']
-            pairs_count = 8  # 8 pairs = 16 cards
-            
-            # Create pairs of symbols
-            all_symbols = []
-            for symbol in symbols[:pairs_count]:
-                all_symbols.extend([symbol, symbol])
-                
-            # Shuffle the board
-            random.shuffle(all_symbols)
+        # Generate a board of matching pairs
+        symbols = ['🎮', '🎲', '🎯', '🎨', '🎭', '🎪', '🎫', '🎟️']
+        pairs_count = 8  # 8 pairs = 16 cards
+        
+        # Create pairs of symbols
+        all_symbols = []
+        for symbol in symbols[:pairs_count]:
+            all_symbols.extend([symbol, symbol])
             
-            return {
-                'success': True,
-                'message': 'Match the pairs of symbols!',
-                'game_data': {
-                    'game_board': all_symbols,
-                    'matches_required': pairs_count
-                }
+        # Shuffle the board
+        random.shuffle(all_symbols)
+        
+        # The board stays in the session; the client flips cards one at a time
+        # through reveal_card
+        return {
+            'message': 'Match the pairs of symbols!',
+            'game_data': {
+                'board_size': len(all_symbols),
+                'matches_required': pairs_count
+            },
+            'state': {
+                'game_board': all_symbols,
+                'matches_required': pairs_count
             }
+        }
+    
+    def _score_pixel_match(self, user, game_state, state, answer):
+        """
+        Score a pixel match game.
         
-        # Process player's choices
-        game_board = game_data.get('game_board', [])
-        matches_required = game_data.get('matches_required', 8)
+        Answer:
+            player_choices: List of card indices, two per matched pair; both
+                cards must have been flipped with reveal_card
+            
+        Returns:
+            Game result dict
+        """
+        player_choices = _int_list(answer.get('player_choices'))
+        game_board = state['game_board']
+        matches_required = state['matches_required']
+        revealed = set(state.get('revealed', ()))
         correct_matches = 0
         
-        # Count correct matches
+        # Count correct matches; only cards the player actually flipped count
         matched_indices = set()
         for i in range(0, len(player_choices) - 1, 2):
-            if i + 1 < len(player_choices):
-                idx1 = player_choices[i]
-                idx2 = player_choices[i + 1]
-                
-                if (0 <= idx1 < len(game_board) and 
-                    0 <= idx2 < len(game_board) and
-                    idx1 != idx2 and 
-                    game_board[idx1] == game_board[idx2] and
-                    idx1 not in matched_indices and 
-                    idx2 not in matched_indices):
-                    correct_matches += 1
-                    matched_indices.add(idx1)
-                    matched_indices.add(idx2)
+            idx1 = player_choices[i]
+            idx2 = player_choices[i + 1]
+            
+            if (idx1 in revealed and 
+                idx2 in revealed and
+                idx1 != idx2 and 
+                game_board[idx1] == game_board[idx2] and
+                idx1 not in matched_indices and 
+                idx2 not in matched_indices):
+                correct_matches += 1
+                matched_indices.add(idx1)
+                matched_indices.add(idx2)
         
         # Calculate score based on matches
         score = (correct_matches / matches_required) * 100
@@ -298,40 +429,48 @@ class MiniGames:
             }
         }
     
-    def _token_puzzle_game(self, user, game_state, game_data):
+    def _setup_token_puzzle(self):
         """
         Number puzzle game where players arrange tokens in order.
         
-        Game data:
-            player_solution: List representing the player's arrangement
+        Returns:
+            Game setup dict with message, public game_data and private state
+        """
+        # Create a sliding puzzle (4x4 grid)
+        puzzle_size = 4
+        puzzle = list(range(1, puzzle_size * puzzle_size))
+        puzzle.append(0)  # Empty space represented by 0
+        
+        # Shuffle the puzzle (ensuring it's solvable)
+        random.shuffle(puzzle)
+        
+        board = {
+            'puzzle': puzzle,
+            'size': puzzle_size
+        }
+        return {
+            'message': 'Arrange the numbers in order, with the empty space in the bottom right.',
+            'game_data': board,
+            'state': board
+        }
+    
+    def _score_token_puzzle(self, user, game_state, state, answer):
+        """
+        Score a token puzzle game.
+        
+        Answer:
+            player_solution: List representing the player's arrangement, 0 for the empty space
             
         Returns:
             Game result dict
         """
-        # Parse player data
-        player_solution = game_data.get('player_solution', [])
-        
-        # Generate puzzle if needed
-        if 'puzzle' not in game_data:
-            # Create a sliding puzzle (4x4 grid)
-            puzzle_size = 4
-            puzzle = list(range(1, puzzle_size * puzzle_size))
-            puzzle.append(0)  # Empty space represented by 0
-            
-            # Shuffle the puzzle (ensuring it's solvable)
-            random.shuffle(puzzle)
-            
-            return {
-                'success': True,
-                'message': 'Arrange the numbers in order, with the empty space in the bottom right.',
-                'game_data': {
-                    'puzzle': puzzle,
-                    'size': puzzle_size
-                }
-            }
+        player_solution = _int_list(answer.get('player_solution'))
+        
+        # The arrangement must be made of the tiles that were dealt
+        puzzle_size = state['size']
+        if sorted(player_solution) != sorted(state['puzzle']):
+            player_solution = []
         
-        # Check player's solution
-        puzzle_size = game_data.get('size', 4)
         correct_solution = list(range(1, puzzle_size * puzzle_size)) + [0]
         
         # Calculate how many tiles are in the correct position
@@ -342,7 +481,8 @@ class MiniGames:
         score = (correct_positions / total_positions) * 100
         
         # Bonus for perfect solution
-        if score == 100:
+        perfect_solution = correct_positions == total_positions
+        if perfect_solution:
             score += 20  # Bonus points
         
         # Calculate rewards
@@ -356,57 +496,65 @@ class MiniGames:
             'game_data': {
                 'correct_positions': correct_positions,
                 'total_positions': total_positions,
-                'perfect_solution': score == 100
+                'perfect_solution': perfect_solution
             }
         }
     
-    def _resource_rush_game(self, user, game_state, game_data):
+    def _setup_resource_rush(self):
         """
         Time-based game where players collect falling resources.
         
-        Game data:
-            resources_collected: Dict of resource types and counts collected
-            
         Returns:
-            Game result dict
+            Game setup dict with message, public game_data and private state
         """
-        # Parse player data
-        resources_collected = game_data.get('resources_collected', {})
-        
-        # If first time, return game configuration
-        if not resources_collected:
-            # Configure game parameters
-            game_duration = 30  # seconds
-            resource_types = ['pixel', 'material', 'gem', 'token']
-            target_counts = {
-                'pixel': 30,
-                'material': 15,
-                'gem': 5,
-                'token': 10
-            }
-            
-            return {
-                'success': True,
-                'message': 'Collect falling resources before time runs out!',
-                'game_data': {
-                    'duration': game_duration,
-                    'resource_types': resource_types,
-                    'target_counts': target_counts
-                }
-            }
-        
-        # Process results
-        target_counts = game_data.get('target_counts', {
+        # Configure game parameters
+        game_duration = 30  # seconds
+        resource_types = ['pixel', 'material', 'gem', 'token']
+        target_counts = {
             'pixel': 30,
             'material': 15,
             'gem': 5,
             'token': 10
-        })
+        }
+        
+        rush = {
+            'duration': game_duration,
+            'resource_types': resource_types,
+            'target_counts': target_counts
+        }
+        return {
+            'message': 'Collect falling resources before time runs out!',
+            'game_data': rush,
+            'state': rush
+        }
+    
+    def _score_resource_rush(self, user, game_state, state, answer):
+        """
+        Score a resource rush game.
+        
+        Answer:
+            resources_collected: Dict of resource types and counts collected
+            
+        Returns:
+            Game result dict
+        """
+        target_counts = state['target_counts']
+        submitted = answer.get('resources_collected')
+        if not isinstance(submitted, dict):
+            submitted = {}
+        
+        # Only count the resource types that were in play
+        resources_collected = {}
+        for resource in target_counts:
+            try:
+                resources_collected[resource] = max(0, int(submitted.get(resource, 0)))
+            except (TypeError, ValueError):
+                resources_collected[resource] = 0
         
         # Calculate percentage of targets reached
         completion_percentages = []
         for resource, target in target_counts.items():
-            collected = resources_collected.get(resource, 0)
+            collected = resources_collected[resource]
             percentage = min(100, (collected / target) * 100)
             completion_percentages.append(percentage)
         
@@ -417,10 +565,10 @@ class MiniGames:
         base_rewards = self._calculate_rewards('resource_rush', score, difficulty=1.3)
         
         # Add bonus rewards based on what they collected
-        reward_tokens = base_rewards['reward_tokens'] + resources_collected.get('token', 0) * 0.5
-        reward_pixels = base_rewards['reward_pixels'] + resources_collected.get('pixel', 0) * 2
-        reward_materials = base_rewards['reward_materials'] + resources_collected.get('material', 0)
-        reward_gems = base_rewards['reward_gems'] + resources_collected.get('gem', 0)
+        reward_tokens = base_rewards['reward_tokens'] + resources_collected['token'] * 0.5
+        reward_pixels = base_rewards['reward_pixels'] + resources_collected['pixel'] * 2
+        reward_materials = base_rewards['reward_materials'] + resources_collected['material']
+        reward_gems = base_rewards['reward_gems'] + resources_collected['gem']
         
         return {
             'success': True,
@@ -432,60 +580,69 @@ class MiniGames:
             'reward_gems': reward_gems,
             'reward_xp': base_rewards['reward_xp'],
             'game_data': {
-                'resources_collected': resources_collected,
-                'target_counts': target_counts
+                'resources_collected': resources_collected
             }
         }
     
-    def _gem_hunter_game(self, user, game_state, game_data):
+    def _setup_gem_hunter(self):
         """
         Strategy game where players search for hidden gems in a grid.
         
-        Game data:
-            selected_cells: List of cell coordinates the player selected
+        Returns:
+            Game setup dict with message, public game_data and private state
+        """
+        # Configure the game
+        grid_size = 5  # 5x5 grid
+        gem_count = 7  # 7 gems hidden in the grid
+        max_selections = 10  # Player can select up to 10 cells
+        
+        # Place gems randomly
+        gem_positions = []
+        while len(gem_positions) < gem_count:
+            x, y = random.randint(0, grid_size-1), random.randint(0, grid_size-1)
+            position = (x, y)
+            if position not in gem_positions:
+                gem_positions.append(position)
+        
+        grid = {
+            'grid_size': grid_size,
+            'gem_count': gem_count,
+            'max_selections': max_selections
+        }
+        return {
+            'message': f'Find the {gem_count} hidden gems on the grid. You have {max_selections} attempts.',
+            'game_data': grid,
+            'state': {**grid, 'gem_positions': gem_positions}
+        }
+    
+    def _score_gem_hunter(self, user, game_state, state, answer):
+        """
+        Score a gem hunter game.
+        
+        Answer:
+            selected_cells: List of [row, col] cell coordinates the player selected
             
         Returns:
             Game result dict
         """
-        # Parse player data
-        selected_cells = game_data.get('selected_cells', [])
-        
-        # Generate game if needed
-        if 'grid_size' not in game_data:
-            # Configure the game
-            grid_size = 5  # 5x5 grid
-            gem_count = 7  # 7 gems hidden in the grid
-            max_selections = 10  # Player can select up to 10 cells
-            
-            # Place gems randomly
-            gem_positions = []
-            while len(gem_positions) < gem_count:
-                x, y = random.randint(0, grid_size-1), random.randint(0, grid_size-1)
-                position = (x, y)
-                if position not in gem_positions:
-                    gem_positions.append(position)
-            
-            return {
-                'success': True,
-                'message': f'Find the {gem_count} hidden gems on the grid. You have {max_selections} attempts.',
-                'game_data': {
-                    'grid_size': grid_size,
-                    'gem_count': gem_count,
-                    'max_selections': max_selections,
-                    'gem_positions': gem_positions
-                }
-            }
-        
-        # Process player selections
-        grid_size = game_data.get('grid_size', 5)
-        gem_positions = game_data.get('gem_positions', [])
-        max_selections = game_data.get('max_selections', 10)
+        grid_size = state['grid_size']
+        # Positions come back from the session's JSON as [row, col] lists
+        gem_positions = set(map(tuple, state['gem_positions']))
+        max_selections = state['max_selections']
+        
+        # Distinct cells on the grid, limited to max_selections
+        selected_cells = []
+        for cell in answer.get('selected_cells') or []:
+            if isinstance(cell, dict):
+                cell = (cell.get('row'), cell.get('col'))
+            position = tuple(_int_list(cell))
+            if (len(position) == 2 and all(0 <= v < grid_size for v in position)
+                    and position not in selected_cells):
+                selected_cells.append(position)
+        selected_cells = selected_cells[:max_selections]
         
         # Count found gems
-        found_gems = 0
-        for x, y in selected_cells[:max_selections]:  # Limit to max_selections
-            if (x, y) in gem_positions:
-                found_gems += 1
+        found_gems = sum(1 for position in selected_cells if position in gem_positions)
         
         # Calculate score based on gem finding efficiency
         efficiency = found_gems / len(selected_cells) if selected_cells else 0
@@ -510,117 +667,119 @@ class MiniGames:
             'game_data': {
                 'found_gems': found_gems,
                 'total_gems': len(gem_positions),
-                'efficiency': efficiency,
-                'efficiency_bonus': efficiency_bonus
+                'efficiency': round(efficiency, 3)
             }
         }
     
-    def _pattern_predictor_game(self, user, game_state, game_data):
+    def _setup_pattern_predictor(self):
         """
         Logic game where players predict the next element in a pattern.
         
-        Game data:
-            player_answer: The player's predicted next element
-            
         Returns:
-            Game result dict
+            Game setup dict with message, public game_data and private state
         """
-        # Parse player data
-        player_answer = game_data.get('player_answer')
-        
-        # Generate game if needed
-        if 'sequence' not in game_data:
-            # Define possible sequence types
-            sequence_types = [
-                'arithmetic',  # e.g., [2, 4, 6, 8, ...]
-                'geometric',   # e.g., [2, 4, 8, 16, ...]
-                'fibonacci',   # e.g., [1, 1, 2, 3, 5, ...]
-                'alternating', # e.g., [1, 3, 1, 3, 1, ...]
-                'symbol'       # e.g., ['A', 'B', 'C', 'A', 'B', ...]
-            ]
+        # Define possible sequence types
+        sequence_types = [
+            'arithmetic',  # e.g., [2, 4, 6, 8, ...]
+            'geometric',   # e.g., [2, 4, 8, 16, ...]
+            'fibonacci',   # e.g., [1, 1, 2, 3, 5, ...]
+            'alternating', # e.g., [1, 3, 1, 3, 1, ...]
+            'symbol'       # e.g., ['A', 'B', 'C', 'A', 'B', ...]
+        ]
+        
+        seq_type = random.choice(sequence_types)
+        sequence = []
+        correct_answer = None
+        
+        if seq_type == 'arithmetic':
+            start = random.randint(1, 10)
+            step = random.randint(1, 5)
+            sequence = [start + step * i for i in range(5)]
+            correct_answer = sequence[-1] + step
             
-            seq_type = random.choice(sequence_types)
-            sequence = []
-            correct_answer = None
+        elif seq_type == 'geometric':
+            start = random.randint(1, 5)
+            ratio = random.randint(2, 3)
+            sequence = [start * (ratio ** i) for i in range(5)]
+            correct_answer = sequence[-1] * ratio
             
-            if seq_type == 'arithmetic':
-                start = random.randint(1, 10)
-                step = random.randint(1, 5)
-                sequence = [start + step * i for i in range(5)]
-                correct_answer = sequence[-1] + step
-                
-            elif seq_type == 'geometric':
-                start = random.randint(1, 5)
-                ratio = random.randint(2, 3)
-                sequence = [start * (ratio ** i) for i in range(5)]
-                correct_answer = sequence[-1] * ratio
-                
-            elif seq_type == 'fibonacci':
-                # Modified Fibonacci with random start numbers
-                a, b = random.randint(1, 5), random.randint(1, 5)
-                sequence = [a, b]
-                for _ in range(3):
-                    a, b = b, a + b
-                    sequence.append(b)
-                correct_answer = sequence[-1] + sequence[-2]
-                
-            elif seq_type == 'alternating':
-                a, b = random.randint(1, 10), random.randint(1, 10)
-                while b == a:
-                    b = random.randint(1, 10)
-                pattern_length = random.randint(2, 3)
-                
-                if pattern_length == 2:
-                    sequence = [a, b] * 2 + [a]
-                    correct_answer = b
-                else:
+        elif seq_type == 'fibonacci':
+            # Modified Fibonacci with random start numbers
+            a, b = random.randint(1, 5), random.randint(1, 5)
+            sequence = [a, b]
+            for _ in range(3):
+                a, b = b, a + b
+                sequence.append(b)
+            correct_answer = sequence[-1] + sequence[-2]
+            
+        elif seq_type == 'alternating':
+            a, b = random.randint(1, 10), random.randint(1, 10)
+            while b == a:
+                b = random.randint(1, 10)
+            pattern_length = random.randint(2, 3)
+            
+            if pattern_length == 2:
+                sequence = [a, b] * 2 + [a]
+                correct_answer = b
+            else:
+                c = random.randint(1, 10)
+                while c == a or c == b:
                     c = random.randint(1, 10)
-                    while c == a or c == b:
-                        c = random.randint(1, 10)
-                    sequence = [a, b, c] + [a, b]
-                    correct_answer = c
-                    
-            elif seq_type == 'symbol':
-                symbols = ['⭐', '🔵', '🔴', '⚪', '🟠', '🟣', '🟢', '⚫']
-                pattern_length = random.randint(2, 3)
-                pattern = random.sample(symbols, pattern_length)
+                sequence = [a, b, c] + [a, b]
+                correct_answer = c
                 
-                # Repeat the pattern
-                sequence = pattern * 2
-                if len(sequence) > 5:
-                    sequence = sequence[:5]
-                else:
-                    sequence = pattern * 3
-                    sequence = sequence[:5]
-                    
-                correct_answer = pattern[len(sequence) % len(pattern)]
-            
-            # Difficulty is based on sequence type and length
-            difficulty_map = {
-                'arithmetic': 1.0,
-                'alternating': 1.2,
-                'fibonacci': 1.5,
-                'geometric': 1.3,
-                'symbol': 1.1
-            }
+        elif seq_type == 'symbol':
+            symbols = ['⭐', '🔵', '🔴', '⚪', '🟠', '🟣', '🟢', '⚫']
+            pattern_length = random.randint(2, 3)
+            pattern = random.sample(symbols, pattern_length)
             
-            return {
-                'success': True,
-                'message': 'What comes next in this sequence?',
-                'game_data': {
-                    'sequence': sequence,
-                    'sequence_type': seq_type,
-                    'correct_answer': correct_answer,
-                    'difficulty': difficulty_map.get(seq_type, 1.0)
-                }
+            # Repeat the pattern
+            sequence = pattern * 2
+            if len(sequence) > 5:
+                sequence = sequence[:5]
+            else:
+                sequence = pattern * 3
+                sequence = sequence[:5]
+                
+            correct_answer = pattern[len(sequence) % len(pattern)]
+        
+        # Difficulty is based on sequence type and length
+        difficulty_map = {
+            'arithmetic': 1.0,
+            'alternating': 1.2,
+            'fibonacci': 1.5,
+            'geometric': 1.3,
+            'symbol': 1.1
+        }
+        
+        return {
+            'message': 'What comes next in this sequence?',
+            'game_data': {
+                'sequence': sequence
+            },
+            'state': {
+                'sequence_type': seq_type,
+                'correct_answer': correct_answer,
+                'difficulty': difficulty_map.get(seq_type, 1.0)
             }
+        }
+    
+    def _score_pattern_predictor(self, user, game_state, state, answer):
+        """
+        Score a pattern predictor game.
         
-        # Process player answer
-        correct_answer = game_data.get('correct_answer')
-        difficulty = game_data.get('difficulty', 1.0)
+        Answer:
+            player_answer: The player's predicted next element
+            
+        Returns:
+            Game result dict
+        """
+        correct_answer = state['correct_answer']
+        difficulty = state['difficulty']
         
-        # Check if answer is correct
-        is_correct = player_answer == correct_answer
+        # Answers arrive as typed text, so compare the text forms
+        player_answer = answer.get('player_answer')
+        is_correct = player_answer is not None and str(player_answer).strip() == str(correct_answer)
         
         # Calculate score - binary for this game
         score = 100 if is_correct else 0
@@ -637,8 +796,16 @@ class MiniGames:
             **rewards,
             'game_data': {
                 'correct': is_correct,
-                'player_answer': player_answer,
-                'correct_answer': correct_answer,
-                'sequence_type': game_data.get('sequence_type')
+                'sequence_type': state['sequence_type']
             }
-        }
\ No newline at end of file
+        }
+
+
+def _int_list(values):
+    """Convert a submitted list to integers, or an empty list if it is not a list of numbers."""
+    if not isinstance(values, (list, tuple)):
+        return []
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        return []
@@ -1,5 +1,7 @@
 from app import db
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session, column_property
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,50 +20,101 @@ class User(db.Model):
     referred_users = db.relationship('User', backref=db.backref('referred_by', remote_side=[id]), lazy=True)
     user_tasks = db.relationship('UserTask', backref='user', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_user_referred_by_id', 'referred_by_id'),
+    )
+    
     def __repr__(self):
         return f'<User {self.username}>'
 
-class GameState(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+# GameState is stored in two tables. game_state holds the profile, progression and
+# other rarely changed columns; game_state_hot is a narrow row with the counters
+# that nearly every action mutates, so those updates do not rewrite the wide row.
+game_state_table = db.Table(
+    'game_state',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), nullable=False),
     
     # Game economy statistics
-    token_balance = db.Column(db.Float, default=0.0)
-    pixel_art_created = db.Column(db.Integer, default=0)
-    buildings_owned = db.Column(db.Integer, default=0)
-    daily_streak = db.Column(db.Integer, default=0)
-    last_daily_claim = db.Column(db.DateTime, nullable=True)
-    
-    # Resources for economy simulation
-    pixels = db.Column(db.Integer, default=100)
-    energy = db.Column(db.Integer, default=100)
-    gems = db.Column(db.Integer, default=0)  # Premium currency for special items
-    materials = db.Column(db.Integer, default=0)  # Building materials for construction
+    db.Column('buildings_owned', db.Integer, default=0),
+    db.Column('daily_streak', db.Integer, default=0),
+    db.Column('last_daily_claim', db.DateTime, nullable=True),
     
     # Game progression
-    level = db.Column(db.Integer, default=1)
-    experience = db.Column(db.Integer, default=0)
+    db.Column('level', db.Integer, default=1),
     
     # Skill levels affecting game mechanics
-    mining_skill = db.Column(db.Integer, default=1)
-    art_skill = db.Column(db.Integer, default=1)
-    building_skill = db.Column(db.Integer, default=1)
-    trading_skill = db.Column(db.Integer, default=1)
+    db.Column('mining_skill', db.Integer, default=1),
+    db.Column('art_skill', db.Integer, default=1),
+    db.Column('building_skill', db.Integer, default=1),
+    db.Column('trading_skill', db.Integer, default=1),
     
     # Market participation
-    market_transactions = db.Column(db.Integer, default=0)
-    last_market_action = db.Column(db.DateTime, nullable=True)
+    db.Column('last_market_action', db.DateTime, nullable=True),
     
     # Referral system stats
-    referral_count = db.Column(db.Integer, default=0)
-    tasks_completed = db.Column(db.Integer, default=0)
+    db.Column('referral_count', db.Integer, default=0),
+    db.Column('tasks_completed', db.Integer, default=0),
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_active = db.Column(db.DateTime, default=datetime.utcnow)
+    db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    
+    # Task catalog version the player's UserTask rows were last assigned from
+    db.Column('task_catalog_version', db.Integer, default=0, nullable=False),
+    
+    # JSON object of mini-game type -> ISO timestamp of the last play, used for cooldowns
+    db.Column('mini_game_last_played', db.Text, nullable=True),
+    
+    # Building production: JSON vector of summed per-period rates (and the number of
+    # buildings folded in), production banked when the rates last changed, and when
+    # the current rates started accruing
+    db.Column('production_rates', db.Text, nullable=True),
+    db.Column('production_banked', db.Text, nullable=True),
+    db.Column('production_accrued_at', db.DateTime, nullable=True),
+    
+    db.Index('ix_game_state_user_id', 'user_id')
+)
+
+game_state_hot_table = db.Table(
+    'game_state_hot',
+    db.Column('game_state_id', db.Integer, db.ForeignKey('game_state.id'), primary_key=True),
+    
+    # Balances and resources
+    db.Column('token_balance', db.Float, default=0.0),
+    db.Column('pixels', db.Integer, default=100),
+    db.Column('energy', db.Integer, default=100),
+    db.Column('gems', db.Integer, default=0),  # Premium currency for special items
+    db.Column('materials', db.Integer, default=0),  # Building materials for construction
+    
+    # Per-action counters
+    db.Column('experience', db.Integer, default=0),
+    db.Column('pixel_art_created', db.Integer, default=0),
+    db.Column('market_transactions', db.Integer, default=0),
+    
+    db.Column('last_active', db.DateTime, default=datetime.utcnow),
+    
+    # Monotonic version, bumped whenever the player's state changes (used for delta responses)
+    db.Column('state_version', db.Integer, default=0, nullable=False)
+)
+
+class GameState(db.Model):
+    """A player's game state, mapped across the game_state and game_state_hot tables."""
+    __table__ = db.join(game_state_table, game_state_hot_table)
+    
+    # Both tables share the game state ID; the hot row's key is copied on insert
+    id = column_property(game_state_table.c.id, game_state_hot_table.c.game_state_id)
+    
+    # state_version doubles as the optimistic lock: every flush that changes the
+    # player's state sets the next version (see bump_game_state_versions) and only
+    # succeeds if the row still holds the version that was loaded
+    __mapper_args__ = {
+        'version_id_col': game_state_hot_table.c.state_version,
+        'version_id_generator': False
+    }
     
     # Relationships
     buildings = db.relationship('Building', backref='owner_state', lazy=True)
+    building_groups = db.relationship('BuildingGroup', backref='owner_state', lazy=True)
     market_orders = db.relationship('MarketOrder', backref='owner_state', lazy=True)
     
     def __repr__(self):
@@ -77,6 +130,10 @@ class Transaction(db.Model):
     description = db.Column(db.String(200), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_transaction_user_type_timestamp', 'user_id', 'type', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<Transaction {self.type} for User {self.user_id}>'
 
@@ -109,6 +166,10 @@ class UserTask(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     last_reset = db.Column(db.DateTime, default=datetime.utcnow)  # For daily/weekly tasks
     
+    __table_args__ = (
+        db.Index('ix_user_task_user_task', 'user_id', 'task_id'),
+    )
+    
     def __repr__(self):
         return f'<UserTask {self.task_id} for User {self.user_id}>'
 
@@ -142,6 +203,31 @@ class Building(db.Model):
     def __repr__(self):
         return f'<Building {self.building_type} (Level {self.level}) for GameState {self.game_state_id}>'
 
+class BuildingGroup(db.Model):
+    """All of a player's buildings of one type and level, stored as a single counted row."""
+    id = db.Column(db.Integer, primary_key=True)
+    game_state_id = db.Column(db.Integer, db.ForeignKey('game_state.id'), nullable=False)
+    
+    # Group key
+    building_type = db.Column(db.String(50), nullable=False)  # 'mine', 'studio', 'factory', 'market', 'bank'
+    level = db.Column(db.Integer, nullable=False, default=1)
+    
+    # Number of buildings in the group and the sum of their efficiencies, so the
+    # group produces production_rate * efficiency_total per collection period
+    count = db.Column(db.Integer, nullable=False, default=0)
+    efficiency_total = db.Column(db.Float, nullable=False, default=0.0)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ux_building_group_key', 'game_state_id', 'building_type', 'level', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<BuildingGroup {self.count}x {self.building_type} (Level {self.level}) for GameState {self.game_state_id}>'
+
 class MarketOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     game_state_id = db.Column(db.Integer, db.ForeignKey('game_state.id'), nullable=False)
@@ -169,7 +255,7 @@ class MarketHistory(db.Model):
     
     # Market data
     resource_type = db.Column(db.String(20), nullable=False)  # 'pixels', 'materials', 'gems'
-    avg_price = db.Column(db.Float, nullable=False)
+    avg_price = db.Column(db.Float, nullable=False)  # Volume-weighted average price
     volume = db.Column(db.Integer, nullable=False)  # Total traded volume
     
     # Price changes
@@ -177,9 +263,20 @@ class MarketHistory(db.Model):
     highest_price = db.Column(db.Float, nullable=False)
     lowest_price = db.Column(db.Float, nullable=False)
     
-    # Timestamp
+    # OHLC candle - rows are rolled up per period ('1m', '1h', '1d') from market fills
+    period = db.Column(db.String(3), nullable=True)
+    open_price = db.Column(db.Float, nullable=True)
+    close_price = db.Column(db.Float, nullable=True)
+    trade_count = db.Column(db.Integer, default=0)
+    
+    # Timestamp - the start of the candle's period
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_market_history_resource_timestamp', 'resource_type', 'timestamp'),
+        db.Index('ux_market_history_candle', 'resource_type', 'period', 'timestamp', unique=True),
+    )
+    
     def __repr__(self):
         return f'<MarketHistory {self.resource_type} Avg: {self.avg_price} $PXPT on {self.timestamp}>'
 
@@ -208,6 +305,10 @@ class GameEvent(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     is_active = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        db.Index('ix_game_event_active_window', 'is_active', 'start_time', 'end_time'),
+    )
+    
     def __repr__(self):
         return f'<GameEvent {self.name} ({self.event_type})>'
 
@@ -234,5 +335,54 @@ class MiniGameResult(db.Model):
     # Relationships
     user = db.relationship('User', backref=db.backref('mini_game_results', lazy=True))
     
+    __table_args__ = (
+        db.Index('ix_mini_game_result_user_type_played', 'user_id', 'game_type', 'played_at'),
+    )
+    
     def __repr__(self):
         return f'<MiniGameResult {self.game_type} score={self.score}>'
+
+class MiniGameSession(db.Model):
+    # Started mini-game waiting for the player's answer, shared by all app processes
+    session_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    game_type = db.Column(db.String(50), nullable=False)
+    state = db.Column(db.Text, nullable=False)  # JSON string with the puzzle and its solution
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ux_mini_game_session_player', 'user_id', 'game_type', unique=True),
+        db.Index('ix_mini_game_session_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<MiniGameSession {self.game_type} user={self.user_id}>'
+
+
+@event.listens_for(Session, 'before_flush')
+def bump_game_state_versions(session, flush_context, instances):
+    """
+    Bump GameState.state_version for every player whose state changes in this flush.
+    
+    A player's state also changes when one of their tasks or transactions is written,
+    so those bump the version of the player's GameState if it is loaded in the session.
+    The version is GameState's version_id_col, so a flush fails with StaleDataError
+    when another request changed the player's state after it was loaded.
+    """
+    changed = set()
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, GameState):
+            if obj in session.new or session.is_modified(obj):
+                changed.add(obj)
+        elif isinstance(obj, (UserTask, Transaction)) and obj.user_id is not None:
+            if obj in session.new or session.is_modified(obj):
+                user_ids.add(obj.user_id)
+    
+    if user_ids:
+        for obj in session.identity_map.values():
+            if isinstance(obj, GameState) and obj.user_id in user_ids:
+                changed.add(obj)
+    
+    for game_state in changed:
+        game_state.state_version = (game_state.state_version or 0) + 1
@@ -0,0 +1,94 @@
+"""
+Optimistic concurrency retries for the Pixel Plaza Token game.
+GameState rows are versioned by state_version, so a request that writes a
+player's state after another request changed it fails with StaleDataError
+instead of overwriting it. run_with_retry rolls such a request back and runs
+it again from a fresh load, with a bounded number of jittered retries, and
+counts how often that happens.
+"""
+
+import logging
+import random
+import threading
+import time
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from player_context import forget_player_context
+from config import GAME_STATE_MAX_RETRIES, GAME_STATE_RETRY_BACKOFF_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class RetryStats:
+    """Per-endpoint counts of optimistic concurrency conflicts, for the admin dashboard."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, name, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(name, {'requests': 0, 'conflicts': 0, 'exhausted': 0})
+            counts[outcome] += 1
+
+    def snapshot(self):
+        """
+        Counts per endpoint since the process started.
+
+        Returns:
+            dict mapping endpoint name to its requests, conflicts (retries),
+            exhausted requests (conflicts on every attempt) and retry rate
+            (retries per request)
+        """
+        with self._lock:
+            return {
+                name: dict(counts, retry_rate=round(counts['conflicts'] / counts['requests'], 4)
+                           if counts['requests'] else 0.0)
+                for name, counts in self._counts.items()
+            }
+
+
+retry_stats = RetryStats()
+
+
+def run_with_retry(name, attempt, retry_on=(), max_retries=GAME_STATE_MAX_RETRIES,
+                   backoff_seconds=GAME_STATE_RETRY_BACKOFF_SECONDS):
+    """
+    Run a request's unit of work and commit it, retrying on concurrent modification.
+
+    The attempt must load everything it needs itself; before a retry the
+    transaction is rolled back and the request's cached player contexts are
+    dropped so the next attempt sees the other request's changes.
+
+    Args:
+        name: Endpoint name the retries are counted under
+        attempt: Callable doing the work without committing, returning the response data
+        retry_on: Further exception types that signal a concurrent change
+        max_retries: Retries after the first attempt before giving up
+        backoff_seconds: Base of the exponential backoff; the actual sleep is
+            drawn uniformly up to it (full jitter)
+
+    Returns:
+        The return value of the successful attempt
+
+    Raises:
+        The last conflict if every attempt conflicted, or any other exception
+        raised by the attempt
+    """
+    retryable = (StaleDataError,) + tuple(retry_on)
+    retry_stats.record(name, 'requests')
+    for attempt_number in range(max_retries + 1):
+        try:
+            result = attempt()
+            db.session.commit()
+            return result
+        except retryable as e:
+            db.session.rollback()
+            forget_player_context()
+            if attempt_number == max_retries:
+                retry_stats.record(name, 'exhausted')
+                logger.warning(f"{name}: giving up after {attempt_number + 1} conflicting attempts: {e}")
+                raise
+            retry_stats.record(name, 'conflicts')
+            time.sleep(random.uniform(0, backoff_seconds * 2 ** attempt_number))
@@ -0,0 +1,140 @@
+"""
+Per-request player context for the Pixel Plaza Token game.
+Loads a player's User and GameState (and optionally building groups and tasks) in a
+single round trip and keeps them in an identity cache for the rest of the request.
+"""
+
+import logging
+from flask import g, has_app_context
+from sqlalchemy.orm import contains_eager, joinedload
+
+from models import User, GameState, UserTask
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerContext:
+    """Everything the request handlers need to know about one player."""
+
+    def __init__(self, user, game_state, buildings=None, user_tasks=None):
+        self.user = user
+        self.game_state = game_state
+        self.buildings = buildings
+        self.user_tasks = user_tasks
+
+    @property
+    def tasks_loaded(self):
+        return self.user_tasks is not None
+
+    def __repr__(self):
+        return f'<PlayerContext for User {self.user.id}>'
+
+
+def _context_cache():
+    """Return the per-request cache, or None outside an app context."""
+    if not has_app_context():
+        return None
+    if 'player_contexts' not in g:
+        g.player_contexts = {'by_telegram_id': {}, 'by_user_id': {}}
+    return g.player_contexts
+
+
+def _remember(ctx):
+    cache = _context_cache()
+    if cache is not None:
+        cache['by_telegram_id'][ctx.user.telegram_id] = ctx
+        cache['by_user_id'][ctx.user.id] = ctx
+    return ctx
+
+
+def _open_tasks(user):
+    """Active (user_task, task) pairs from an eagerly loaded user."""
+    return [(ut, ut.task) for ut in user.user_tasks if ut.task is not None and ut.task.is_active]
+
+
+def load_player_context(telegram_id, with_buildings=False, with_tasks=False):
+    """
+    Load a player by Telegram ID together with their game state.
+
+    Args:
+        telegram_id: Telegram ID (or web ID) of the player
+        with_buildings: Also eager-load the player's building groups
+        with_tasks: Also eager-load the player's active tasks
+
+    Returns:
+        PlayerContext or None if the user does not exist. The context's
+        game_state is None if the user has no game state.
+    """
+    cache = _context_cache()
+    ctx = cache['by_telegram_id'].get(telegram_id) if cache is not None else None
+
+    if ctx is None:
+        game_state_loader = contains_eager(User.game_state)
+        if with_buildings:
+            if with_tasks:
+                # Load building groups with an IN query rather than a join, so a player
+                # with many groups and tasks does not multiply the result rows
+                game_state_loader = game_state_loader.selectinload(GameState.building_groups)
+            else:
+                game_state_loader = game_state_loader.joinedload(GameState.building_groups)
+
+        query = User.query.outerjoin(
+            GameState, GameState.user_id == User.id
+        ).options(
+            game_state_loader
+        ).filter(
+            User.telegram_id == telegram_id
+        )
+
+        if with_tasks:
+            query = query.options(joinedload(User.user_tasks).joinedload(UserTask.task))
+
+        user = query.first()
+        if not user:
+            return None
+
+        game_state = user.game_state
+        ctx = PlayerContext(
+            user,
+            game_state,
+            buildings=list(game_state.building_groups) if with_buildings and game_state else None,
+            user_tasks=_open_tasks(user) if with_tasks else None
+        )
+        return _remember(ctx)
+
+    # Cached context: only load the pieces that were not requested before
+    if with_buildings and ctx.buildings is None and ctx.game_state is not None:
+        ctx.buildings = list(ctx.game_state.building_groups)
+    if with_tasks and not ctx.tasks_loaded:
+        ctx.user_tasks = _open_tasks(ctx.user)
+    return ctx
+
+
+def get_cached_context(user_id):
+    """Return the context already loaded for a user ID in this request, if any."""
+    cache = _context_cache()
+    if cache is None:
+        return None
+    return cache['by_user_id'].get(user_id)
+
+
+def get_game_state(user_id):
+    """Get a user's game state, reusing the request's player context when available."""
+    ctx = get_cached_context(user_id)
+    if ctx is not None and ctx.game_state is not None:
+        return ctx.game_state
+    return GameState.query.filter_by(user_id=user_id).first()
+
+
+def forget_player_context(user_id=None):
+    """Drop cached contexts (all of them, or a single user's) from this request."""
+    cache = _context_cache()
+    if cache is None:
+        return
+    if user_id is None:
+        cache['by_telegram_id'].clear()
+        cache['by_user_id'].clear()
+        return
+    ctx = cache['by_user_id'].pop(user_id, None)
+    if ctx is not None:
+        cache['by_telegram_id'].pop(ctx.user.telegram_id, None)
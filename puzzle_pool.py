@@ -0,0 +1,161 @@
+"""
+Pregenerated mini-game puzzles for the Pixel Plaza Token game.
+A background thread keeps a pool of ready puzzles for each pooled game type,
+so starting a game takes a puzzle off the pool instead of generating it in
+the request. An empty pool falls back to generating the puzzle inline.
+"""
+
+import logging
+import threading
+from collections import deque
+
+from config import MINI_GAME_POOL_SIZE, MINI_GAME_POOL_REFILL_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+
+class PuzzlePool:
+    """
+    Process-local pools of generated puzzles, one per game type.
+
+    Each puzzle is handed out once. Taking a puzzle from a pool that has
+    dropped below the refill threshold, or from an empty pool, wakes the
+    refill worker.
+    """
+
+    def __init__(self, size=MINI_GAME_POOL_SIZE, refill_threshold=MINI_GAME_POOL_REFILL_THRESHOLD):
+        self.size = size
+        self.refill_threshold = refill_threshold
+        self._generators = {}
+        self._pools = {}
+        self._hits = {}
+        self._misses = {}
+        self._counter_lock = threading.Lock()
+        self._refill_needed = threading.Event()
+
+    def register(self, game_type, generator):
+        """
+        Pool the puzzles of a game type.
+
+        Args:
+            game_type: Mini-game type
+            generator: Function without arguments returning a new puzzle
+        """
+        self._generators[game_type] = generator
+        self._pools.setdefault(game_type, deque())
+        self._hits.setdefault(game_type, 0)
+        self._misses.setdefault(game_type, 0)
+        self._refill_needed.set()
+
+    def is_pooled(self, game_type):
+        return game_type in self._generators
+
+    def take(self, game_type):
+        """
+        Take a ready puzzle, generating one inline if the pool is empty.
+
+        Args:
+            game_type: A registered mini-game type
+
+        Returns:
+            Puzzle as returned by the game type's generator
+        """
+        pool = self._pools[game_type]
+        try:
+            puzzle = pool.popleft()
+        except IndexError:
+            with self._counter_lock:
+                self._misses[game_type] += 1
+            self._refill_needed.set()
+            return self._generators[game_type]()
+
+        with self._counter_lock:
+            self._hits[game_type] += 1
+        if len(pool) < self.refill_threshold:
+            self._refill_needed.set()
+        return puzzle
+
+    def refill(self):
+        """
+        Fill every pool up to its size.
+
+        Returns:
+            Number of puzzles generated
+        """
+        generated = 0
+        for game_type, generator in list(self._generators.items()):
+            pool = self._pools[game_type]
+            while len(pool) < self.size:
+                pool.append(generator())
+                generated += 1
+        return generated
+
+    def wait_for_refill(self, timeout=None):
+        """Block until a pool asks for a refill; returns False on timeout."""
+        requested = self._refill_needed.wait(timeout)
+        self._refill_needed.clear()
+        return requested
+
+    def stats(self):
+        """
+        Get the pool levels and counters.
+
+        Returns:
+            dict mapping game type to available puzzles, hits and misses
+        """
+        with self._counter_lock:
+            return {
+                game_type: {
+                    'available': len(self._pools[game_type]),
+                    'hits': self._hits[game_type],
+                    'misses': self._misses[game_type]
+                }
+                for game_type in self._generators
+            }
+
+
+puzzle_pool = PuzzlePool()
+
+
+class PuzzlePoolRefiller(threading.Thread):
+    """Daemon thread refilling the puzzle pools when they run low."""
+
+    def __init__(self, pool):
+        super().__init__(name='puzzle-pool-refiller', daemon=True)
+        self.pool = pool
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.pool._refill_needed.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                generated = self.pool.refill()
+                if generated:
+                    logger.debug(f"Puzzle pools refilled with {generated} puzzles")
+            except Exception as e:
+                logger.error(f"Error refilling puzzle pools: {str(e)}")
+            self.pool.wait_for_refill()
+
+
+_refiller = None
+_refiller_lock = threading.Lock()
+
+
+def start_puzzle_pool_refiller(pool=puzzle_pool):
+    """
+    Start the refill worker for this process if it is not running yet.
+
+    Returns:
+        The running PuzzlePoolRefiller
+    """
+    global _refiller
+
+    with _refiller_lock:
+        if _refiller is None or not _refiller.is_alive():
+            _refiller = PuzzlePoolRefiller(pool)
+            _refiller.start()
+            logger.info("Puzzle pool refiller started")
+        return _refiller
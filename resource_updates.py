@@ -0,0 +1,141 @@
+"""
+Atomic resource updates for the Pixel Plaza Token game.
+Balances, resources and experience are changed with a single
+UPDATE game_state_hot SET column = column + :delta ... RETURNING statement whose
+WHERE clause also checks the player can afford what is spent. Two requests from
+the same player (a double tap, the bot and the web app) can no longer overwrite
+each other's changes, and no row lock is held while Python code runs.
+"""
+
+import logging
+from sqlalchemy import update, select, case, and_
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from models import game_state_hot_table
+from leaderboard import record_balance
+
+logger = logging.getLogger(__name__)
+
+# Columns that may be changed through apply_resources
+RESOURCE_COLUMNS = (
+    'token_balance', 'pixels', 'energy', 'materials', 'gems',
+    'experience', 'pixel_art_created', 'market_transactions'
+)
+
+# Columns read back into the game state after every update
+RETURNED_COLUMNS = RESOURCE_COLUMNS + ('state_version',)
+
+
+def apply_resources(game_state, deltas, require=None, caps=None):
+    """
+    Atomically add to a player's resources.
+
+    Negative deltas are spends: the update only happens if every spent column
+    holds at least the amount spent, so a balance can not go negative. The new
+    values are read back into game_state without marking it dirty, and the
+    player's state version is bumped in the same statement. Like an ORM flush,
+    the update only applies to the state version that was loaded.
+
+    Args:
+        game_state: GameState model instance to update
+        deltas: dict mapping columns of RESOURCE_COLUMNS to the amount to add
+        require: Optional dict mapping columns to the minimum value they must
+            hold before the update
+        caps: Optional dict mapping columns to the maximum value they may hold
+            after the update (e.g. energy refills)
+
+    Returns:
+        dict of the updated column values, or None if a guard failed and
+        nothing was changed
+
+    Raises:
+        StaleDataError: if another request changed the player's state since it
+            was loaded
+    """
+    hot = game_state_hot_table
+    deltas = {column: amount for column, amount in deltas.items() if amount}
+    caps = caps or {}
+    minimums = dict(require or {})
+    for column, amount in deltas.items():
+        if column not in RESOURCE_COLUMNS:
+            raise ValueError(f"Unknown resource column: {column}")
+        if amount < 0:
+            minimums[column] = max(minimums.get(column, 0), -amount)
+
+    values = {}
+    for column, amount in deltas.items():
+        new_value = hot.c[column] + amount
+        if column in caps:
+            # Never lower a value that is already above the cap
+            new_value = case(
+                (new_value <= caps[column], new_value),
+                (hot.c[column] > caps[column], hot.c[column]),
+                else_=caps[column]
+            )
+        values[column] = new_value
+    values['state_version'] = hot.c.state_version + 1
+
+    # Write pending ORM changes (e.g. a new game state) before the update
+    db.session.flush()
+
+    expected_version = game_state.state_version
+    conditions = [hot.c.game_state_id == game_state.id, hot.c.state_version == expected_version]
+    conditions.extend(hot.c[column] >= minimum for column, minimum in minimums.items())
+    stmt = update(hot).where(and_(*conditions)).values(**values)
+
+    if db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(
+            stmt.returning(*(hot.c[column] for column in RETURNED_COLUMNS))
+        ).first()
+    else:
+        # Databases without UPDATE ... RETURNING: read the row back in the same transaction
+        row = _read_back(game_state) if db.session.execute(stmt).rowcount else None
+
+    if row is None:
+        current = _read_back(game_state)
+        if current is None or current[-1] != expected_version:
+            raise StaleDataError(
+                f"GameState {game_state.id} was changed concurrently "
+                f"(expected version {expected_version})"
+            )
+        # Show the caller the values that made the guard fail
+        for column, value in zip(RETURNED_COLUMNS, current):
+            set_committed_value(game_state, column, value)
+        return None
+
+    updated = dict(zip(RETURNED_COLUMNS, row))
+    for column, value in updated.items():
+        set_committed_value(game_state, column, value)
+    if 'token_balance' in deltas:
+        record_balance(db.session, game_state.user_id, updated['token_balance'])
+    return updated
+
+
+def _read_back(game_state):
+    hot = game_state_hot_table
+    return db.session.execute(
+        select(*(hot.c[column] for column in RETURNED_COLUMNS)).where(
+            hot.c.game_state_id == game_state.id
+        )
+    ).first()
+
+
+def apply_level_up(game_state, xp_per_level):
+    """
+    Level the player up if they have enough experience for their level.
+
+    The experience is spent atomically, so concurrent requests can not both
+    use the same experience to level up.
+
+    Returns:
+        Boolean: True if the player leveled up
+    """
+    xp_needed = game_state.level * xp_per_level
+    if game_state.experience < xp_needed:
+        return False
+    if apply_resources(game_state, {'experience': -xp_needed}) is None:
+        return False
+    game_state.level += 1
+    return True
@@ -0,0 +1,304 @@
+"""
+Set-based task progress engine for the Pixel Plaza Token game.
+Keeps the active task catalog in memory, indexed by objective type, and applies
+progress and completion to a player's tasks with a fixed number of UPDATE
+statements no matter how many tasks match. Daily and weekly resets are applied
+to all players at once by the scheduled job in task_scheduler.py.
+"""
+
+import logging
+import threading
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, select, update, case, func, literal, or_, and_
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Task, UserTask, game_state_table, game_state_hot_table
+from player_context import get_game_state
+from config import TASK_CATALOG_TTL_SECONDS, TASK_RESET_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class CachedTask:
+    """Read-only copy of an active Task that can outlive the session it was loaded in."""
+
+    __slots__ = (
+        'id', 'name', 'description', 'task_type', 'objective_type', 'objective_value',
+        'token_reward', 'pixel_reward', 'experience_reward'
+    )
+
+    def __init__(self, task):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(task, attr))
+
+    def __repr__(self):
+        return f'<CachedTask {self.name}>'
+
+
+class TaskCatalog:
+    """
+    Process-local catalog of the active tasks.
+
+    Reloaded when the TTL runs out and after any commit that writes a Task.
+    """
+
+    def __init__(self, ttl_seconds=TASK_CATALOG_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_objective = {}
+        self._version = 0
+        self._expires_at = None
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._expires_at = None
+
+    def _ensure_fresh(self):
+        now = datetime.utcnow()
+        with self._lock:
+            if self._expires_at is not None and now < self._expires_at:
+                return
+
+            tasks = [CachedTask(t) for t in Task.query.filter_by(is_active=True).order_by(Task.id).all()]
+            by_objective = {}
+            for task in tasks:
+                by_objective.setdefault(task.objective_type, []).append(task)
+
+            self._by_id = {task.id: task for task in tasks}
+            self._by_objective = {objective: tuple(items) for objective, items in by_objective.items()}
+            # Identifies the set of active tasks; players assigned from an older
+            # version may be missing rows for newly added tasks
+            # (masked to 31 bits to fit a signed INTEGER column)
+            self._version = (zlib.crc32(','.join(str(task.id) for task in tasks).encode()) & 0x7FFFFFFF) or 1
+            self._expires_at = now + timedelta(seconds=self.ttl_seconds)
+
+    def all(self):
+        """All active tasks, ordered by ID."""
+        self._ensure_fresh()
+        return tuple(self._by_id.values())
+
+    @property
+    def version(self):
+        """Checksum of the active task IDs, never 0."""
+        self._ensure_fresh()
+        return self._version
+
+    def get(self, task_id):
+        """An active task by ID, or None."""
+        self._ensure_fresh()
+        return self._by_id.get(task_id)
+
+    def for_objective(self, objective_type):
+        """Active tasks advanced by an objective type."""
+        self._ensure_fresh()
+        return self._by_objective.get(objective_type, ())
+
+
+task_catalog = TaskCatalog()
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_task_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Task):
+            session.info['tasks_changed'] = True
+            break
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_task_catalog(session):
+    if session.info.pop('tasks_changed', False):
+        task_catalog.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_task_writes(session):
+    session.info.pop('tasks_changed', None)
+
+
+def reset_boundaries(now=None):
+    """
+    Start of the current daily and weekly task periods.
+
+    Returns:
+        Tuple of (day_start, week_start); weeks start on Monday
+    """
+    now = now or datetime.utcnow()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = day_start - timedelta(days=now.weekday())
+    return day_start, week_start
+
+
+def _reset_condition(tasks, now):
+    """WHERE clause matching user tasks whose daily or weekly period has rolled over."""
+    day_start, week_start = reset_boundaries(now)
+    daily_ids = [task.id for task in tasks if task.task_type == 'daily']
+    weekly_ids = [task.id for task in tasks if task.task_type == 'weekly']
+
+    conditions = []
+    if daily_ids:
+        conditions.append(and_(UserTask.task_id.in_(daily_ids), UserTask.last_reset < day_start))
+    if weekly_ids:
+        conditions.append(and_(UserTask.task_id.in_(weekly_ids), UserTask.last_reset < week_start))
+    if not conditions:
+        return None
+    return or_(*conditions)
+
+
+def _execute_update(stmt):
+    """Run an ORM UPDATE and refresh the affected UserTask objects already in the session."""
+    return db.session.execute(
+        stmt.returning(UserTask),
+        execution_options={'synchronize_session': False, 'populate_existing': True}
+    ).scalars().all()
+
+
+def reset_rolled_over_tasks(now=None, batch_size=TASK_RESET_BATCH_SIZE):
+    """
+    Reset every player's daily and weekly tasks whose period has rolled over.
+
+    Runs one UPDATE per range of batch_size UserTask IDs and commits after each
+    one, so no single statement locks the whole table. Rows already reset for
+    the current period are not matched, which makes the job safe to repeat.
+    The state version of every player with a reset task is bumped in the same
+    transaction, so delta responses do not keep showing the old progress.
+
+    Args:
+        now: Optional current time
+        batch_size: Number of UserTask IDs covered by each UPDATE
+
+    Returns:
+        Number of user tasks reset
+    """
+    now = now or datetime.utcnow()
+    condition = _reset_condition(task_catalog.all(), now)
+    if condition is None:
+        return 0
+
+    first_id, last_id = db.session.query(
+        func.min(UserTask.id), func.max(UserTask.id)
+    ).filter(condition).one()
+    if first_id is None:
+        return 0
+
+    hot = game_state_hot_table
+    total = 0
+    for batch_start in range(first_id, last_id + 1, batch_size):
+        in_batch = and_(
+            UserTask.id >= batch_start,
+            UserTask.id < batch_start + batch_size,
+            condition
+        )
+        # Bump the owners' state versions first, while the rows still match, so
+        # clients holding the previous version get the reset tasks in their next delta
+        db.session.execute(
+            update(hot).where(
+                hot.c.game_state_id.in_(
+                    select(game_state_table.c.id).where(
+                        game_state_table.c.user_id.in_(select(UserTask.user_id).where(in_batch))
+                    )
+                )
+            ).values(state_version=hot.c.state_version + 1)
+        )
+        result = db.session.execute(
+            update(UserTask).where(in_batch).values(
+                current_progress=0,
+                completed=False,
+                last_reset=now
+            ),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        total += result.rowcount
+
+    return total
+
+
+def assign_missing_tasks(user_id, now=None):
+    """
+    Insert UserTask rows for the active tasks a player does not have yet.
+
+    Uses a single INSERT ... SELECT that skips tasks the player already has.
+
+    Args:
+        user_id: User ID
+        now: Optional current time, used as the rows' last reset
+
+    Returns:
+        Number of UserTask rows inserted
+    """
+    now = now or datetime.utcnow()
+    task_ids = [task.id for task in task_catalog.all()]
+    if not task_ids:
+        return 0
+
+    already_assigned = select(UserTask.id).where(
+        UserTask.user_id == user_id,
+        UserTask.task_id == Task.id
+    ).exists()
+    missing = select(
+        literal(user_id), Task.id, literal(0), literal(False), literal(now)
+    ).where(
+        Task.id.in_(task_ids),
+        ~already_assigned
+    )
+
+    result = db.session.execute(
+        insert(UserTask).from_select(
+            ['user_id', 'task_id', 'current_progress', 'completed', 'last_reset'],
+            missing
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount
+
+
+def apply_progress(user_id, objective_type, increment=1):
+    """
+    Advance a player's tasks for an objective type.
+
+    Runs a single UPDATE adding the increment and setting completion flags.
+    Newly completed tasks are counted on the player's GameState. Nothing is
+    committed.
+
+    Args:
+        user_id: User ID
+        objective_type: Objective type advanced by the action
+        increment: Amount of progress to add
+
+    Returns:
+        List of CachedTask instances completed by this update
+    """
+    tasks = task_catalog.for_objective(objective_type)
+    if not tasks:
+        return []
+
+    now = datetime.utcnow()
+    objective_values = {task.id: task.objective_value for task in tasks}
+    new_progress = UserTask.current_progress + increment
+    reaches_objective = new_progress >= case(objective_values, value=UserTask.task_id)
+
+    updated = _execute_update(
+        update(UserTask).where(
+            UserTask.user_id == user_id,
+            UserTask.task_id.in_(list(objective_values)),
+            or_(UserTask.completed == False, UserTask.completed.is_(None))
+        ).values(
+            current_progress=new_progress,
+            completed=reaches_objective,
+            completed_at=case((reaches_objective, now), else_=UserTask.completed_at)
+        )
+    )
+
+    completed = [task_catalog.get(user_task.task_id) for user_task in updated if user_task.completed]
+    if completed:
+        # Record task completions in game state
+        game_state = get_game_state(user_id)
+        if game_state:
+            game_state.tasks_completed = (game_state.tasks_completed or 0) + len(completed)
+
+    return completed
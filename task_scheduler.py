@@ -0,0 +1,78 @@
+"""
+Scheduled daily and weekly task resets for the Pixel Plaza Token game.
+A background thread resets every player's rolled-over tasks once right after
+startup (catching up on any boundary missed while the app was down) and then
+again shortly after each midnight UTC, Mondays included for weekly tasks.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from app import db
+from task_engine import reset_rolled_over_tasks
+from config import TASK_RESET_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def seconds_until_next_reset(now=None):
+    """Seconds from now until the next midnight UTC plus the grace delay."""
+    now = now or datetime.utcnow()
+    next_day = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return (next_day - now).total_seconds() + TASK_RESET_GRACE_SECONDS
+
+
+class TaskResetScheduler(threading.Thread):
+    """Daemon thread running the bulk task reset at each day boundary."""
+
+    def __init__(self, flask_app):
+        super().__init__(name='task-reset-scheduler', daemon=True)
+        self.flask_app = flask_app
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run_once(self):
+        """Run the bulk reset now; safe to call from any process or thread."""
+        with self.flask_app.app_context():
+            try:
+                reset = reset_rolled_over_tasks()
+                logger.info(f"Scheduled task reset complete: {reset} user tasks reset")
+                return reset
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error during scheduled task reset: {str(e)}")
+                return 0
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(seconds_until_next_reset())
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_task_reset_scheduler(flask_app):
+    """
+    Start the reset scheduler for this process if it is not running yet.
+
+    Every web worker may start one; the reset only matches rows that have not
+    been reset for the current period, so concurrent runs do no extra work.
+
+    Returns:
+        The running TaskResetScheduler
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = TaskResetScheduler(flask_app)
+            _scheduler.start()
+            logger.info("Task reset scheduler started")
+        return _scheduler
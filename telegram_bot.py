@@ -11,6 +11,7 @@ from config import (
     MINING_REWARD, BUILDING_COST, BUILDING_INCOME, PIXEL_ART_COST, PIXEL_ART_REWARD
 )
 from game_mechanics import GameMechanics
+from leaderboard import leaderboard as token_leaderboard
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -535,13 +536,7 @@ async def collect_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show token leaderboard."""
     # Get top 10 users by token balance
-    top_users = db.session.query(
-        User, GameState
-    ).join(
-        GameState, User.id == GameState.user_id
-    ).order_by(
-        GameState.token_balance.desc()
-    ).limit(10).all()
+    top_users = token_leaderboard.top_players(10)
     
     if not top_users:
         await update.message.reply_text("No users found in the leaderboard yet.")
@@ -553,6 +548,14 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         medal = "🥇" if i == 0 else "🥈" if i == 1 else "🥉" if i == 2 else f"{i+1}."
         leaderboard_text += f"{medal} {user.username}: {game_state.token_balance:.2f} $PXPT (Level {game_state.level})\n"
     
+    # Show the caller's own rank
+    telegram_id = str(update.effective_user.id)
+    user = User.query.filter_by(telegram_id=telegram_id).first()
+    if user:
+        rank = token_leaderboard.rank(user.id)
+        if rank:
+            leaderboard_text += f"\nYour rank: #{rank} of {token_leaderboard.size()}\n"
+    
     # Add a note about web dashboard
     leaderboard_text += "\nView the full leaderboard on the web dashboard: /dashboard"
     
@@ -2,15 +2,22 @@
 Utility functions for the Pixel Plaza Token game.
 """
 
-import random
+import hmac
+import hashlib
 import string
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from sqlalchemy import update
 
 from app import db
 from models import User, GameState, Transaction, Task, UserTask
+from player_context import get_cached_context, get_game_state
+from resource_updates import apply_resources
+from task_engine import task_catalog, apply_progress, assign_missing_tasks
 from config import (
     REFERRAL_CODE_LENGTH, REFERRER_BONUS, REFEREE_BONUS, 
+    REFERRER_LEVEL_REQUIREMENT, REFERRAL_CODE_SECRET, REFERRAL_BACKFILL_BATCH_SIZE,
     DEFAULT_TASKS
 )
 
@@ -18,15 +25,97 @@ from config import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_referral_code(length=REFERRAL_CODE_LENGTH):
-    """Generate a unique referral code."""
-    chars = string.ascii_uppercase + string.digits
+REFERRAL_CODE_ALPHABET = string.ascii_uppercase + string.digits
+REFERRAL_FEISTEL_ROUNDS = 6
+
+def _referral_code_domain(length):
+    """Size of the code space and the (even) bit width of the Feistel network covering it."""
+    domain = len(REFERRAL_CODE_ALPHABET) ** length
+    bits = max(2, (domain - 1).bit_length())
+    bits += bits % 2
+    return domain, bits
+
+def _feistel_permute(value, bits, key):
+    """Keyed permutation of the integers [0, 2**bits) using a balanced Feistel network."""
+    half_bits = bits // 2
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for round_index in range(REFERRAL_FEISTEL_ROUNDS):
+        digest = hmac.new(key, f'{round_index}:{right}'.encode(), hashlib.sha256).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:8], 'big') & mask)
+    return (left << half_bits) | right
+
+def referral_code_for_id(user_id, length=REFERRAL_CODE_LENGTH, secret=REFERRAL_CODE_SECRET):
+    """
+    Derive a user's referral code from their user ID.
+    
+    The ID goes through a keyed permutation of the code space, cycle-walking
+    until the result falls inside it, so distinct IDs always give distinct codes
+    and consecutive IDs give unrelated ones.
+    
+    Args:
+        user_id: User ID (must be smaller than the number of possible codes)
+        length: Number of characters in the code
+        secret: Permutation key
+        
+    Returns:
+        String referral code
+    """
+    domain, bits = _referral_code_domain(length)
+    if not 0 <= user_id < domain:
+        raise ValueError(f"User ID {user_id} does not fit in a {length}-character referral code")
+    
+    key = secret.encode() if isinstance(secret, str) else secret
+    value = _feistel_permute(user_id, bits, key)
+    while value >= domain:
+        value = _feistel_permute(value, bits, key)
+    
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, len(REFERRAL_CODE_ALPHABET))
+        chars.append(REFERRAL_CODE_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+def generate_referral_code(user_id, length=REFERRAL_CODE_LENGTH):
+    """
+    Generate a unique referral code for a user.
+    No uniqueness query is needed: codes are a permutation of user IDs.
+    """
+    return referral_code_for_id(user_id, length)
+
+def backfill_referral_codes(min_level=REFERRER_LEVEL_REQUIREMENT, batch_size=REFERRAL_BACKFILL_BATCH_SIZE):
+    """
+    Give a referral code to every user at or above a level who does not have one.
+    Commits after each batch.
+    
+    Returns:
+        Number of users updated
+    """
+    total = 0
+    last_id = 0
     while True:
-        code = ''.join(random.choice(chars) for _ in range(length))
-        # Check if code already exists
-        existing = User.query.filter_by(referral_code=code).first()
-        if not existing:
-            return code
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).join(
+            GameState, GameState.user_id == User.id
+        ).filter(
+            User.id > last_id,
+            User.referral_code.is_(None),
+            GameState.level >= min_level
+        ).order_by(User.id).limit(batch_size).all()]
+        if not user_ids:
+            break
+        
+        # ORM bulk UPDATE by primary key, sent as one executemany
+        db.session.execute(
+            update(User),
+            [{'id': user_id, 'referral_code': referral_code_for_id(user_id)} for user_id in user_ids]
+        )
+        db.session.commit()
+        
+        total += len(user_ids)
+        last_id = user_ids[-1]
+        logger.info(f"Backfilled referral codes for {total} users")
+    
+    return total
 
 def process_referral(referrer_id, referee):
     """Process a referral and award bonuses."""
@@ -38,16 +127,16 @@ def process_referral(referrer_id, referee):
             return False
         
         # Get game states
-        referrer_game_state = GameState.query.filter_by(user_id=referrer.id).first()
-        referee_game_state = GameState.query.filter_by(user_id=referee.id).first()
+        referrer_game_state = get_game_state(referrer.id)
+        referee_game_state = get_game_state(referee.id)
         
         if not referrer_game_state or not referee_game_state:
             logger.error("Game state not found for referrer or referee")
             return False
         
         # Award bonuses
-        referrer_game_state.token_balance += REFERRER_BONUS
-        referee_game_state.token_balance += REFEREE_BONUS
+        apply_resources(referrer_game_state, {'token_balance': REFERRER_BONUS})
+        apply_resources(referee_game_state, {'token_balance': REFEREE_BONUS})
         
         # Increment referral count
         referrer_game_state.referral_count += 1
@@ -114,107 +203,68 @@ def initialize_tasks():
         logger.error(f"Error initializing tasks: {str(e)}")
 
 def assign_tasks_to_user(user_id):
-    """Assign all active tasks to a user if they don't already have them."""
+    """
+    Assign all active tasks to a user if they don't already have them.
+    Skipped when the user was already assigned from the current task catalog;
+    otherwise missing rows are inserted in one statement. Nothing is committed.
+    """
     try:
-        # Get all active tasks
-        active_tasks = Task.query.filter_by(is_active=True).all()
+        catalog_version = task_catalog.version
+        game_state = get_game_state(user_id)
+        if game_state is not None and game_state.task_catalog_version == catalog_version:
+            return 0
         
-        # Check which tasks the user already has
-        existing_user_tasks = UserTask.query.filter_by(user_id=user_id).all()
-        existing_task_ids = [ut.task_id for ut in existing_user_tasks]
+        assigned = assign_missing_tasks(user_id)
+        if game_state is not None:
+            game_state.task_catalog_version = catalog_version
         
-        # Assign missing tasks
-        for task in active_tasks:
-            if task.id not in existing_task_ids:
-                user_task = UserTask(
-                    user_id=user_id,
-                    task_id=task.id,
-                    current_progress=0,
-                    completed=False,
-                    last_reset=datetime.utcnow()
-                )
-                db.session.add(user_task)
-        
-        db.session.commit()
-        logger.info(f"Tasks assigned to user {user_id}")
+        if assigned:
+            # The bulk insert bypasses the ORM, so reload the user's task list on next access
+            ctx = get_cached_context(user_id)
+            if ctx is not None:
+                db.session.expire(ctx.user, ['user_tasks'])
+            logger.info(f"{assigned} tasks assigned to user {user_id}")
+        return assigned
         
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error assigning tasks to user {user_id}: {str(e)}")
+        raise
 
 def update_task_progress(user_id, objective_type, increment=1):
-    """Update progress for tasks with the given objective type."""
+    """
+    Update progress for tasks with the given objective type.
+    Runs as set-based UPDATEs through the task engine; nothing is committed.
+    
+    Returns:
+        List of tasks completed by this update
+    """
     try:
-        # Get user's tasks for this objective type
-        user_tasks = UserTask.query.join(Task).filter(
-            UserTask.user_id == user_id,
-            Task.objective_type == objective_type,
-            Task.is_active == True
-        ).all()
-        
-        # Update each matching task
-        for user_task in user_tasks:
-            task = Task.query.get(user_task.task_id)
-            
-            # Check if daily/weekly tasks need to be reset
-            if should_reset_task(user_task, task):
-                user_task.current_progress = 0
-                user_task.completed = False
-                user_task.last_reset = datetime.utcnow()
-            
-            # Only update if task is not already completed
-            if not user_task.completed:
-                user_task.current_progress += increment
-                
-                # Check if task is now completed
-                if user_task.current_progress >= task.objective_value:
-                    user_task.completed = True
-                    user_task.completed_at = datetime.utcnow()
-                    
-                    # Record task completion in game state
-                    game_state = GameState.query.filter_by(user_id=user_id).first()
-                    if game_state:
-                        game_state.tasks_completed += 1
-        
-        db.session.commit()
+        completed = apply_progress(user_id, objective_type, increment)
         logger.info(f"Updated {objective_type} task progress for user {user_id}")
+        return completed
         
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error updating task progress: {str(e)}")
-
-def should_reset_task(user_task, task):
-    """Check if a daily or weekly task should be reset based on its last reset time."""
-    now = datetime.utcnow()
-    
-    if task.task_type == 'daily':
-        # Check if last reset was on a previous day
-        yesterday = now - timedelta(days=1)
-        return user_task.last_reset.date() <= yesterday.date()
-        
-    elif task.task_type == 'weekly':
-        # Check if last reset was in a previous week
-        # Reset on Monday (weekday 0)
-        days_since_monday = (now.weekday() - 0) % 7
-        last_monday = now - timedelta(days=days_since_monday)
-        last_monday = last_monday.replace(hour=0, minute=0, second=0, microsecond=0)
-        return user_task.last_reset < last_monday
-    
-    return False
+        raise
 
 def complete_task(user_id, user_task, task):
-    """Process task completion and award rewards."""
+    """
+    Process task completion and award rewards.
+    Does not commit.
+    """
     try:
         # Get user's game state
-        game_state = GameState.query.filter_by(user_id=user_id).first()
+        game_state = get_game_state(user_id)
         if not game_state:
             logger.error(f"Game state not found for user {user_id}")
             return False
         
         # Update game state with rewards
-        game_state.token_balance += task.token_reward
-        game_state.pixels += task.pixel_reward
-        game_state.experience += task.experience_reward
+        apply_resources(game_state, {
+            'token_balance': task.token_reward,
+            'pixels': task.pixel_reward,
+            'experience': task.experience_reward
+        })
         
         # Record transaction
         transaction = Transaction(
@@ -231,42 +281,43 @@ def complete_task(user_id, user_task, task):
             user_task.current_progress = 0
             user_task.last_reset = datetime.utcnow()
         
-        db.session.commit()
+        db.session.flush()
         logger.info(f"Task {task.name} completed for user {user_id}")
         return True
         
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error completing task: {str(e)}")
-        return False
+        raise
 
 def get_user_tasks(user_id):
-    """Get all tasks for a user with their progress."""
+    """
+    Get all tasks for a user with their progress.
+    Assignments are flushed but not committed; daily and weekly resets are
+    applied by the scheduled reset job.
+    """
     try:
         # Assign any missing tasks to the user
-        assign_tasks_to_user(user_id)
+        assigned = assign_tasks_to_user(user_id)
         
-        # Get all user tasks with their task info
-        user_tasks = db.session.query(
-            UserTask, Task
-        ).join(
-            Task, UserTask.task_id == Task.id
-        ).filter(
-            UserTask.user_id == user_id,
-            Task.is_active == True
-        ).all()
-        
-        # Reset any tasks that need it
-        for user_task, task in user_tasks:
-            if should_reset_task(user_task, task):
-                user_task.current_progress = 0
-                user_task.completed = False
-                user_task.last_reset = datetime.utcnow()
-        
-        db.session.commit()
+        # Reuse the tasks loaded with the player context unless new ones were assigned
+        ctx = get_cached_context(user_id)
+        if ctx is not None and ctx.tasks_loaded and not assigned:
+            user_tasks = ctx.user_tasks
+        else:
+            # Get all user tasks with their task info
+            user_tasks = db.session.query(
+                UserTask, Task
+            ).join(
+                Task, UserTask.task_id == Task.id
+            ).filter(
+                UserTask.user_id == user_id,
+                Task.is_active == True
+            ).all()
+            if ctx is not None:
+                ctx.user_tasks = [(user_task, task) for user_task, task in user_tasks]
         
         return user_tasks
         
     except Exception as e:
-        logger.error(f"Error getting user tasks: {str(e)}")
-        return []
\ No newline at end of file
+        logger.error(f"Error getting user tasks for user {user_id}: {str(e)}")
+        raise
\ No newline at end of file